@@ -0,0 +1,65 @@
+# ボットだけのルームを大量に作って最後まで打たせ、bot_turns の1バッチ（run() 1回）にかかる時間を計測する。
+# ASGI モードではバッチの合間にしかイベントループへ戻らないので、最長のバッチがプレーヤーの操作を
+# 待たせる時間の上限になる（ASGI モードのバッチサイズは BOT_ASYNC_BATCH_SIZE）。
+# 方針表の1回の参照にかかる時間も示す。
+#
+#   python benchmarks/bench_bots.py [ルーム数] [バッチサイズ]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from card_game import bot_policy, bot_turns, game_rooms
+
+
+def build_rooms(count):
+    for n in range(count):
+        with game_rooms.locked(f"B{n}", create=True) as room:
+            for seat in range(room.max_players):
+                room.add_player(f"bot-{n}-{seat}", f"bot{seat}", None, bot=True)
+            room.start_game()
+            room.discard_all_pairs()
+
+
+def main():
+    import logging
+    logging.disable(logging.INFO)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    if len(sys.argv) > 2:
+        bot_turns.batch_size = int(sys.argv[2])
+
+    start = time.perf_counter()
+    bot_policy.build()
+    print(f"policy table        : {time.perf_counter() - start:10.2f} s to build")
+    rng = random.Random(0)
+    calls = 1000000
+    start = time.perf_counter()
+    for n in range(calls):
+        bot_policy.choose(n % 14 + 1, rng)
+    print(f"policy lookup       : {(time.perf_counter() - start) / calls * 1e6:10.2f} us")
+
+    start = time.perf_counter()
+    build_rooms(count)
+    print(f"rooms: {count}  bot turns queued: {len(bot_turns)}  (built in {time.perf_counter() - start:.1f}s)")
+
+    # 待ち時間を飛ばして、待ち行列が空になるまで run() を繰り返す
+    batches = []
+    start = time.perf_counter()
+    while len(bot_turns):
+        batch_start = time.perf_counter()
+        played = bot_turns.run(time.time() + bot_turns.delay)
+        batches.append((time.perf_counter() - batch_start, played))
+    elapsed = time.perf_counter() - start
+    print(f"bot turns played    : {bot_turns.turns:10d}  in {elapsed:.1f}s "
+          f"({elapsed / bot_turns.turns * 1e6:.1f} us/turn)")
+    print(f"batch size          : {bot_turns.batch_size:10d}  batches: {len(batches)}")
+    print(f"longest batch       : {max(seconds for seconds, _ in batches) * 1000:10.2f} ms")
+    unfinished = sum(1 for _, room in game_rooms.items() if room.game_phase != 'finished')
+    print(f"unfinished rooms    : {unfinished:10d}")
+
+
+if __name__ == '__main__':
+    main()
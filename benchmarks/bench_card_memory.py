@@ -0,0 +1,79 @@
+# ルーム1つあたりのメモリ使用量を、旧 Card 実装（毎回53枚を生成）と
+# 共有テーブル CARDS を使う現行実装で比較する。
+#
+#   python benchmarks/bench_card_memory.py [ルーム数]
+import os
+import sys
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_logic import GameRoom
+
+
+class LegacyCard:
+    def __init__(self, value, suit, is_joker=False):
+        self.value = value
+        self.suit = suit
+        self.is_joker = is_joker
+        self.suits = ["♠", "♥", "♦", "♣"]
+        self.values = [None, None, "2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K", "A"]
+
+
+def legacy_create_deck(self):
+    deck = []
+    for value in range(2, 15):
+        for suit in range(4):
+            deck.append(LegacyCard(value, suit))
+    deck.append(LegacyCard(0, 0, True))
+    for i in range(len(deck)):
+        j = random.randint(0, len(deck) - 1)
+        deck[i], deck[j] = deck[j], deck[i]
+    return deck
+
+
+def build_rooms(count):
+    rooms = []
+    for n in range(count):
+        room = GameRoom(f"R{n}")
+        for i in range(3):
+            room.add_player(f"p{i}", f"player{i}", f"sid{i}")
+        room.start_game()
+        rooms.append(room)
+    return rooms
+
+
+def measure(count):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    rooms = build_rooms(count)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del rooms
+    return total / count
+
+
+def main():
+    import logging
+    logging.disable(logging.INFO)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    current = measure(count)
+
+    original = GameRoom.create_deck
+    GameRoom.create_deck = legacy_create_deck
+    try:
+        legacy = measure(count)
+    finally:
+        GameRoom.create_deck = original
+
+    print(f"rooms: {count}")
+    print(f"legacy : {legacy:10.0f} bytes/room")
+    print(f"current: {current:10.0f} bytes/room")
+    print(f"saved  : {legacy - current:10.0f} bytes/room ({(1 - current / legacy) * 100:.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
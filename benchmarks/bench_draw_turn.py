@@ -0,0 +1,92 @@
+# 1ターン（カードを1枚引いてペアを削除する）あたりの処理時間を、
+# 旧実装（毎回手札全体を再走査）と Hand のランク索引による実装で比較する。
+#
+#   python benchmarks/bench_draw_turn.py [ゲーム数]
+import os
+import sys
+import random
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_logic import CARDS, Hand
+
+
+def legacy_discard_pairs(hand):
+    new_hand = []
+    card_groups = {}
+    pairs_count = 0
+    for card in hand:
+        if card.is_joker:
+            new_hand.append(card)
+        else:
+            value = card.get_value()
+            if value not in card_groups:
+                card_groups[value] = []
+            card_groups[value].append(card)
+    for value, cards in card_groups.items():
+        if len(cards) >= 2:
+            pairs_count += len(cards) // 2
+            for i in range(len(cards) % 2):
+                new_hand.append(cards[i])
+        else:
+            new_hand.append(cards[0])
+    return new_hand, pairs_count
+
+
+def legacy_turn(hands, drawer, source, index):
+    card = hands[source].pop(index)
+    hands[drawer].append(card)
+    hands[drawer], pairs_count = legacy_discard_pairs(hands[drawer])
+    return pairs_count
+
+
+def current_turn(hands, drawer, source, index):
+    return hands[drawer].receive(hands[source].take(index))
+
+
+def deal(seed):
+    rng = random.Random(seed)
+    deck = list(CARDS)
+    rng.shuffle(deck)
+    hands = [Hand(deck[i::3]) for i in range(3)]
+    for hand in hands:
+        hand.discard_pairs()
+    return hands, rng
+
+
+def run(turn, legacy, games):
+    elapsed = 0.0
+    turns = 0
+    for seed in range(games):
+        hands, rng = deal(seed)
+        if legacy:
+            hands = [list(hand) for hand in hands]
+        active = [0, 1, 2]
+        drawer = 0
+        while len(active) > 1:
+            source = active[(active.index(drawer) + 1) % len(active)]
+            index = rng.randrange(len(hands[source]))
+            start = time.perf_counter()
+            turn(hands, drawer, source, index)
+            elapsed += time.perf_counter() - start
+            turns += 1
+            for seat in (source, drawer):
+                if seat in active and not hands[seat]:
+                    active.remove(seat)
+            if drawer in active:
+                drawer = active[(active.index(drawer) + 1) % len(active)]
+            elif active:
+                drawer = active[0]
+    return elapsed, turns
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for name, turn, legacy in (('legacy', legacy_turn, True), ('current', current_turn, False)):
+        elapsed, turns = run(turn, legacy, games)
+        print(f"{name:8s}: {turns:8d} turns  {elapsed / turns * 1e9:8.0f} ns/turn")
+
+
+if __name__ == '__main__':
+    main()
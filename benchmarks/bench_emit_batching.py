@@ -0,0 +1,81 @@
+# draw_card 1回あたりのソケット書き込み数（クライアントに届いたパケット数）とハンドラの遅延を、
+# 送信のまとめ（BATCH_EMITS）を無効にした場合と有効にした場合で比較する。
+#
+#   python benchmarks/bench_emit_batching.py [ルーム数]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_socketio_load import ClientState, event_data, percentile
+
+
+def play_room(app, socketio, room_id, rng):
+    clients = [socketio.test_client(app) for _ in range(3)]
+    states = [ClientState() for _ in clients]
+    player_ids = [f"{room_id}-{seat}" for seat in range(3)]
+
+    def deliver():
+        packets = 0
+        for client, state in zip(clients, states):
+            for message in client.get_received():
+                packets += 1
+                state.handle(message['name'], event_data(message))
+        return packets
+
+    for client, player_id in zip(clients, player_ids):
+        client.emit('join_game', {'player_id': player_id, 'room_id': room_id, 'name': player_id[-6:]})
+    clients[0].emit('start_game', {'player_id': player_ids[0], 'room_id': room_id})
+    clients[0].emit('discard_pairs', {'player_id': player_ids[0], 'room_id': room_id})
+    deliver()
+
+    writes = []
+    latencies = []
+    while states[0].state['game_phase'] == 'draw':
+        for client, state, player_id in zip(clients, states, player_ids):
+            target = state.draw_target()
+            if target:
+                from_position, hand_count = target
+                start = time.perf_counter()
+                client.emit('draw_card', {'player_id': player_id, 'room_id': room_id,
+                                          'from_position': from_position,
+                                          'card_index': rng.randrange(hand_count)})
+                latencies.append(time.perf_counter() - start)
+                writes.append(deliver())
+                break
+        else:
+            break
+
+    for client, player_id in zip(clients, player_ids):
+        client.emit('leave_game', {'player_id': player_id, 'room_id': room_id})
+        client.disconnect()
+    return writes, latencies
+
+
+def run(app, socketio, rooms, batched):
+    app.config['BATCH_EMITS'] = batched
+    writes = []
+    latencies = []
+    for n in range(rooms):
+        room_writes, room_latencies = play_room(app, socketio, f"B{int(batched)}{n}"[:10], random.Random(n))
+        writes += room_writes
+        latencies += room_latencies
+    return writes, latencies
+
+
+def main():
+    import logging
+    logging.disable(logging.INFO)
+    from card_game import app, socketio
+
+    rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for name, batched in (('unbatched', False), ('batched', True)):
+        writes, latencies = run(app, socketio, rooms, batched)
+        print(f"{name:10s}: {len(writes):7d} draws  {sum(writes) / len(writes):5.2f} writes/turn  "
+              f"p50 {percentile(latencies, 0.50) * 1e6:7.0f}us  p99 {percentile(latencies, 0.99) * 1e6:7.0f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# 起動済みサーバーへ待機状態の WebSocket 接続を大量に張り、サーバーの RSS が
+# 1接続あたりどれだけ増えるかを計測する。ASGI モード（ASGI_MODE=1）と従来モードの比較用。
+#
+#   ASGI_MODE=1 python card_game.py &
+#   python benchmarks/bench_idle_connections.py --url ws://localhost:8000 --connections 20000 --server-pid $!
+#
+# クライアント側は python-socketio を使わず、Engine.IO v4 のパケットを websockets で直接やり取りする
+# （1接続あたりのクライアント側のコストを小さくするため）。ulimit -n を接続数より大きくしておくこと。
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_socketio_load import read_rss
+
+
+async def hold_connection(url, connected, stop):
+    import websockets
+    async with websockets.connect(f"{url}/socket.io/?EIO=4&transport=websocket",
+                                  compression=None, max_size=2 ** 16) as websocket:
+        await websocket.recv()           # 0{...} (open)
+        await websocket.send('40')       # 名前空間 / に接続
+        await websocket.recv()           # 40{"sid": ...}
+        connected.append(websocket)
+        while not stop.is_set():
+            try:
+                packet = await asyncio.wait_for(websocket.recv(), timeout=1.0)
+            except asyncio.TimeoutError:
+                continue
+            if packet == '2':
+                await websocket.send('3')
+
+
+async def run(url, connections, batch, hold, server_pid):
+    stop = asyncio.Event()
+    connected = []
+    baseline = read_rss(server_pid)
+    start = time.perf_counter()
+    tasks = []
+    for offset in range(0, connections, batch):
+        tasks += [asyncio.ensure_future(hold_connection(url, connected, stop))
+                  for _ in range(min(batch, connections - offset))]
+        await asyncio.sleep(0.5)
+    while len(connected) < connections and not all(task.done() for task in tasks):
+        await asyncio.sleep(0.5)
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for task in tasks if task.done() and task.exception() is not None)
+
+    await asyncio.sleep(hold)
+    loaded = read_rss(server_pid)
+    print(f"connections: {len(connected)} (failed {failed})  in {elapsed:.1f}s")
+    if baseline and loaded:
+        print(f"server rss: {baseline / 2**20:.1f}MiB -> {loaded / 2**20:.1f}MiB  "
+              f"({(loaded - baseline) / max(len(connected), 1) / 1024:.1f} KiB/connection)")
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="待機接続のメモリ計測")
+    parser.add_argument('--url', default='ws://localhost:8000')
+    parser.add_argument('--connections', type=int, default=10000)
+    parser.add_argument('--batch', type=int, default=500, help="0.5秒ごとに張る接続数")
+    parser.add_argument('--hold', type=float, default=30.0, help="計測前に待機する秒数")
+    parser.add_argument('--server-pid', required=True, help="RSS を読むサーバーのプロセス ID")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.connections, args.batch, args.hold, args.server_pid))
+
+
+if __name__ == '__main__':
+    main()
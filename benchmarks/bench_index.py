@@ -0,0 +1,58 @@
+# "/" の1秒あたりのリクエスト数を、旧方式（毎回 render_template_string で
+# ページ全体を描画）と起動時に生成済みのバイト列を返す現行方式で比較する。
+#
+#   python benchmarks/bench_index.py [秒数]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import render_template_string
+
+from card_game import CLIENT_CSS, CLIENT_JS, INDEX_HTML, app
+
+LEGACY_PAGE = INDEX_HTML.format(css_url='', js_url='', player_options='', deck_options='').replace(
+    '    <link rel="stylesheet" href="">\n', f'    <style>\n{CLIENT_CSS}    </style>\n'
+).replace('<script src=""></script>\n', f'<script>\n{CLIENT_JS}</script>\n')
+
+
+@app.route('/__legacy_index')
+def legacy_index():
+    return render_template_string(LEGACY_PAGE)
+
+
+def requests_per_second(client, path, seconds, headers):
+    count = 0
+    size = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        response = client.get(path, headers=headers)
+        size = len(response.data)
+        count += 1
+    return count / seconds, size
+
+
+def main():
+    import logging
+    logging.disable(logging.INFO)
+
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    client = app.test_client()
+    cases = (
+        ('legacy render_template_string', '/__legacy_index', {}),
+        ('prebuilt identity', '/', {}),
+        ('prebuilt gzip', '/', {'Accept-Encoding': 'gzip'}),
+        ('prebuilt br', '/', {'Accept-Encoding': 'br, gzip'}),
+    )
+    for name, path, headers in cases:
+        rate, size = requests_per_second(client, path, seconds, headers)
+        print(f"{name:32s}: {rate:9.0f} req/s  {size:7d} bytes")
+
+    etag = client.get('/').headers['ETag']
+    rate, _ = requests_per_second(client, '/', seconds, {'If-None-Match': etag})
+    print(f"{'prebuilt 304 revalidation':32s}: {rate:9.0f} req/s")
+
+
+if __name__ == '__main__':
+    main()
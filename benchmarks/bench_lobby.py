@@ -0,0 +1,69 @@
+# 募集中のルームを大量に作り、自動マッチ1回あたりの時間を Lobby の索引と
+# game_rooms の全走査で比較する。ロビー一覧の1ページ取得の時間（キャッシュの作り直しあり・なし）も示す。
+#
+#   python benchmarks/bench_lobby.py [ルーム数]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from card_game import game_rooms, lobby
+from game_logic import MAX_PLAYERS, MIN_PLAYERS
+
+
+def build_rooms(count, rng):
+    for n in range(count):
+        max_players = rng.randint(MIN_PLAYERS, MAX_PLAYERS)
+        with game_rooms.locked(f"L{n}", create=True, max_players=max_players, decks=rng.randint(1, 2)) as room:
+            for seat in range(rng.randint(1, max_players)):
+                room.add_player(f"player-{n}-{seat}", f"p{seat}", None)
+            # 一部はゲーム中にして索引から外す
+            if len(room.players) == max_players and n % 2:
+                room.start_game()
+
+
+def scan_match(max_players, decks):
+    # 索引を使わない場合。空席の少ないルームを探すには毎回全ルームを見る必要がある
+    best = None
+    for room_id, room in game_rooms.items():
+        free = room.max_players - len(room.players)
+        if (room.max_players == max_players and room.decks == decks and room.game_phase == 'waiting'
+                and room.players and free > 0 and (best is None or free < best[0])):
+            best = (free, room_id)
+    return best and best[1]
+
+
+def per_call(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    import logging
+    logging.disable(logging.INFO)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(0)
+    build_rooms(count, rng)
+    print(f"rooms: {len(game_rooms)}  open in lobby: {len(lobby)}")
+
+    options = [(rng.randint(MIN_PLAYERS, MAX_PLAYERS), rng.randint(1, 2)) for _ in range(1000)]
+    indexed = per_call(lambda: [lobby.match(*option) for option in options], 10) / len(options)
+    scanned = per_call(lambda: scan_match(*options[0]), 3)
+    print(f"match (lobby index) : {indexed * 1e6:10.2f} us")
+    print(f"match (full scan)   : {scanned * 1e6:10.2f} us")
+
+    lobby.refresh = 0
+    def rebuild():
+        lobby.version += 1
+        lobby.page(1)
+    print(f"page (rebuild)      : {per_call(rebuild, 10) * 1e6:10.2f} us")
+    print(f"page (cached)       : {per_call(lambda: lobby.page(1), 10000) * 1e6:10.2f} us")
+
+
+if __name__ == '__main__':
+    main()
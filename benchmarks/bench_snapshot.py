@@ -0,0 +1,82 @@
+# 大量のルームを RoomSnapshotter で書き出し、差分スナップショットと起動時の復元にかかる時間、
+# ファイルサイズを計測する。復元はレコードの索引作りまでで、GameRoom への変換は使われたときか
+# バックグラウンドで行われるので、その時間（load all rooms）も別に示す。復元したルームが元のルームと一致することも確認する。
+#
+#   python benchmarks/bench_snapshot.py [ルーム数] [スナップショットのパス]
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import card_game
+from card_game import RoomSnapshotter, game_rooms
+
+
+def build_rooms(count):
+    for n in range(count):
+        with game_rooms.locked(f"S{n}", create=True) as room:
+            for seat in range(3):
+                room.add_player(f"player-{n}-{seat}", f"p{seat}", f"sid-{n}-{seat}")
+            # 待機中・ペア削除前・ゲーム中のルームを混ぜる
+            if n % 3:
+                room.start_game()
+            if n % 3 == 2:
+                room.discard_all_pairs()
+            room.version += 1
+
+
+def describe(room):
+    return (room.version, room.seed, room.game_phase, room.current_player, room.elimination_order,
+            [(pid, pdata['name'], pdata['position'], pdata['eliminated'],
+              [card.code for card in pdata['hand']], pdata['hand'].slots)
+             for pid, pdata in room.players.items()])
+
+
+def main():
+    import logging
+    logging.disable(logging.INFO)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(tempfile.mkdtemp(), 'rooms.snapshot')
+    build_rooms(count)
+    snapshotter = RoomSnapshotter(path)
+
+    start = time.perf_counter()
+    written = snapshotter.snapshot()
+    full = time.perf_counter() - start
+    print(f"full snapshot       : {written:7d} rooms  {full * 1000:8.1f} ms  {os.path.getsize(path) / 2**20:.1f} MiB")
+
+    start = time.perf_counter()
+    written = snapshotter.snapshot()
+    print(f"unchanged snapshot  : {written:7d} rooms  {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    for n in range(0, count, 100):
+        room = game_rooms[f"S{n}"]
+        room.version += 1
+    game_rooms.discard('S1')
+    start = time.perf_counter()
+    written = snapshotter.snapshot()
+    print(f"1% changed snapshot : {written:7d} rooms  {(time.perf_counter() - start) * 1000:8.1f} ms  "
+          f"{os.path.getsize(path) / 2**20:.1f} MiB")
+
+    expected = {room_id: describe(room) for room_id, room in game_rooms.items()}
+    registry = card_game.RoomRegistry()
+    start = time.perf_counter()
+    registry.restore(card_game.read_snapshot(path))
+    restore = time.perf_counter() - start
+    print(f"restore (index)     : {len(registry):7d} rooms  {restore * 1000:8.1f} ms")
+
+    start = time.perf_counter()
+    registry.load_pending()
+    print(f"load all rooms      : {len(registry):7d} rooms  {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    restored = dict(registry.items())
+    assert restored.keys() == expected.keys()
+    for room_id, room in restored.items():
+        assert describe(room) == expected[room_id], room_id
+    print("restored rooms match")
+
+if __name__ == '__main__':
+    main()
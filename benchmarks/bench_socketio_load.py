@@ -0,0 +1,281 @@
+# join_game → start_game → discard_pairs → draw_card → leave_game の一連の流れを
+# 多数の Socket.IO クライアントで並行に実行し、イベントごとの遅延 (p50/p95/p99)、
+# 1秒あたりのイベント数、サーバーの RSS をルーム数ごとに計測して JSON に保存する。
+#
+#   python benchmarks/bench_socketio_load.py --rooms 10,100,1000 --threads 16
+#   python benchmarks/bench_socketio_load.py --url http://localhost:8000 --server-pid 1234
+#
+# --url を省略すると Flask-SocketIO のテストクライアントでプロセス内のサーバーを叩く。
+# --url を指定した場合は python-socketio のクライアントで起動済みのサーバーへ接続する。
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STATE_EVENTS = ('game_joined', 'player_joined', 'game_state_updated', 'game_state_patch', 'batch')
+
+
+class ClientState:
+    # 同梱クライアントの applyStatePatch と同じ規則で状態を追う
+    def __init__(self):
+        self.state = None
+
+    def handle(self, event, data):
+        if event == 'batch':
+            for frame_event, frame_data in json.loads(data):
+                self.handle(frame_event, frame_data)
+        elif event == 'game_joined' and data.get('success'):
+            self.state = data['game_state']
+        elif event == 'player_joined':
+            self.state = data['game_state']
+        elif event == 'game_state_updated':
+            self.state = data
+        elif event == 'game_state_patch' and self.state is not None:
+            self.apply_patch(data)
+
+    def apply_patch(self, patch):
+        state = self.state
+        for key in ('current_player_position', 'game_phase', 'game_start_time', 'elimination_order'):
+            if key in patch:
+                state[key] = patch[key]
+        for changed in patch.get('players', []):
+            for other in state['other_players']:
+                if other['position'] == changed['position']:
+                    other['hand_count'] = changed['hand_count']
+                    other['eliminated'] = changed['eliminated']
+        info = patch.get('my_info', {})
+        for key in ('hand_count', 'eliminated', 'cards_drawn', 'pairs_discarded'):
+            if key in info:
+                state['my_info'][key] = info[key]
+        state['version'] = patch['version']
+
+    def draw_target(self):
+        state = self.state
+        me = state['my_info']
+        if state['game_phase'] != 'draw' or me['eliminated'] or state['current_player_position'] != me['position']:
+            return None
+        active = sorted([me['position']] + [p['position'] for p in state['other_players'] if not p['eliminated']])
+        target = active[(active.index(me['position']) + 1) % len(active)]
+        for other in state['other_players']:
+            if other['position'] == target:
+                return target, other['hand_count']
+        return None
+
+
+def event_data(message):
+    # Flask-SocketIO のテストクライアントは、'message' イベントだけ args をリストにせず辞書のまま返す
+    args = message['args']
+    if isinstance(args, list):
+        return args[0] if args else {}
+    return args
+
+
+class TestClientConnection:
+    def __init__(self, app, socketio):
+        self.client = socketio.test_client(app)
+        self.state = ClientState()
+
+    def emit(self, event, data, wait=True):
+        start = time.perf_counter()
+        self.client.emit(event, data)
+        return time.perf_counter() - start
+
+    def poll(self):
+        for message in self.client.get_received():
+            self.state.handle(message['name'], event_data(message))
+
+    def close(self):
+        self.client.disconnect()
+
+
+class RemoteConnection:
+    def __init__(self, url):
+        import socketio as socketio_client
+        self.client = socketio_client.Client()
+        self.state = ClientState()
+        self.lock = threading.Lock()
+        self.received = threading.Event()
+        for event in STATE_EVENTS + ('error',):
+            self.client.on(event, self.make_handler(event))
+        self.client.connect(url, transports=['websocket'])
+
+    def make_handler(self, event):
+        def handler(data):
+            with self.lock:
+                self.state.handle(event, data)
+            self.received.set()
+        return handler
+
+    def emit(self, event, data, wait=True, timeout=10.0):
+        # 遅延はこのクライアント宛ての最初の応答が届くまでの時間（退出は応答がないので送信のみ）
+        self.received.clear()
+        start = time.perf_counter()
+        self.client.emit(event, data)
+        if wait:
+            self.received.wait(timeout)
+        return time.perf_counter() - start
+
+    def poll(self):
+        pass
+
+    def close(self):
+        self.client.disconnect()
+
+
+def run_room(connect, room_index, run_id, rng, latencies):
+    room_id = f"L{run_id}{room_index}"[:10]
+    players = [(f"load_{run_id}_{room_index}_{seat}", f"bot{seat}") for seat in range(3)]
+    connections = [connect() for _ in players]
+    events = 0
+
+    def emit(connection, event, data):
+        nonlocal events
+        elapsed = connection.emit(event, data, wait=event != 'leave_game')
+        latencies.setdefault(event, []).append(elapsed)
+        events += 1
+        for other in connections:
+            other.poll()
+
+    for connection, (player_id, name) in zip(connections, players):
+        emit(connection, 'join_game', {'player_id': player_id, 'room_id': room_id, 'name': name})
+    emit(connections[0], 'start_game', {'player_id': players[0][0], 'room_id': room_id})
+    emit(connections[0], 'discard_pairs', {'player_id': players[0][0], 'room_id': room_id})
+
+    idle_polls = 0
+    while idle_polls < 1000:
+        state = connections[0].state.state
+        if state is None or state['game_phase'] != 'draw':
+            break
+        for connection, (player_id, _) in zip(connections, players):
+            target = connection.state.draw_target()
+            if target:
+                from_position, hand_count = target
+                emit(connection, 'draw_card', {
+                    'player_id': player_id, 'room_id': room_id,
+                    'from_position': from_position, 'card_index': rng.randrange(hand_count)
+                })
+                idle_polls = 0
+                break
+        else:
+            # リモート接続では他のクライアントへのパッチがまだ届いていないことがある
+            idle_polls += 1
+            time.sleep(0.001)
+
+    # emit は全接続を poll するので、全員の退出を送り終えてから接続を閉じる
+    for connection, (player_id, _) in zip(connections, players):
+        emit(connection, 'leave_game', {'player_id': player_id, 'room_id': room_id})
+    for connection in connections:
+        connection.close()
+    return events
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def read_rss(pid='self'):
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid == 'self':
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def run(connect, rooms, threads, run_id, rss_pid):
+    latencies = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = []
+        for room_index in range(rooms):
+            room_latencies = {}
+            futures.append((executor.submit(run_room, connect, room_index, run_id,
+                                            random.Random(room_index), room_latencies),
+                            room_latencies))
+        events = 0
+        for future, room_latencies in futures:
+            events += future.result()
+            for event, values in room_latencies.items():
+                latencies.setdefault(event, []).extend(values)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'rooms': rooms,
+        'threads': threads,
+        'events': events,
+        'seconds': elapsed,
+        'events_per_second': events / elapsed,
+        'rss_bytes': read_rss(rss_pid),
+        'latency_ms': {
+            event: {
+                'count': len(values),
+                'p50': percentile(values, 0.50) * 1000,
+                'p95': percentile(values, 0.95) * 1000,
+                'p99': percentile(values, 0.99) * 1000,
+            }
+            for event, values in sorted(latencies.items())
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket.IO 負荷ベンチマーク")
+    parser.add_argument('--rooms', default='10,100,1000', help="カンマ区切りのルーム数")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--url', help="起動済みサーバーの URL（省略時はテストクライアント）")
+    parser.add_argument('--server-pid', help="--url 使用時に RSS を読むサーバーのプロセス ID")
+    parser.add_argument('--output', default=None, help="結果 JSON の保存先")
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+
+    if args.url:
+        connect = lambda: RemoteConnection(args.url)
+        rss_pid = args.server_pid
+        mode = 'remote'
+    else:
+        from card_game import app, socketio
+        connect = lambda: TestClientConnection(app, socketio)
+        rss_pid = 'self'
+        mode = 'test_client'
+
+    started_at = datetime.now()
+    results = []
+    for run_id, rooms in enumerate(int(count) for count in args.rooms.split(',')):
+        result = run(connect, rooms, args.threads, run_id, rss_pid)
+        results.append(result)
+        draw = result['latency_ms'].get('draw_card', {})
+        rss = result['rss_bytes']
+        print(f"rooms {rooms:6d}: {result['events_per_second']:9.0f} events/s  "
+              f"draw p50 {draw.get('p50', 0):.3f}ms p95 {draw.get('p95', 0):.3f}ms "
+              f"p99 {draw.get('p99', 0):.3f}ms  rss {rss / 2**20 if rss else 0:.1f}MiB")
+
+    output = args.output or f"socketio_load-{started_at:%Y%m%d-%H%M%S}.json"
+    with open(output, 'w', encoding='utf-8') as result_file:
+        json.dump({
+            'started_at': started_at.isoformat(),
+            'mode': mode,
+            'url': args.url,
+            'results': results,
+        }, result_file, indent=2)
+    print(f"saved: {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# 観戦者の人数を変えて、1回の状態変化あたりに観戦者向けの送信データを作る時間を比較する。
+#   per-connection : 観戦者ごとに公開情報の辞書を作って JSON にする（to_dict_for_player と同じやり方）
+#   shared         : GameRoom.spectator_frame() で version ごとに1回だけ JSON にし、全員に同じ文字列を送る
+# shared の時間は観戦者の人数によらないので、プレーヤー自身への更新が遅れることはない。
+#
+#   python benchmarks/bench_spectators.py [ターン数]
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_logic import GameRoom
+
+SPECTATORS = (1, 100, 1000, 10000)
+
+
+def new_room():
+    room = GameRoom('BENCH', seed=0, headless=True, max_players=6, decks=2)
+    for seat in range(6):
+        room.add_player(f"p{seat}", f"p{seat}", None)
+    room.start_game()
+    room.discard_all_pairs()
+    return room
+
+
+def per_connection_frame(room):
+    return json.dumps({
+        'room_id': room.room_id,
+        'players': [{
+            'name': pdata['name'],
+            'hand_count': len(pdata['hand']),
+            'eliminated': pdata['eliminated'],
+            'position': pdata['position'],
+        } for pdata in room.seats],
+        'current_player_position': room.current_player,
+        'game_phase': room.game_phase,
+        'elimination_order': room.elimination_order,
+        'player_count': len(room.players),
+        'max_players': room.max_players,
+        'decks': room.decks,
+        'game_start_time': room.game_start_time.isoformat() if room.game_start_time else None,
+        'version': room.version
+    }, ensure_ascii=False, separators=(',', ':'))
+
+
+def run(turns, spectators, shared):
+    room = new_room()
+    rng = random.Random(0)
+    elapsed = 0.0
+    changes = 0
+    while changes < turns and room.game_phase == 'draw':
+        position = room.current_player
+        from_position = room.get_next_player_position(position)
+        player_id = next(pid for pid, pdata in room.players.items() if pdata['position'] == position)
+        room.draw_card(player_id, from_position, rng.randrange(len(room.seats[from_position]['hand'])))
+        room.version += 1
+        start = time.perf_counter()
+        if shared:
+            frames = [room.spectator_frame()] * spectators
+        else:
+            frames = [per_connection_frame(room) for _ in range(spectators)]
+        elapsed += time.perf_counter() - start
+        changes += 1
+    return elapsed / changes, len(frames[0])
+
+
+def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"{'spectators':>10} {'per-connection us':>18} {'shared us':>10} {'frame bytes':>12}")
+    for spectators in SPECTATORS:
+        per_connection, size = min(run(turns, spectators, False) for _ in range(3))
+        shared, _ = min(run(turns, spectators, True) for _ in range(3))
+        print(f"{spectators:10d} {per_connection * 1e6:18.1f} {shared * 1e6:10.1f} {size:12d}")
+
+
+if __name__ == '__main__':
+    main()
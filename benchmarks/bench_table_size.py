@@ -0,0 +1,81 @@
+# 席数（2〜10人）とデッキ数を変えて、1ターンあたりの処理時間と
+# ゲーム開始直後のルーム1つあたりのメモリ使用量を計測する。
+# 処理時間は handle_draw_card と同じく capture_state → draw_card → build_patches の合計で、
+# draw_card だけの時間も示す。席数が増えても us/turn がほぼ一定であることを確認するためのもの
+# （パッチは全員に1つずつ作るので、その分だけは席数に比例する）。
+#
+#   python benchmarks/bench_table_size.py [ゲーム数]
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_logic import MAX_DECKS, MAX_PLAYERS, MIN_PLAYERS, DealEngine, GameRoom
+
+SEAT_COUNTS = (MIN_PLAYERS, 3, 4, 6, 8, MAX_PLAYERS)
+DECK_COUNTS = (1, 2, MAX_DECKS)
+
+
+def new_room(seats, decks, seed=0):
+    room = GameRoom('BENCH', seed=seed, headless=True, max_players=seats, decks=decks)
+    for seat in range(seats):
+        room.add_player(f"p{seat}", f"p{seat}", None)
+    return room
+
+
+def run(seats, decks, games):
+    room = new_room(seats, decks)
+    player_ids = [f"p{seat}" for seat in range(seats)]
+    rng = room.rng
+    draw_elapsed = 0.0
+    turn_elapsed = 0.0
+    turns = 0
+    for deck in DealEngine(seats * 100 + decks).shuffle_many(games, decks):
+        room.reset_game()
+        room.start_game(deck)
+        room.discard_all_pairs()
+        while room.game_phase == 'draw':
+            position = room.current_player
+            from_position = room.get_next_player_position(position)
+            index = rng.randrange(len(room.seats[from_position]['hand']))
+            start = time.perf_counter()
+            before = room.capture_state()
+            drawn = time.perf_counter()
+            _, (_, _, moves) = room.draw_card(player_ids[position], from_position, index)
+            draw_elapsed += time.perf_counter() - drawn
+            room.version += 1
+            room.build_patches(before, moves)
+            turn_elapsed += time.perf_counter() - start
+            turns += 1
+    return draw_elapsed, turn_elapsed, turns
+
+
+def room_bytes(seats, decks, count=200):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    rooms = []
+    for n in range(count):
+        room = new_room(seats, decks, seed=n)
+        room.start_game()
+        rooms.append(room)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del rooms
+    return total / count
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print(f"{'seats':>5} {'decks':>5} {'turns':>9} {'draw us':>8} {'turn us':>8} {'bytes/room':>11}")
+    for decks in DECK_COUNTS:
+        for seats in SEAT_COUNTS:
+            draw_elapsed, turn_elapsed, turns = run(seats, decks, games)
+            print(f"{seats:5d} {decks:5d} {turns:9d} {draw_elapsed / turns * 1e6:8.2f} "
+                  f"{turn_elapsed / turns * 1e6:8.2f} {room_bytes(seats, decks):11.0f}")
+
+
+if __name__ == '__main__':
+    main()
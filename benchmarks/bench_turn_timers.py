@@ -0,0 +1,65 @@
+# ゲーム中のルームを大量に作って持ち時間のタイマーを張り、共有のタイマーホイール（turn_timers）の
+# 1ティックあたりの処理時間を計測する。期限の来ないティック、手番が進んでいて期限を引き直すだけのルーム、
+# 持ち時間切れで自動的に引くルームに分けて示す。
+#
+#   python benchmarks/bench_turn_timers.py [ルーム数]
+import os
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import card_game
+from card_game import game_rooms, turn_timers
+
+
+def build_rooms(count):
+    rooms = []
+    for n in range(count):
+        with game_rooms.locked(f"T{n}", create=True) as room:
+            for seat in range(3):
+                room.add_player(f"player-{n}-{seat}", f"p{seat}", None)
+            room.start_game()
+            room.discard_all_pairs()
+        if room.game_phase == 'draw':
+            rooms.append(room)
+    return rooms
+
+
+def main():
+    import logging
+    logging.disable(logging.INFO)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    start = time.perf_counter()
+    rooms = build_rooms(count)
+    print(f"rooms in draw phase : {len(rooms):7d}  pending timers: {turn_timers.pending}  "
+          f"(built in {time.perf_counter() - start:.1f}s)")
+
+    # 手番を進めたことにして、半分のルームは期限を延ばしておく
+    for room in rooms[::2]:
+        room.turn_start_time += timedelta(seconds=turn_timers.timeout / 2)
+
+    # 時計を1ティックずつ進めてホイールを回す（実際の周期処理と同じ進め方）
+    base = time.time()
+    idle = []
+    due = []
+    for tick in range(1, int(turn_timers.timeout / turn_timers.tick) + 3):
+        before = (card_game.turn_timeouts, turn_timers.pending)
+        start = time.process_time()
+        turn_timers.advance(base + tick * turn_timers.tick)
+        elapsed = time.process_time() - start
+        if card_game.turn_timeouts != before[0]:
+            due.append((elapsed, card_game.turn_timeouts - before[0]))
+        else:
+            idle.append(elapsed)
+    print(f"idle tick           : {sum(idle) / len(idle) * 1e6:10.1f} us cpu  ({len(idle)} ticks)")
+    for elapsed, drawn in due:
+        print(f"deadline tick       : {elapsed * 1000:10.1f} ms cpu  auto draws: {drawn}  "
+              f"({elapsed / drawn * 1e6:.1f} us/room)")
+    print(f"pending after       : {turn_timers.pending}")
+
+
+if __name__ == '__main__':
+    main()
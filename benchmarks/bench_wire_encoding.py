@@ -0,0 +1,98 @@
+# 手札の送り方ごとに、Socket.IO で実際に送られるバイト数と、状態の組み立て＋エンコードの時間を比較する。
+#   json   : カードを {code, value, suit, is_joker, display} の辞書で送る従来の形式
+#   packed : 手札全体は1枚1バイトのコード列として Socket.IO のバイナリ添付で、差分はカードコードの配列で送る形式
+# ゲーム開始直後の全体の状態（game_state_updated）と、1ターン分の差分（game_state_patch）を測る。
+# msgpack がインストールされていれば、json 形式の辞書を MessagePack にした場合の大きさも参考に示す。
+#
+#   python benchmarks/bench_wire_encoding.py [繰り返し回数]
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_logic import GameRoom
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+TABLES = ((3, 1), (6, 2), (10, 4))
+
+
+def socketio_packet(event, data):
+    # python-socketio と同じく、バイト列をプレースホルダに置き換えて本体の JSON と添付に分ける
+    attachments = []
+
+    def deconstruct(value):
+        if isinstance(value, bytes):
+            attachments.append(value)
+            return {'_placeholder': True, 'num': len(attachments) - 1}
+        if isinstance(value, dict):
+            return {key: deconstruct(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [deconstruct(item) for item in value]
+        return value
+
+    body = json.dumps([event, deconstruct(data)], separators=(',', ':'))
+    header = f"45{len(attachments)}-" if attachments else '42'
+    return len(header) + len(body.encode()) + sum(len(attachment) + 1 for attachment in attachments)
+
+
+def new_room(seats, decks, encoding):
+    room = GameRoom('BENCH', seed=seats * 10 + decks, headless=True, max_players=seats, decks=decks)
+    for seat in range(seats):
+        room.add_player(f"p{seat}", f"p{seat}", None)
+        room.players[f"p{seat}"]['encoding'] = encoding
+    room.start_game()
+    return room
+
+
+def draw_patches(room, rng):
+    before = room.capture_state()
+    position = room.current_player
+    from_position = room.get_next_player_position(position)
+    player_id = next(pid for pid, pdata in room.players.items() if pdata['position'] == position)
+    _, (_, _, moves) = room.draw_card(player_id, from_position,
+                                      rng.randrange(len(room.seats[from_position]['hand'])))
+    return room.build_patches(before, moves)
+
+
+def measure(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{'seats':>5} {'decks':>5} {'kind':>6} {'encoding':>8} {'bytes':>8} {'us':>8}")
+    for seats, decks in TABLES:
+        for encoding in ('json', 'packed'):
+            room = new_room(seats, decks, encoding)
+            size, elapsed = measure(
+                lambda: socketio_packet('game_state_updated', room.to_dict_for_player('p0')), repeat)
+            print(f"{seats:5d} {decks:5d} {'full':>6} {encoding:>8} {size:8d} {elapsed * 1e6:8.1f}")
+            if msgpack is not None and encoding == 'json':
+                packed = msgpack.packb(room.to_dict_for_player('p0'))
+                print(f"{seats:5d} {decks:5d} {'full':>6} {'msgpack':>8} {len(packed):8d}")
+
+            room.discard_all_pairs()
+            rng = random.Random(0)
+            sizes = []
+            elapsed = 0.0
+            while room.game_phase == 'draw':
+                start = time.perf_counter()
+                patches = draw_patches(room, rng)
+                sizes += [socketio_packet('game_state_patch', patch) for patch in patches.values()]
+                elapsed += time.perf_counter() - start
+            print(f"{seats:5d} {decks:5d} {'turn':>6} {encoding:>8} {sum(sizes) / len(sizes):8.1f} "
+                  f"{elapsed / len(sizes) * 1e6:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# 1プロセスの中で2ノードのクラスタ（QueuePubSub）を組み、このプロセスをノード0として
+# 接続（sid）宛ての送信がその接続を持つノードにだけ届くことを確認する。ノード1の受信キューは
+# 購読せず、このスクリプトが直接読む。ノード1の接続はノード1から転送されてきたイベントとして
+# run_room_event(..., origin=1) で再現する。送信のまとめ（BATCH_EMITS）の有無の両方で確かめる。
+#
+#   python benchmarks/check_cluster_routing.py
+import os
+import queue
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import card_game
+from card_game import QueuePubSub, app, configure_cluster, connection_nodes, run_room_event, socketio
+
+REMOTE_SID = 'remote-sid'
+
+
+def local_room_id(cluster, prefix):
+    return next(f"{prefix}{n}" for n in range(1000) if cluster.is_local(f"{prefix}{n}"))
+
+
+def drain(node_queue):
+    messages = []
+    while True:
+        try:
+            messages.append(node_queue.get_nowait())
+        except queue.Empty:
+            return messages
+
+
+def connect(cluster, room_id, name):
+    # 参加させ、その接続の sid（connection_nodes に新しく入ったもの）を返す
+    before = set(connection_nodes)
+    client = socketio.test_client(app)
+    client.emit('join_game', {'player_id': f"{room_id}-{name}", 'room_id': room_id, 'name': name})
+    sid, = set(connection_nodes) - before
+    assert connection_nodes[sid] == cluster.node_id
+    return client, sid
+
+
+def check(cluster, node_queue, batched):
+    app.config['BATCH_EMITS'] = batched
+    room_id = local_room_id(cluster, 'R' if batched else 'U')
+    local, local_sid = connect(cluster, room_id, 'local')
+
+    run_room_event('join_game', {'player_id': f"{room_id}-remote", 'room_id': room_id, 'name': 'remote'},
+                   REMOTE_SID, 1)
+    assert connection_nodes[REMOTE_SID] == 1, connection_nodes
+    kinds = [message['kind'] for message in drain(node_queue)]
+    assert 'join' in kinds and 'bind' in kinds, kinds
+
+    # ノード0の接続が参加すると、ノード1の接続へ player_joined が届く
+    joiner, joiner_sid = connect(cluster, room_id, 'joiner')
+    joiner.emit('start_game', {'player_id': f"{room_id}-joiner", 'room_id': room_id})
+    emits = [message for message in drain(node_queue) if message['kind'] == 'emit']
+    to_remote = [message for message in emits if message['to'] == REMOTE_SID]
+    assert to_remote, emits
+    # ノード0の接続宛てのものはノード1へ流れない
+    assert not any(message['to'] in (local_sid, joiner_sid) for message in emits), emits
+    received = [message['name'] for message in local.get_received()]
+    assert 'player_joined' in received or 'batch' in received, received
+
+    # ノード1の接続が切れたら送信先の記録を外し、以降はルーム宛てと同じく全ノードへ送る
+    run_room_event('suspend_player', {'player_id': f"{room_id}-remote", 'room_id': room_id}, REMOTE_SID, 1)
+    assert REMOTE_SID not in connection_nodes, connection_nodes
+
+    for client, name in ((local, 'local'), (joiner, 'joiner')):
+        client.emit('leave_game', {'player_id': f"{room_id}-{name}", 'room_id': room_id})
+    for client in (local, joiner):
+        client.disconnect()
+    run_room_event('leave_game', {'player_id': f"{room_id}-remote", 'room_id': room_id}, REMOTE_SID, 1)
+    drain(node_queue)
+    return len(to_remote), len(emits)
+
+
+def main():
+    pubsub = QueuePubSub(2, queue.Queue)
+    cluster = configure_cluster(0, 2, pubsub)
+    node_queue = pubsub.queues[1]
+    try:
+        for batched in (False, True):
+            to_remote, emits = check(cluster, node_queue, batched)
+            label = 'batched' if batched else 'unbatched'
+            print(f"{label:>10}: emits to node 1 = {emits}, addressed to its connection = {to_remote}")
+    finally:
+        pubsub.publish(0, None)
+        card_game.cluster = None
+    print("ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# 多数のスレッドから多数のルームへ同時にカードを引き続け、
+# ルームごとのロックで操作が原子的に適用されることを確認するストレステスト。
+# 並行してルームの作成・削除と 期限切れルームの掃除 room_expiry.advance()も行う。
+#
+#   python benchmarks/stress_rooms.py [スレッド数] [ルーム数] [秒数]
+import os
+import sys
+import random
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from card_game import game_rooms, room_expiry
+from game_logic import DECK_SIZE
+
+
+def check_room(room):
+    if room.game_phase not in ('draw', 'finished'):
+        return
+    held = sum(len(p['hand']) for p in room.players.values())
+    discarded = sum(p['pairs_discarded'] for p in room.players.values()) * 2
+    assert held + discarded == DECK_SIZE, (room.room_id, held, discarded)
+
+
+def play_turn(room_id, rng):
+    with game_rooms.locked(room_id, create=True) as room:
+        if len(room.players) < 3:
+            for i in range(len(room.players), 3):
+                room.add_player(f"{room_id}-p{i}", f"player{i}", None)
+        if room.game_phase == 'finished':
+            room.reset_game()
+        if room.game_phase == 'waiting':
+            room.start_game()
+            room.discard_all_pairs()
+        check_room(room)
+
+        for player_id, player in room.players.items():
+            if player['position'] == room.current_player:
+                break
+        from_position = room.get_next_player_position(room.current_player)
+        source = room.get_player_by_position(from_position)
+        success, message = room.draw_card(player_id, from_position, rng.randrange(len(source['hand'])))
+        assert success, message
+        check_room(room)
+
+
+def drawer(room_ids, deadline, counter, errors):
+    rng = random.Random()
+    turns = 0
+    try:
+        while time.monotonic() < deadline:
+            play_turn(rng.choice(room_ids), rng)
+            turns += 1
+    except Exception as e:
+        errors.append(e)
+    counter.append(turns)
+
+
+def churner(deadline, errors):
+    rng = random.Random()
+    try:
+        while time.monotonic() < deadline:
+            room_id = f"CHURN{rng.randrange(200)}"
+            with game_rooms.locked(room_id, create=True) as room:
+                room.add_player('churn', 'churner', None)
+            with game_rooms.locked(room_id) as room:
+                if room is not None:
+                    room.remove_player('churn')
+                    if not room.players:
+                        game_rooms.discard(room_id, room)
+            room_expiry.advance()
+    except Exception as e:
+        errors.append(e)
+
+
+def main():
+    import logging
+    logging.disable(logging.INFO)
+
+    threads_count = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    rooms_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+
+    room_ids = [f"STRESS{i}" for i in range(rooms_count)]
+    deadline = time.monotonic() + seconds
+    counter = []
+    errors = []
+    threads = [threading.Thread(target=drawer, args=(room_ids, deadline, counter, errors))
+               for _ in range(threads_count)]
+    threads += [threading.Thread(target=churner, args=(deadline, errors)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for room_id in room_ids:
+        check_room(game_rooms[room_id])
+
+    total = sum(counter)
+    print(f"threads: {threads_count}  rooms: {rooms_count}  turns: {total}  ({total / seconds:.0f} turns/s)")
+    if errors:
+        print(f"FAILED: {len(errors)} errors, first: {errors[0]!r}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
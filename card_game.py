@@ -1,599 +1,1740 @@
-from flask import Flask, render_template_string, request, session
+from flask import Flask, Response, request
 from flask_socketio import SocketIO, emit, join_room, leave_room
+import asyncio
+import atexit
+import bisect
+import gzip
+import hashlib
+import inspect
+import itertools
+import json
+import multiprocessing
+import os
+import queue
 import random
 import time
 import logging
-from datetime import datetime, timedelta
+import mmap
+import struct
+import threading
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import parse_qsl
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from game_logic import (CARDS, MAX_DECKS, MAX_PLAYERS, MIN_PLAYERS, MONOTONIC_TO_WALL,
+                        BotPolicy, GameRoom, Hand)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
+app.config['ROOM_TIMEOUT_SECONDS'] = float(os.environ.get('ROOM_TIMEOUT_SECONDS', 1800))
+app.config['ROOM_SWEEP_TICK_SECONDS'] = float(os.environ.get('ROOM_SWEEP_TICK_SECONDS', 1))
+app.config['HISTORY_CAPACITY'] = int(os.environ.get('HISTORY_CAPACITY', 256))
+app.config['HISTORY_LOG_PATH'] = os.environ.get('HISTORY_LOG_PATH')
+app.config['CLUSTER_NODES'] = int(os.environ.get('CLUSTER_NODES', 1))
+app.config['CLUSTER_NODE_INDEX'] = os.environ.get('CLUSTER_NODE_INDEX')
+app.config['PUBSUB_URL'] = os.environ.get('PUBSUB_URL')
+app.config['SNAPSHOT_PATH'] = os.environ.get('SNAPSHOT_PATH')
+app.config['EVENT_LOG_PATH'] = os.environ.get('EVENT_LOG_PATH')
+app.config['RECONNECT_GRACE_SECONDS'] = float(os.environ.get('RECONNECT_GRACE_SECONDS', 30))
+# 手番の持ち時間。過ぎるとサーバーが代わりにランダムな1枚を引く（0 で無効）
+app.config['TURN_TIMEOUT_SECONDS'] = float(os.environ.get('TURN_TIMEOUT_SECONDS', 60))
+# ボットが手番で引くまでの待ち時間と、1回にまとめて処理するボットの手番の数の上限
+app.config['BOT_DELAY_SECONDS'] = float(os.environ.get('BOT_DELAY_SECONDS', 1))
+app.config['BOT_BATCH_SIZE'] = int(os.environ.get('BOT_BATCH_SIZE', 100))
+# ASGI モードでの上限。バッチはイベントループの上で打つので、1手 約1ms として数 ms で制御を返す
+app.config['BOT_ASYNC_BATCH_SIZE'] = int(os.environ.get('BOT_ASYNC_BATCH_SIZE', 8))
+# ボットの方針表を作るときに、人数ごとに回すヘッドレスのゲーム数
+app.config['BOT_POLICY_GAMES'] = int(os.environ.get('BOT_POLICY_GAMES', 200))
+app.config['BATCH_EMITS'] = os.environ.get('BATCH_EMITS', '1') != '0'
+# 1 なら python-socketio の AsyncServer を使う ASGI アプリとして動かす（create_asgi_app を参照）
+app.config['ASGI_MODE'] = os.environ.get('ASGI_MODE') == '1'
+app.config['LOBBY_PAGE_SIZE'] = int(os.environ.get('LOBBY_PAGE_SIZE', 50))
+app.config['LOBBY_REFRESH_SECONDS'] = float(os.environ.get('LOBBY_REFRESH_SECONDS', 1))
+app.config['SNAPSHOT_INTERVAL_SECONDS'] = float(os.environ.get('SNAPSHOT_INTERVAL_SECONDS', 5))
 socketio = SocketIO(app, cors_allowed_origins="*")
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# ゲームルームの管理
-game_rooms = {}
-
-class Card:
-    def __init__(self, value, suit, is_joker=False):
-        self.value = value
-        self.suit = suit
-        self.is_joker = is_joker
-        self.suits = ["♠", "♥", "♦", "♣"]
-        self.values = [None, None, "2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K", "A"]
-    
-    def __str__(self):
-        if self.is_joker:
-            return "🃏"
-        return f"{self.values[self.value]}{self.suits[self.suit]}"
-    
-    def get_value(self):
-        return 'JOKER' if self.is_joker else self.value
-    
-    def to_dict(self):
-        return {
-            'value': self.value,
-            'suit': self.suit,
-            'is_joker': self.is_joker,
-            'display': str(self)
-        }
+# 自動マッチで既存のルームを試す回数（最後の1回は新しいルームを作る）
+QUICK_MATCH_ATTEMPTS = 3
+ROOM_ID_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
 
-class GameRoom:
-    def __init__(self, room_id):
-        self.room_id = room_id
-        self.players = {}
-        self.current_player = 0
-        self.game_phase = 'waiting'
-        self.elimination_order = []
-        self.created_at = datetime.now()
-        self.last_activity = datetime.now()
-        self.deck = []
-        self.game_start_time = None
-        self.turn_start_time = None
-        self.game_history = []
-        
-    def add_player(self, player_id, name, sid):
-        if len(self.players) >= 3:
-            return False, "ルームが満員です（3人まで）"
-        
-        # 名前の重複チェック
-        existing_names = [p['name'] for p in self.players.values()]
-        if name in existing_names:
-            return False, "同じ名前のプレーヤーが既に参加しています"
-        
-        used_positions = [p['position'] for p in self.players.values()]
-        available_position = 0
-        while available_position in used_positions:
-            available_position += 1
-        
-        self.players[player_id] = {
-            'name': name,
-            'hand': [],
-            'eliminated': False,
-            'sid': sid,
-            'position': available_position,
-            'join_time': datetime.now(),
-            'cards_drawn': 0,
-            'pairs_discarded': 0
-        }
-        
-        self.last_activity = datetime.now()
-        logger.info(f"Player {name} joined room {self.room_id}")
-        return True, "参加成功"
-    
-    def remove_player(self, player_id):
-        if player_id in self.players:
-            player_name = self.players[player_id]['name']
-            del self.players[player_id]
-            logger.info(f"Player {player_name} left room {self.room_id}")
-            
-            if len(self.players) < 3:
-                self.reorganize_positions()
-    
-    def reorganize_positions(self):
-        players_list = list(self.players.values())
-        for i, player in enumerate(players_list):
-            player['position'] = i
-        if len(players_list) > 0:
-            self.current_player = 0
-        else:
-            self.current_player = 0
-    
-    def create_deck(self):
-        deck = []
-        for value in range(2, 15):
-            for suit in range(4):
-                deck.append(Card(value, suit))
-        deck.append(Card(0, 0, True))
-        
-        for i in range(len(deck)):
-            j = random.randint(0, len(deck) - 1)
-            deck[i], deck[j] = deck[j], deck[i]
-        
-        return deck
-    
-    def start_game(self):
-        if len(self.players) != 3:
-            return False
-        
-        self.deck = self.create_deck()
-        player_list = list(self.players.values())
-        
-        for i, card in enumerate(self.deck):
-            player_list[i % 3]['hand'].append(card)
-        
-        self.game_phase = 'discard'
-        self.game_start_time = datetime.now()
-        self.last_activity = datetime.now()
-        
-        logger.info(f"Game started in room {self.room_id} with players: {[p['name'] for p in player_list]}")
-        
-        return True
-    
-    def discard_pairs_for_player(self, player_data):
-        new_hand = []
-        card_groups = {}
-        pairs_count = 0
-        
-        for card in player_data['hand']:
-            if card.is_joker:
-                new_hand.append(card)
-            else:
-                value = card.get_value()
-                if value not in card_groups:
-                    card_groups[value] = []
-                card_groups[value].append(card)
-        
-        for value, cards in card_groups.items():
-            if len(cards) >= 2:
-                pairs = len(cards) // 2
-                pairs_count += pairs
-                remaining = len(cards) % 2
-                for i in range(remaining):
-                    new_hand.append(cards[i])
+class HistorySpillWriter:
+    # 履歴イベントを別スレッドでまとめて JSONL に追記する（リクエスト処理側はキューに積むだけ）
+    def __init__(self, path, batch_size=512, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self.written = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, room_id, record):
+        self.queue.put((room_id, record))
+
+    def current_path(self):
+        return self.path
+
+    def encode(self, room_id, record):
+        timestamp, action, player, details = record
+        return json.dumps({
+            'room_id': room_id,
+            'timestamp': datetime.fromtimestamp(timestamp + MONOTONIC_TO_WALL).isoformat(),
+            'action': action,
+            'player': player,
+            'details': details
+        }, ensure_ascii=False) + '\n'
+
+    def sync(self, log_file):
+        log_file.flush()
+
+    def committed(self):
+        # バッチを書き終えるたび（と、スレッドが終わるとき）に呼ばれる
+        pass
+
+    def run(self):
+        log_file = None
+        try:
+            while True:
+                batch = [self.queue.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size and batch[-1] is not None:
+                    try:
+                        batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+                
+                lines = [self.encode(*entry) for entry in batch if entry is not None]
+                path = self.current_path()
+                if log_file is None or log_file.name != path:
+                    if log_file is not None:
+                        log_file.close()
+                    log_file = open(path, 'a', encoding='utf-8')
+                log_file.write(''.join(lines))
+                self.sync(log_file)
+                self.written += len(lines)
+                self.committed()
+                
+                if batch[-1] is None:
+                    return
+        except Exception as e:
+            logger.error(f"{type(self).__name__} stopped: {e}")
+        finally:
+            if log_file is not None:
+                log_file.close()
+            self.stopped = True
+            self.committed()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+# 書き出しのスレッドは fork で引き継がれないので、import 時には作らず start_log_writers で作る
+history_spill = None
+
+GameRoom.history_capacity = app.config['HISTORY_CAPACITY']
+
+class EventLogWriter(HistorySpillWriter):
+    # 受け付けた操作の先行書き込みログ。1行が [時刻, room_id, イベント, 引数...] の JSON 配列。
+    # ハンドラは記録をキューに積んで番号を受け取り、その番号までの fsync が済むのを待ってから
+    # クライアントへ送る（wait_for_event_log）。書き出しと fsync は別スレッドが、前の fsync の間に
+    # 溜まった記録をまとめて1回で行う（グループコミット）ので、同時に待つハンドラが多いほど1件あたりは安い。
+    # path に strftime の書式（例: events-%Y%m%d.log）を含めると日付ごとのファイルに分かれる。
+    def __init__(self, path, batch_size=4096, flush_interval=0):
+        self.submitted = 0
+        self.condition = threading.Condition()
+        # ASGI モードで待っている (番号, イベントループ, Future)。番号の昇順に並ぶ
+        self.async_waiters = []
+        super().__init__(path, batch_size, flush_interval)
+
+    def submit(self, room_id, record):
+        with self.condition:
+            self.submitted += 1
+            self.queue.put((room_id, record))
+            return self.submitted
+
+    def committed(self):
+        with self.condition:
+            self.condition.notify_all()
+            ready = [waiter for waiter in self.async_waiters if waiter[0] <= self.written or self.stopped]
+            del self.async_waiters[:len(ready)]
+        for _, loop, future in ready:
+            loop.call_soon_threadsafe(resolve_future, future)
+
+    def wait(self, seq):
+        # 書き出しのスレッドが止まっていたら待たない（エラーはスレッドが終わるときに記録済み）
+        with self.condition:
+            self.condition.wait_for(lambda: self.written >= seq or self.stopped)
+
+    def wait_async(self, seq):
+        # ASGI モード用。イベントループを止めずに待つ Future を返す
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.condition:
+            if self.written >= seq or self.stopped:
+                future.set_result(None)
             else:
-                new_hand.append(cards[0])
-        
-        player_data['hand'] = new_hand
-        player_data['pairs_discarded'] += pairs_count
-        return pairs_count
-    
-    def get_next_player_position(self, current_position):
-        positions = [p['position'] for p in self.players.values() if not p['eliminated']]
-        positions.sort()
+                self.async_waiters.append((seq, loop, future))
+        return future
+
+    def current_path(self):
+        return datetime.now().strftime(self.path)
+
+    def encode(self, room_id, record):
+        return json.dumps([record[0], room_id, *record[1:]], ensure_ascii=False, separators=(',', ':')) + '\n'
+
+    def sync(self, log_file):
+        log_file.flush()
+        os.fsync(log_file.fileno())
+
+event_log = None
+
+def start_log_writers():
+    # 履歴の書き出しとイベントログを開く。クラスタでは同じファイルに複数のプロセスが書かないよう、
+    # パスの末尾にノード番号を付ける（replay.py には全ノードのファイルを渡す）
+    global history_spill, event_log
+    suffix = f".{cluster.node_id}" if cluster is not None else ''
+    # fork 前のプロセスで作られていたら、スレッドの止まったそれは使わずに作り直す
+    if history_spill is not None and not history_spill.thread.is_alive():
+        history_spill = None
+    if event_log is not None and not event_log.thread.is_alive():
+        event_log = None
+    if app.config['HISTORY_LOG_PATH'] and history_spill is None:
+        history_spill = HistorySpillWriter(app.config['HISTORY_LOG_PATH'] + suffix)
+        atexit.register(history_spill.close)
+        GameRoom.history_spill = history_spill
+    if app.config['EVENT_LOG_PATH'] and event_log is None:
+        event_log = EventLogWriter(app.config['EVENT_LOG_PATH'] + suffix)
+        atexit.register(event_log.close)
+
+def resolve_future(future):
+    if not future.done():
+        future.set_result(None)
+
+def log_event(room_id, event, *args):
+    # 記録の番号だけを覚えて戻る。このスレッドが次にフレームを送る前に wait_for_event_log で待つ
+    if event_log is not None:
+        event_context.log_seq = event_log.submit(room_id, (round(time.time(), 3), event, *args))
+
+def wait_for_event_log():
+    # このスレッドで積んだ記録の fsync が済むまで待つ。クライアントに知らせた操作がクラッシュで失われないように
+    seq = getattr(event_context, 'log_seq', 0)
+    if not seq:
+        return
+    event_context.log_seq = 0
+    if async_server is not None:
+        # ASGI モードではイベントループを止めず、この後の送信を Future が済むまで遅らせる（schedule_async）
+        global event_log_barrier
+        event_log_barrier = event_log.wait_async(seq)
+    else:
+        event_log.wait(seq)
+
+class ExpiryWheel:
+    # ハッシュ化タイマーホイール。1スロット = 1ティックで、スロット数はタイムアウトより
+    # 長く取るため、各エントリは期限のティックでだけ処理される。
+    # on_expire(item, now) が新しい期限を返せば再登録、None を返せば破棄する。
+    def __init__(self, timeout, tick, on_expire, history=60):
+        self.timeout = timeout
+        self.tick = tick
+        self.on_expire = on_expire
+        self.slots = [[] for _ in range(int(timeout / tick) + 2)]
+        self.current_tick = int(time.time() / tick)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.ticks = 0
+        self.expired_total = 0
+        self.recent_expired = deque(maxlen=history)
+
+    def schedule(self, item, deadline):
+        with self.lock:
+            tick = max(int(deadline / self.tick) + 1, self.current_tick + 1)
+            self.slots[tick % len(self.slots)].append((tick, item))
+            self.pending += 1
+
+    def advance(self, now=None):
+        now = time.time() if now is None else now
+        target_tick = int(now / self.tick)
+        expired = 0
         
-        if current_position not in positions:
-            return positions[0] if positions else 0
+        while True:
+            with self.lock:
+                # 長時間止まっていた場合も、ホイールを1周すれば期限切れは全て拾える
+                self.current_tick = max(self.current_tick, target_tick - len(self.slots))
+                if self.current_tick >= target_tick:
+                    break
+                self.current_tick += 1
+                tick = self.current_tick
+                due = []
+                later = []
+                for entry in self.slots[tick % len(self.slots)]:
+                    (due if entry[0] <= tick else later).append(entry)
+                self.slots[tick % len(self.slots)] = later
+                self.pending -= len(due)
+            
+            tick_expired = 0
+            for _, item in due:
+                # 1件の失敗で同じティックの残りのエントリを失わないよう、エントリごとに捕まえる
+                try:
+                    deadline = self.on_expire(item, now)
+                except Exception as e:
+                    logger.error(f"Timer wheel callback error: {e}")
+                    deadline = None
+                if deadline is None:
+                    tick_expired += 1
+                else:
+                    self.schedule(item, deadline)
+            
+            # 統計は他のスレッドの stats() からも読まれるので、ロックを取って更新する
+            with self.lock:
+                self.ticks += 1
+                self.recent_expired.append(tick_expired)
+                self.expired_total += tick_expired
+            expired += tick_expired
         
-        current_index = positions.index(current_position)
-        next_index = (current_index + 1) % len(positions)
-        return positions[next_index]
-    
-    def get_player_by_position(self, position):
-        for player_data in self.players.values():
-            if player_data['position'] == position:
-                return player_data
+        return expired
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': self.pending,
+                'ticks': self.ticks,
+                'expired_total': self.expired_total,
+                'last_tick_expired': self.recent_expired[-1] if self.recent_expired else 0,
+                'max_tick_expired': max(self.recent_expired, default=0),
+            }
+
+def expire_room(room_ref, now):
+    room = room_ref()
+    if room is None:
         return None
     
-    def check_win_condition(self):
-        active_players = [p for p in self.players.values() if not p['eliminated']]
-        return len(active_players) <= 1
-    
-    def is_room_inactive(self, timeout_minutes=30):
-        return datetime.now() - self.last_activity > timedelta(minutes=timeout_minutes)
+    timeout = room_expiry.timeout
+    with room.lock:
+        if game_rooms.get(room.room_id) is not room:
+            return None
+        deadline = room.last_activity.timestamp() + timeout
+        if deadline <= now:
+            game_rooms.discard(room.room_id, room)
+            log_event(room.room_id, 'expire')
+            logger.info(f"Cleaning up inactive room: {room.room_id}")
+            return None
+        # 途中で操作があったルームは最終操作時刻から期限を引き直す
+        return deadline
+
+room_expiry = ExpiryWheel(app.config['ROOM_TIMEOUT_SECONDS'],
+                          app.config['ROOM_SWEEP_TICK_SECONDS'], expire_room)
+
+def expire_suspended_player(entry, now):
+    # 猶予時間内に再接続しなかったプレーヤーは、通常の退出と同じ扱いにする
+    room_ref, player_id, suspended_at = entry
+    room = room_ref()
+    if room is None:
+        return None
+    with room.lock:
+        player_data = room.players.get(player_id)
+        if player_data is None or player_data['suspended_at'] != suspended_at:
+            return None
+        logger.info(f"Reconnect grace expired for {player_id} in room {room.room_id}")
+        run_room_event('leave_game', {'player_id': player_id, 'room_id': room.room_id},
+                       None, cluster.node_id if cluster else None)
+    return None
+
+suspended_players = ExpiryWheel(app.config['RECONNECT_GRACE_SECONDS'],
+                                app.config['ROOM_SWEEP_TICK_SECONDS'], expire_suspended_player)
+
+# 持ち時間切れで自動的に引いた回数
+turn_timeouts = 0
+
+def arm_turn_timer(room):
+    # room.lock を持った状態で呼ぶ。ホイールに載せるのはルームごとに1エントリだけで、
+    # 手番が進んで期限が延びた分は expire_turn が turn_start_time から引き直す
+    if room.turn_timer_armed or room.game_phase != 'draw' or turn_timers.timeout <= 0:
+        return
+    room.turn_timer_armed = True
+    turn_timers.schedule(weakref.ref(room), room.turn_start_time.timestamp() + turn_timers.timeout)
+
+def expire_turn(room_ref, now):
+    global turn_timeouts
+    room = room_ref()
+    if room is None:
+        return None
     
-    def add_to_history(self, action, player_name, details=None):
-        self.game_history.append({
-            'timestamp': datetime.now(),
-            'action': action,
-            'player': player_name,
-            'details': details
-        })
+    with room.lock:
+        if game_rooms.get(room.room_id) is not room or room.game_phase != 'draw':
+            room.turn_timer_armed = False
+            return None
+        deadline = room.turn_start_time.timestamp() + turn_timers.timeout
+        if deadline > now:
+            return deadline
+        room.turn_timer_armed = False
+        # handle_draw_card と同じ経路で引く。次の手番のタイマーはその中で張り直される
+        player_data = room.get_player_by_position(room.current_player)
+        player_id = next(pid for pid, pdata in room.players.items() if pdata is player_data)
+        from_position = room.get_next_player_position(room.current_player)
+        card_index = room.rng.randrange(len(room.seats[from_position]['hand']))
+        logger.info(f"Turn timed out for {player_id} in room {room.room_id}")
+        turn_timeouts += 1
+        run_room_event('draw_card', {'player_id': player_id, 'room_id': room.room_id,
+                                     'from_position': from_position, 'card_index': card_index,
+                                     'timed_out': True},
+                       None, cluster.node_id if cluster else None)
+    return None
+
+turn_timers = ExpiryWheel(app.config['TURN_TIMEOUT_SECONDS'],
+                          app.config['ROOM_SWEEP_TICK_SECONDS'], expire_turn)
+
+bot_policy = BotPolicy(app.config['BOT_POLICY_GAMES'])
+
+class BotScheduler:
+    # ボットの手番の待ち行列。待ち時間は一定なので、載せた順がそのまま期限順になる。
+    # run() は期限の来たルームを最大 batch_size 件まとめて取り出し、ルームをまたいで続けて打つ。
+    # 待ち行列に載るのはルームごとに1エントリだけ（room.bot_turn_scheduled）。
+    def __init__(self, delay, batch_size, tick=0.1):
+        self.delay = delay
+        self.batch_size = batch_size
+        self.tick = tick
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.turns = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def schedule(self, item, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            self.queue.append((now + self.delay, item))
+
+    def run(self, now=None, limit=None):
+        now = time.time() if now is None else now
+        limit = self.batch_size if limit is None else limit
+        due = []
+        with self.lock:
+            while self.queue and self.queue[0][0] <= now and len(due) < limit:
+                due.append(self.queue.popleft()[1])
+        for room_ref in due:
+            # 1件の失敗で同じバッチの残りのルームのボットを止めないよう、ルームごとに捕まえる
+            try:
+                play_bot_turn(room_ref)
+            except Exception as e:
+                logger.error(f"Bot turn error: {e}")
+        self.turns += len(due)
+        return len(due)
+
+def schedule_bot_turn(room):
+    # room.lock を持った状態で呼ぶ。手番がボットのときだけ待ち行列に載せる
+    if room.bot_turn_scheduled or room.game_phase != 'draw':
+        return
+    player_data = room.get_player_by_position(room.current_player)
+    if player_data is None or not player_data['bot']:
+        return
+    room.bot_turn_scheduled = True
+    bot_turns.schedule(weakref.ref(room))
+
+def play_bot_turn(room_ref):
+    room = room_ref()
+    if room is None:
+        return
     
-    def to_dict_for_player(self, player_id):
-        player_data = self.players.get(player_id)
-        if not player_data:
+    with room.lock:
+        room.bot_turn_scheduled = False
+        if game_rooms.get(room.room_id) is not room or room.game_phase != 'draw':
+            return
+        player_data = room.get_player_by_position(room.current_player)
+        if not player_data['bot']:
+            return
+        # handle_draw_card と同じ経路で引く。次もボットの手番なら、その中で待ち行列に載せ直される
+        player_id = next(pid for pid, pdata in room.players.items() if pdata is player_data)
+        from_position = room.get_next_player_position(room.current_player)
+        card_index = bot_policy.choose(len(room.seats[from_position]['hand']), room.rng)
+        run_room_event('draw_card', {'player_id': player_id, 'room_id': room.room_id,
+                                     'from_position': from_position, 'card_index': card_index},
+                       None, cluster.node_id if cluster else None)
+
+bot_turns = BotScheduler(app.config['BOT_DELAY_SECONDS'], app.config['BOT_BATCH_SIZE'])
+
+def run_bot_turns():
+    # 方針表は手番を打ち始める前にこのスレッドで作っておく。choose() の中で作ると、
+    # 最初のボットの手番がルームのロックを持ったまま表ができるのを待つことになる
+    bot_policy.build()
+    while True:
+        played = bot_turns.run()
+        # 1回で捌ききれなかったときは待たずに続きを処理する
+        time.sleep(0 if played >= bot_turns.batch_size else bot_turns.tick)
+
+async def run_bot_turns_async():
+    # ASGI モード用。バッチの合間に必ずイベントループへ制御を返し、プレーヤーの操作を待たせない。
+    # 1バッチは BOT_ASYNC_BATCH_SIZE 手までにして、ループを止める時間を数 ms に抑える
+    limit = min(bot_turns.batch_size, app.config['BOT_ASYNC_BATCH_SIZE'])
+    while True:
+        if bot_turns.queue and bot_policy.table is None:
+            # 方針表は最初のボットの手番の前に、イベントループの外で作る
+            await asyncio.get_running_loop().run_in_executor(None, bot_policy.build)
+        played = bot_turns.run(limit=limit)
+        await asyncio.sleep(0 if played >= limit else bot_turns.tick)
+
+class Lobby:
+    # 参加者を募集中（待機中・空席あり・1人以上参加済み）のルームの索引。
+    # (人数, デッキ数) ごとに空席数でバケットを分けて持つので、自動マッチは game_rooms を走査せず、
+    # 空席の少ないバケットの先頭を取るだけで済む。ルームの変更は RoomRegistry.locked の最後に反映される。
+    # 一覧はページごとの JSON をキャッシュし、変更があっても作り直すのは最短 refresh 秒おきにする。
+    def __init__(self, page_size=50, refresh=1.0):
+        self.page_size = page_size
+        self.refresh = refresh
+        # (max_players, decks) → 空席数ごとの {room_id: None}（挿入順 = 募集を始めた順）
+        self.buckets = {}
+        # room_id → (バケットのキー, 空席数)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.version = 0
+        self.pages = {}
+        self.pages_version = -1
+        self.pages_built = 0.0
+        self.rows = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, room):
+        # room.lock を持った状態で呼ぶ
+        players = len(room.players)
+        if room.game_phase != 'waiting' or not 0 < players < room.max_players:
+            self.remove(room.room_id)
+            return
+        key = (room.max_players, room.decks)
+        entry = (key, room.max_players - players)
+        with self.lock:
+            previous = self.entries.get(room.room_id)
+            if previous == entry:
+                return
+            if previous is not None:
+                del self.buckets[previous[0]][previous[1]][room.room_id]
+            buckets = self.buckets.get(key)
+            if buckets is None:
+                buckets = self.buckets[key] = [{} for _ in range(room.max_players)]
+            buckets[entry[1]][room.room_id] = None
+            self.entries[room.room_id] = entry
+            self.version += 1
+
+    def remove(self, room_id):
+        with self.lock:
+            previous = self.entries.pop(room_id, None)
+            if previous is not None:
+                del self.buckets[previous[0]][previous[1]][room_id]
+                self.version += 1
+
+    def match(self, max_players, decks, exclude=()):
+        # 空席が少ない（すぐ始められる）ルームほど優先する。見るバケットは最大 max_players - 1 個
+        with self.lock:
+            buckets = self.buckets.get((max_players, decks))
+            if buckets is None:
+                return None
+            for free in range(1, max_players):
+                for room_id in buckets[free]:
+                    if room_id not in exclude:
+                        return room_id
+        return None
+
+    def page(self, number):
+        with self.lock:
+            now = time.monotonic()
+            if self.pages_version != self.version and now - self.pages_built >= self.refresh:
+                # バケットを空席の少ない順に並べるだけなので並べ替えは要らない
+                keys = sorted(self.buckets)
+                self.rows = [(free, room_id, key)
+                             for free in range(1, MAX_PLAYERS)
+                             for key in keys if free < key[0]
+                             for room_id in self.buckets[key][free]]
+                self.pages = {}
+                self.pages_version = self.version
+                self.pages_built = now
+            total = len(self.rows)
+            pages = max(1, -(-total // self.page_size))
+            number = min(max(number, 1), pages)
+            body = self.pages.get(number)
+            if body is None:
+                start = (number - 1) * self.page_size
+                body = self.pages[number] = json.dumps({
+                    'rooms': [{'room_id': room_id, 'players': key[0] - free, 'max_players': key[0],
+                               'decks': key[1], 'free': free}
+                              for free, room_id, key in self.rows[start:start + self.page_size]],
+                    'page': number,
+                    'pages': pages,
+                    'total': total,
+                }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            return body
+
+class RoomRegistry:
+    # 辞書そのものの変更は self._lock で守り、ルームごとの操作は room.lock で直列化する。
+    # 別々のルームのハンドラ同士は互いにブロックしない。
+    # スナップショットから読み込んだルームは、最初に使われるか load_pending() で
+    # 順に GameRoom に戻されるまでレコードのまま _pending に置いておく。
+    def __init__(self):
+        self._rooms = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, room_id):
+        return room_id in self._rooms or room_id in self._pending
+
+    def __getitem__(self, room_id):
+        room = self.get(room_id)
+        if room is None:
+            raise KeyError(room_id)
+        return room
+
+    def __len__(self):
+        return len(self._rooms) + len(self._pending)
+
+    def get(self, room_id, default=None):
+        room = self._rooms.get(room_id)
+        if room is None and self._pending:
+            with self._lock:
+                room = self._rooms.get(room_id) or self._load(room_id)
+        return default if room is None else room
+
+    def items(self):
+        self.load_pending()
+        with self._lock:
+            return list(self._rooms.items())
+
+    def restore(self, records):
+        with self._lock:
+            self._pending.update(records)
+
+    def _load(self, room_id):
+        # self._lock を持った状態で呼ぶ
+        record = self._pending.pop(room_id, None)
+        if record is None:
             return None
-        
-        my_info = {
-            'name': player_data['name'],
-            'hand': [card.to_dict() for card in player_data['hand']],
-            'hand_count': len(player_data['hand']),
-            'eliminated': player_data['eliminated'],
-            'position': player_data['position'],
-            'cards_drawn': player_data.get('cards_drawn', 0),
-            'pairs_discarded': player_data.get('pairs_discarded', 0)
+        room = self._rooms[room_id] = decode_room(record, 0, room_id)
+        room_expiry.schedule(weakref.ref(room), room.last_activity.timestamp() + room_expiry.timeout)
+        lobby.update(room)
+        if room.game_phase == 'draw':
+            # サーバーが止まっていた時間は持ち時間に数えない
+            room.turn_start_time = datetime.now()
+            arm_turn_timer(room)
+            schedule_bot_turn(room)
+        return room
+
+    def load_pending(self, batch_size=100):
+        # 少しずつロックを取り直して、復元中もイベント処理を止めない
+        while self._pending:
+            with self._lock:
+                for room_id in list(itertools.islice(self._pending, batch_size)):
+                    self._load(room_id)
+            time.sleep(0)
+
+    def get_or_create(self, room_id, **options):
+        # options (max_players, decks) は新しく作るときだけ使う
+        with self._lock:
+            room = self._rooms.get(room_id) or self._load(room_id)
+            if room is None:
+                room = self._rooms[room_id] = GameRoom(room_id, **options)
+                room_expiry.schedule(weakref.ref(room), time.time() + room_expiry.timeout)
+                log_event(room_id, 'create', room.seed, room.max_players, room.decks)
+            return room
+
+    def discard(self, room_id, room=None):
+        with self._lock:
+            current = self._rooms.get(room_id) or self._load(room_id)
+            if current is None or (room is not None and current is not room):
+                return False
+            del self._rooms[room_id]
+            lobby.remove(room_id)
+        return True
+
+    @contextmanager
+    def locked(self, room_id, create=False, **options):
+        while True:
+            room = self.get_or_create(room_id, **options) if create else self.get(room_id)
+            if room is None:
+                yield None
+                return
+            with room.lock:
+                # ロック待ちの間に削除されたルームは使わない
+                if self._rooms.get(room_id) is room:
+                    yield room
+                    # ハンドラの中で削除されたルームは discard で索引から外れている
+                    if self._rooms.get(room_id) is room:
+                        lobby.update(room)
+                        arm_turn_timer(room)
+                        schedule_bot_turn(room)
+                    flush_event_outbox(room_id)
+                    return
+            if not create:
+                yield None
+                return
+
+# ゲームルームの管理
+game_rooms = RoomRegistry()
+lobby = Lobby(app.config['LOBBY_PAGE_SIZE'], app.config['LOBBY_REFRESH_SECONDS'])
+
+# スナップショットファイルの形式（すべてリトルエンディアン）:
+#   SNAPSHOT_MAGIC の後に [u32 長さ][u8 種別][u8 ルームID長][ルームID][本体] のレコードが続く。
+#   種別 1 はルーム本体、0 は削除済み。同じルームは後のレコードが優先される。
+#   本体は SNAPSHOT_ROOM、上がり順（席番号の列）、プレーヤーごとの
+#   SNAPSHOT_PLAYER + player_id + 名前 + 手札のカードコード列。時刻が無い場合は -1。
+#   プレーヤーの2バイト目はフラグで、bit0 が上がり済み、bit1 がボット。
+SNAPSHOT_MAGIC = b'CGSNAP2\n'
+SNAPSHOT_PHASES = ('waiting', 'discard', 'draw', 'finished')
+SNAPSHOT_RECORD = struct.Struct('<IBB')
+SNAPSHOT_ROOM = struct.Struct('<QQIBBBBddddBB')
+SNAPSHOT_PLAYER = struct.Struct('<BBBIIdHHH')
+ROOM_RECORD, DELETED_RECORD = 1, 0
+
+def encode_room(room):
+    room_id = room.room_id.encode()
+    parts = [b'', room_id, SNAPSHOT_ROOM.pack(
+        room.version, room.seed & 0xFFFFFFFFFFFFFFFF, room.games_started, room.max_players, room.decks,
+        SNAPSHOT_PHASES.index(room.game_phase), room.current_player,
+        room.created_at.timestamp(), room.last_activity.timestamp(),
+        room.game_start_time.timestamp() if room.game_start_time else -1.0,
+        room.turn_start_time.timestamp() if room.turn_start_time else -1.0,
+        len(room.players), len(room.elimination_order)
+    )]
+    positions = {pdata['name']: pdata['position'] for pdata in room.players.values()}
+    parts.append(bytes(positions[name] for name in room.elimination_order))
+    for player_id, pdata in room.players.items():
+        encoded_id = player_id.encode()
+        encoded_name = pdata['name'].encode()
+        hand = pdata['hand']
+        parts.append(SNAPSHOT_PLAYER.pack(
+            pdata['position'], pdata['eliminated'] | pdata['bot'] << 1, hand.slots is not None,
+            pdata['cards_drawn'], pdata['pairs_discarded'], pdata['join_time'].timestamp(),
+            len(encoded_id), len(encoded_name), len(hand)
+        ))
+        parts += [encoded_id, encoded_name, bytes(card.code for card in hand)]
+    body_length = sum(len(part) for part in parts)
+    parts[0] = SNAPSHOT_RECORD.pack(body_length + 2, ROOM_RECORD, len(room_id))
+    return b''.join(parts)
+
+def encode_deleted_room(room_id):
+    room_id = room_id.encode()
+    return SNAPSHOT_RECORD.pack(len(room_id) + 2, DELETED_RECORD, len(room_id)) + room_id
+
+def decode_room(buffer, offset, room_id):
+    (version, seed, games_started, max_players, decks, phase, current_player, created_at, last_activity,
+     game_start_time, turn_start_time, player_count, eliminated_count) = SNAPSHOT_ROOM.unpack_from(buffer, offset)
+    offset += SNAPSHOT_ROOM.size
+    room = GameRoom(room_id, seed=seed, max_players=max_players, decks=decks)
+    room.version = version
+    room.games_started = games_started
+    room.game_phase = SNAPSHOT_PHASES[phase]
+    room.current_player = current_player
+    room.created_at = datetime.fromtimestamp(created_at)
+    room.last_activity = datetime.fromtimestamp(last_activity)
+    room.game_start_time = datetime.fromtimestamp(game_start_time) if game_start_time >= 0 else None
+    room.turn_start_time = datetime.fromtimestamp(turn_start_time) if turn_start_time >= 0 else None
+    elimination_positions = buffer[offset:offset + eliminated_count]
+    offset += eliminated_count
+    
+    seats = [None] * player_count
+    for _ in range(player_count):
+        (position, flags, indexed, cards_drawn, pairs_discarded, join_time,
+         id_length, name_length, hand_length) = SNAPSHOT_PLAYER.unpack_from(buffer, offset)
+        offset += SNAPSHOT_PLAYER.size
+        player_id = str(buffer[offset:offset + id_length], 'utf-8')
+        offset += id_length
+        name = str(buffer[offset:offset + name_length], 'utf-8')
+        offset += name_length
+        hand = Hand([CARDS[code] for code in buffer[offset:offset + hand_length]])
+        offset += hand_length
+        if indexed:
+            hand.reindex()
+        # 接続は復元しない。再接続した時点で sid を付け直す
+        seats[position] = room.players[player_id] = {
+            'name': name,
+            'hand': hand,
+            'eliminated': bool(flags & 1),
+            'sid': None,
+            'bot': bool(flags & 2),
+            'suspended_at': None,
+            'encoding': 'json',
+            'position': position,
+            'join_time': datetime.fromtimestamp(join_time),
+            'cards_drawn': cards_drawn,
+            'pairs_discarded': pairs_discarded
         }
+    room.seats = seats
+    room.elimination_order = [seats[position]['name'] for position in elimination_positions]
+    room.rebuild_turn_ring()
+    return room
+
+def read_snapshot(path):
+    # room_id → ルーム本体のレコード（decode_room(record, 0, room_id) で GameRoom に戻す）。
+    # 最後まで書き切れていないレコード（書き込み中のクラッシュ）は無視する
+    rooms = {}
+    with open(path, 'rb') as snapshot_file:
+        size = os.fstat(snapshot_file.fileno()).st_size
+        if size <= len(SNAPSHOT_MAGIC):
+            return rooms
+        with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            if buffer[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a room snapshot")
+            offset = len(SNAPSHOT_MAGIC)
+            header = SNAPSHOT_RECORD.size - 2
+            while offset + SNAPSHOT_RECORD.size <= size:
+                length, kind, id_length = SNAPSHOT_RECORD.unpack_from(buffer, offset)
+                end = offset + header + length
+                if end > size:
+                    break
+                start = offset + SNAPSHOT_RECORD.size
+                room_id = str(buffer[start:start + id_length], 'utf-8')
+                if kind == ROOM_RECORD:
+                    rooms[room_id] = buffer[start + id_length:end]
+                else:
+                    rooms.pop(room_id, None)
+                offset = end
+    return rooms
+
+class RoomSnapshotter:
+    # 前回から version が変わったルームだけを追記専用ファイルへ書き出す。
+    # 書き出しは別スレッドで行い、イベント処理側はルームのロックを1件ずつ短時間取られるだけ。
+    # ファイルが生きているレコードの compact_ratio 倍を超えたら、全ルームを書いた新しいファイルに置き換える。
+    def __init__(self, path, interval=5.0, compact_ratio=2.0, batch_size=1000):
+        self.path = path
+        self.interval = interval
+        self.compact_ratio = compact_ratio
+        self.batch_size = batch_size
+        self.saved = {}
+        self.live_bytes = 0
+        self.file_bytes = 0
+        self.snapshots = 0
+        self.rooms_written = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def restore(self):
+        if not os.path.exists(self.path):
+            return 0
+        start = time.perf_counter()
+        rooms = read_snapshot(self.path)
+        game_rooms.restore(rooms)
+        logger.info(f"Restored {len(rooms)} rooms from {self.path} in {time.perf_counter() - start:.3f}s")
+        return len(rooms)
+
+    def collect(self, full=False):
+        records = []
+        saved = {}
+        for index, (room_id, room) in enumerate(game_rooms.items()):
+            previous = self.saved.get(room_id)
+            if not full and previous is not None and previous[0]() is room and previous[1] == room.version:
+                saved[room_id] = previous
+                continue
+            with room.lock:
+                version = room.version
+                record = encode_room(room)
+            records.append(record)
+            saved[room_id] = (weakref.ref(room), version, len(record))
+            if index % self.batch_size == self.batch_size - 1:
+                # 大量のルームを書くときもイベント処理スレッドに GIL を譲る
+                time.sleep(0)
+        if not full:
+            records += [encode_deleted_room(room_id) for room_id in self.saved if room_id not in saved]
+        return records, saved
+
+    def snapshot(self):
+        with self.lock:
+            if self.file_bytes == 0 or self.file_bytes > self.compact_ratio * max(self.live_bytes, 1):
+                return self.compact()
+            records, saved = self.collect()
+            if records:
+                data = b''.join(records)
+                with open(self.path, 'ab') as snapshot_file:
+                    snapshot_file.write(data)
+                    snapshot_file.flush()
+                    os.fsync(snapshot_file.fileno())
+                self.file_bytes += len(data)
+            self.saved = saved
+            self.live_bytes = sum(entry[2] for entry in saved.values())
+            self.snapshots += 1
+            self.rooms_written += len(records)
+            return len(records)
+
+    def compact(self):
+        records, saved = self.collect(full=True)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'wb') as snapshot_file:
+            snapshot_file.write(SNAPSHOT_MAGIC)
+            snapshot_file.write(b''.join(records))
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary, self.path)
+        self.saved = saved
+        self.live_bytes = sum(entry[2] for entry in saved.values())
+        self.file_bytes = len(SNAPSHOT_MAGIC) + self.live_bytes
+        self.snapshots += 1
+        self.rooms_written += len(records)
+        return len(records)
+
+    def run(self):
+        game_rooms.load_pending()
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.snapshot()
+            except Exception as e:
+                logger.error(f"Room snapshot error: {e}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.snapshot)
+
+room_snapshots = None
+
+def start_room_snapshots(path):
+    global room_snapshots
+    room_snapshots = RoomSnapshotter(path, app.config['SNAPSHOT_INTERVAL_SECONDS'])
+    room_snapshots.restore()
+    room_snapshots.start()
+    return room_snapshots
+
+class ConsistentHashRing:
+    def __init__(self, nodes, replicas=100):
+        ring = sorted((self.hash(f"{node_id}:{replica}"), node_id)
+                      for node_id in range(nodes) for replica in range(replicas))
+        self.points = [point for point, _ in ring]
+        self.owners = [node_id for _, node_id in ring]
+
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def owner(self, key):
+        index = bisect.bisect(self.points, self.hash(key)) % len(self.points)
+        return self.owners[index]
+
+class QueuePubSub:
+    # ノードごとに受信キューを1本持つ。queue.Queue なら同一プロセス内（テスト用）、
+    # multiprocessing.Queue なら fork したワーカー間で使える。
+    def __init__(self, nodes, queue_factory=queue.Queue):
+        self.queues = [queue_factory() for _ in range(nodes)]
+
+    def publish(self, node_id, message):
+        targets = self.queues if node_id is None else [self.queues[node_id]]
+        for target in targets:
+            target.put(message)
+
+    def subscribe(self, node_id, callback):
+        def listen():
+            while True:
+                message = self.queues[node_id].get()
+                if message is None:
+                    break
+                callback(message)
+        socketio.start_background_task(listen)
+
+class RedisPubSub:
+    def __init__(self, url, prefix='card_game'):
+        if redis is None:
+            raise RuntimeError("PUBSUB_URL に Redis を指定するには redis パッケージが必要です")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def channel(self, node_id):
+        return f"{self.prefix}:all" if node_id is None else f"{self.prefix}:node:{node_id}"
+
+    def publish(self, node_id, message):
+        self.client.publish(self.channel(node_id), json.dumps(message))
+
+    def subscribe(self, node_id, callback):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel(node_id), self.channel(None))
         
-        other_players = []
-        for pid, pdata in self.players.items():
-            if pid != player_id:
-                other_players.append({
-                    'name': pdata['name'],
-                    'hand_count': len(pdata['hand']),
-                    'eliminated': pdata['eliminated'],
-                    'position': pdata['position']
-                })
-        
-        return {
-            'room_id': self.room_id,
-            'my_info': my_info,
-            'other_players': other_players,
-            'current_player_position': self.current_player,
-            'game_phase': self.game_phase,
-            'elimination_order': self.elimination_order,
-            'player_count': len(self.players),
-            'game_start_time': self.game_start_time.isoformat() if self.game_start_time else None
-        }
+        def listen():
+            for item in pubsub.listen():
+                callback(json.loads(item['data']))
+        socketio.start_background_task(listen)
 
-def cleanup_inactive_rooms():
-    current_time = datetime.now()
-    rooms_to_delete = []
-    
-    for room_id, room in game_rooms.items():
-        if room.is_room_inactive():
-            rooms_to_delete.append(room_id)
-    
-    for room_id in rooms_to_delete:
-        logger.info(f"Cleaning up inactive room: {room_id}")
-        del game_rooms[room_id]
-    
-    return len(rooms_to_delete)
+class ClusterNode:
+    # ルームは room_id のコンシステントハッシュで担当ノードが決まる。
+    # 担当外のルームのイベントは担当ノードへ転送し、接続を持つノードが送信・入退室を行う。
+    def __init__(self, node_id, nodes, pubsub):
+        self.node_id = node_id
+        self.nodes = nodes
+        self.ring = ConsistentHashRing(nodes)
+        self.pubsub = pubsub
+        self.forwarded = 0
 
-@app.route('/')
-def index():
-    html_template = '''
-<!DOCTYPE html>
-<html lang="ja">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>マルチプレーヤー ババ抜き</title>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.7.2/socket.io.min.js"></script>
-    <style>
-        * { box-sizing: border-box; }
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 20px;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            min-height: 100vh;
-            line-height: 1.6;
-        }
-        .container {
-            background: rgba(255, 255, 255, 0.1);
-            padding: 30px;
-            border-radius: 20px;
-            backdrop-filter: blur(15px);
-            box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3);
-            border: 1px solid rgba(255, 255, 255, 0.1);
-        }
-        h1 {
-            text-align: center;
-            margin-bottom: 30px;
-            text-shadow: 2px 2px 4px rgba(0, 0, 0, 0.5);
-            font-size: 2.5em;
-            background: linear-gradient(45deg, #ffd700, #ffed4e);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            background-clip: text;
-        }
-        .setup {
-            text-align: center;
-            margin-bottom: 30px;
-        }
-        .input-group {
-            margin: 20px 0;
-            position: relative;
-        }
-        .input-group label {
-            display: block;
-            margin-bottom: 8px;
-            font-weight: 600;
-            color: #ffd700;
-        }
-        input[type="text"] {
-            padding: 15px 25px;
-            border: none;
-            border-radius: 30px;
-            font-size: 16px;
-            width: 300px;
-            max-width: 100%;
-            text-align: center;
-            transition: all 0.3s ease;
-            background: rgba(255, 255, 255, 0.9);
-            color: #333;
-        }
-        input[type="text"]:focus {
-            outline: none;
-            transform: translateY(-2px);
-            box-shadow: 0 5px 15px rgba(0, 0, 0, 0.3);
-            background: rgba(255, 255, 255, 1);
-        }
-        button {
-            background: linear-gradient(45deg, #ff6b6b, #ee5a24);
-            color: white;
-            border: none;
-            padding: 15px 30px;
-            border-radius: 30px;
-            font-size: 16px;
-            font-weight: 600;
-            cursor: pointer;
-            margin: 10px;
-            transition: all 0.3s ease;
-            box-shadow: 0 4px 15px rgba(0, 0, 0, 0.2);
-        }
-        button:hover:not(:disabled) {
-            transform: translateY(-3px);
-            box-shadow: 0 8px 25px rgba(0, 0, 0, 0.3);
-            background: linear-gradient(45deg, #ff5252, #d63031);
-        }
-        button:active:not(:disabled) {
-            transform: translateY(-1px);
-        }
-        button:disabled {
-            opacity: 0.6;
-            cursor: not-allowed;
-            transform: none;
-        }
-        .game-area {
-            display: none;
-        }
-        .message {
-            text-align: center;
-            margin: 20px 0;
-            padding: 20px;
-            background: rgba(255, 255, 255, 0.15);
-            border-radius: 15px;
-            font-weight: 500;
-            white-space: pre-line;
-            border-left: 4px solid #ffd700;
-            animation: slideIn 0.5s ease;
-        }
-        @keyframes slideIn {
-            from { opacity: 0; transform: translateY(20px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-        .room-info {
-            background: rgba(255, 255, 255, 0.2);
-            padding: 20px;
-            border-radius: 15px;
-            margin: 20px 0;
-            text-align: center;
-            font-weight: 600;
-            border: 2px solid rgba(255, 215, 0, 0.3);
-        }
-        .my-hand {
-            background: rgba(255, 215, 0, 0.2);
-            padding: 25px;
-            border-radius: 15px;
-            margin: 25px 0;
-            border: 2px solid rgba(255, 215, 0, 0.4);
-        }
-        .my-hand h3 {
-            color: #ffd700;
-            text-shadow: 1px 1px 2px rgba(0, 0, 0, 0.5);
-        }
-        .cards {
-            display: flex;
-            flex-wrap: wrap;
-            gap: 12px;
-            justify-content: center;
-            margin: 20px 0;
-        }
-        .card {
-            background: linear-gradient(145deg, #ffffff, #f0f0f0);
-            color: #333;
-            padding: 12px;
-            border-radius: 10px;
-            min-width: 70px;
-            text-align: center;
-            font-weight: bold;
-            font-size: 14px;
-            box-shadow: 0 4px 8px rgba(0, 0, 0, 0.2);
-            transition: all 0.3s ease;
-            border: 2px solid #ddd;
-        }
-        .card:hover {
-            transform: translateY(-5px) scale(1.05);
-            box-shadow: 0 8px 16px rgba(0, 0, 0, 0.3);
-        }
-        .card.joker {
-            background: linear-gradient(45deg, #ff6b6b, #ee5a24);
-            color: white;
-            border: 2px solid #c0392b;
-            animation: pulse 2s infinite;
-        }
-        @keyframes pulse {
-            0%, 100% { transform: scale(1); }
-            50% { transform: scale(1.05); }
-        }
-        .other-players {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 20px;
-            margin: 25px 0;
-        }
-        .other-player {
-            background: rgba(255, 255, 255, 0.15);
-            padding: 20px;
-            border-radius: 15px;
-            text-align: center;
-            transition: all 0.3s ease;
-            border: 2px solid transparent;
-        }
-        .other-player:hover {
-            background: rgba(255, 255, 255, 0.2);
-            transform: translateY(-2px);
-        }
-        .current-turn {
-            border: 3px solid #ffd700;
-            box-shadow: 0 0 20px rgba(255, 215, 0, 0.6);
-            background: rgba(255, 215, 0, 0.1);
-            animation: glow 2s ease-in-out infinite alternate;
-        }
-        @keyframes glow {
-            from { box-shadow: 0 0 20px rgba(255, 215, 0, 0.6); }
-            to { box-shadow: 0 0 30px rgba(255, 215, 0, 0.9); }
-        }
-        .eliminated {
-            opacity: 0.5;
-            filter: grayscale(100%);
-        }
-        .connection-status {
-            position: fixed;
-            top: 15px;
-            right: 15px;
-            padding: 8px 15px;
-            border-radius: 20px;
-            font-size: 12px;
-            font-weight: 600;
-            z-index: 1000;
-            transition: all 0.3s ease;
-        }
-        .connected {
-            background: linear-gradient(45deg, #00b894, #00a085);
-            color: white;
-            box-shadow: 0 2px 10px rgba(0, 184, 148, 0.3);
-        }
-        .disconnected {
-            background: linear-gradient(45deg, #e17055, #d63031);
-            color: white;
-            box-shadow: 0 2px 10px rgba(214, 48, 49, 0.3);
-        }
-        .connecting {
-            background: linear-gradient(45deg, #fdcb6e, #e17055);
-            color: white;
-            box-shadow: 0 2px 10px rgba(225, 112, 85, 0.3);
-        }
-        .card-back {
-            background: linear-gradient(145deg, #4a90e2, #357abd);
-            color: white;
-            padding: 12px;
-            border-radius: 10px;
-            min-width: 70px;
-            text-align: center;
-            font-weight: bold;
-            font-size: 14px;
-            box-shadow: 0 4px 8px rgba(0, 0, 0, 0.2);
-            cursor: pointer;
-            transition: all 0.3s ease;
-            border: 2px solid #2980b9;
-        }
-        .card-back:hover {
-            transform: translateY(-5px) scale(1.1);
-            box-shadow: 0 8px 20px rgba(0, 0, 0, 0.4);
-            border: 3px solid #ffd700;
-        }
-        .card-back:active {
-            transform: translateY(-2px) scale(1.05);
-        }
-        .game-order {
-            background: rgba(255, 215, 0, 0.15);
-            padding: 25px;
-            border-radius: 20px;
-            margin: 25px 0;
-            border: 2px solid #ffd700;
-            text-align: center;
-            box-shadow: 0 4px 15px rgba(255, 215, 0, 0.2);
-        }
-        .game-order h3 {
-            color: #ffd700;
-            text-shadow: 1px 1px 2px rgba(0, 0, 0, 0.5);
-            margin-bottom: 15px;
-        }
-        .stats {
-            background: rgba(255, 255, 255, 0.1);
-            padding: 15px;
-            border-radius: 10px;
-            margin: 15px 0;
-            font-size: 14px;
-            text-align: center;
-        }
-        .error-message {
-            background: rgba(231, 76, 60, 0.2);
-            border: 2px solid #e74c3c;
-            color: #fff;
-            padding: 15px;
-            border-radius: 10px;
-            margin: 15px 0;
-            animation: shake 0.5s ease-in-out;
-        }
-        @keyframes shake {
-            0%, 100% { transform: translateX(0); }
-            25% { transform: translateX(-5px); }
-            75% { transform: translateX(5px); }
-        }
-        .success-message {
-            background: rgba(46, 204, 113, 0.2);
-            border: 2px solid #2ecc71;
-            color: #fff;
-            padding: 15px;
-            border-radius: 10px;
-            margin: 15px 0;
-        }
-        @media (max-width: 768px) {
-            body { padding: 10px; }
-            .container { padding: 20px; }
-            h1 { font-size: 2em; }
-            input[type="text"] { width: 100%; }
-            .other-players { grid-template-columns: 1fr; }
-            .cards { gap: 8px; }
-            .card, .card-back { min-width: 60px; padding: 8px; font-size: 12px; }
-        }
-    </style>
-</head>
-<body>
-    <div class="connection-status" id="connectionStatus">接続中...</div>
+    def start(self):
+        self.pubsub.subscribe(self.node_id, self.handle_message)
+
+    def owner(self, room_id):
+        return self.ring.owner(room_id)
+
+    def is_local(self, room_id):
+        return self.owner(room_id) == self.node_id
+
+    def forward(self, room_id, event, data, sid, origin=None):
+        self.forwarded += 1
+        self.pubsub.publish(self.owner(room_id), {
+            'kind': 'event', 'event': event, 'data': data, 'sid': sid,
+            'origin': self.node_id if origin is None else origin
+        })
+
+    def send(self, node_id, kind, **fields):
+        fields['kind'] = kind
+        self.pubsub.publish(node_id, fields)
+
+    def handle_message(self, message):
+        kind = message['kind']
+        try:
+            if kind == 'event':
+                run_room_event(message['event'], message['data'], message['sid'], message['origin'])
+            elif kind == 'emit':
+                socketio.emit(message['event'], message['data'], room=message['to'])
+            elif kind == 'join':
+                join_room(message['room'], sid=message['sid'], namespace='/')
+            elif kind == 'leave':
+                leave_room(message['room'], sid=message['sid'], namespace='/')
+            elif kind == 'bind':
+                set_connection_session(message['sid'], message['player_id'], message['room_id'])
+        except Exception as e:
+            logger.error(f"Cluster message error ({kind}): {e}")
+
+cluster = None
+
+def configure_cluster(node_id, nodes, pubsub):
+    global cluster
+    cluster = ClusterNode(node_id, nodes, pubsub)
+    cluster.start()
+    logger.info(f"Cluster node {node_id}/{nodes} started")
+    return cluster
+
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class LatencyHistogram:
+    # ラベル値ごとに [各バケットの件数..., +Inf の件数, 合計秒数] を持つ。observe は1回の bisect と加算のみ
+    def __init__(self, name, documentation, label):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    def snapshot(self):
+        with self.lock:
+            series = {label_value: list(values) for label_value, values in self.series.items()}
+        result = {}
+        for label_value, values in series.items():
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), values):
+                cumulative += count
+                buckets[bound] = cumulative
+            result[label_value] = {'count': cumulative, 'sum': values[-1], 'buckets': buckets}
+        return result
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_value, data in sorted(self.snapshot().items()):
+            for bound, count in data['buckets'].items():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="{le}"}} {count}')
+            lines.append(f'{self.name}_sum{{{self.label}="{label_value}"}} {data["sum"]}')
+            lines.append(f'{self.name}_count{{{self.label}="{label_value}"}} {data["count"]}')
+        return lines
+
+class EventCounter:
+    def __init__(self, name, documentation, label):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_value, amount=1):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_value, value in sorted(self.snapshot().items()):
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+event_latency = LatencyHistogram('card_game_event_seconds', 'Socket event handler latency', 'event')
+event_errors = EventCounter('card_game_event_errors_total', 'Socket event handlers that raised', 'event')
+serialize_latency = LatencyHistogram('card_game_serialize_seconds',
+                                     'Time spent building per-player state payloads', 'kind')
+fanout_latency = LatencyHistogram('card_game_emit_fanout_seconds',
+                                  'Time spent emitting state payloads to a room', 'kind')
+
+def metrics_snapshot():
+    return {
+        'events': event_latency.snapshot(),
+        'errors': event_errors.snapshot(),
+        'serialize': serialize_latency.snapshot(),
+        'fanout': fanout_latency.snapshot(),
+        'rooms': len(game_rooms),
+        'lobby_open_rooms': len(lobby),
+        'room_expiry': room_expiry.stats(),
+        'turn_timers': dict(turn_timers.stats(), timeouts=turn_timeouts),
+        'bot_turns': {'pending': len(bot_turns), 'played_total': bot_turns.turns},
+        'cluster_forwarded': cluster.forwarded if cluster else 0,
+    }
+
+def render_metrics():
+    lines = []
+    for metric in (event_latency, event_errors, serialize_latency, fanout_latency):
+        lines.extend(metric.render())
+    expiry = room_expiry.stats()
+    lines += [
+        "# HELP card_game_rooms Rooms currently held by this process",
+        "# TYPE card_game_rooms gauge",
+        f"card_game_rooms {len(game_rooms)}",
+        "# HELP card_game_lobby_open_rooms Waiting rooms with free seats in the lobby index",
+        "# TYPE card_game_lobby_open_rooms gauge",
+        f"card_game_lobby_open_rooms {len(lobby)}",
+        "# HELP card_game_room_expiry_pending Rooms scheduled on the expiry wheel",
+        "# TYPE card_game_room_expiry_pending gauge",
+        f"card_game_room_expiry_pending {expiry['pending']}",
+        "# HELP card_game_rooms_expired_total Rooms evicted for inactivity",
+        "# TYPE card_game_rooms_expired_total counter",
+        f"card_game_rooms_expired_total {expiry['expired_total']}",
+        "# HELP card_game_room_expiry_last_tick Rooms evicted on the last expiry tick",
+        "# TYPE card_game_room_expiry_last_tick gauge",
+        f"card_game_room_expiry_last_tick {expiry['last_tick_expired']}",
+        "# HELP card_game_turn_timers_pending Rooms with a turn deadline on the timer wheel",
+        "# TYPE card_game_turn_timers_pending gauge",
+        f"card_game_turn_timers_pending {turn_timers.pending}",
+        "# HELP card_game_turn_timeouts_total Turns drawn automatically after the turn timer expired",
+        "# TYPE card_game_turn_timeouts_total counter",
+        f"card_game_turn_timeouts_total {turn_timeouts}",
+        "# HELP card_game_bot_turns_pending Rooms waiting for a bot to take its turn",
+        "# TYPE card_game_bot_turns_pending gauge",
+        f"card_game_bot_turns_pending {len(bot_turns)}",
+        "# HELP card_game_bot_turns_total Turns taken by server-side bots",
+        "# TYPE card_game_bot_turns_total counter",
+        f"card_game_bot_turns_total {bot_turns.turns}",
+    ]
+    if cluster is not None:
+        lines += [
+            "# HELP card_game_cluster_forwarded_total Events forwarded to the owning node",
+            "# TYPE card_game_cluster_forwarded_total counter",
+            f"card_game_cluster_forwarded_total {cluster.forwarded}",
+        ]
+    return '\n'.join(lines) + '\n'
+
+# 接続 (sid) ごとの参加情報。切断は接続を持つノードで処理されるため、各ノードが自分の接続分だけ持つ
+connection_sessions = {}
+# クラスタのとき、担当ノードが持つ 接続 (sid) → その接続を持つノード。sid 宛ての送信はそのノードにだけ送る
+connection_nodes = {}
+room_event_handlers = {}
+event_context = threading.local()
+
+# reply() で積んだフレームの宛先。フラッシュ時に event_context.sid に置き換える
+REPLY = object()
+
+# ASGI モードの python-socketio AsyncServer（create_asgi_app で作る）
+async_server = None
+# 実行中のタスクへの参照（イベントループは弱参照しか持たないため）
+async_tasks = set()
+# ASGI モードで、直近のハンドラの記録の fsync を待つ Future。済むまでの送信はその後ろに並べる
+event_log_barrier = None
+
+def start_async_task(awaitable):
+    task = asyncio.ensure_future(awaitable)
+    async_tasks.add(task)
+    task.add_done_callback(async_tasks.discard)
+    return task
+
+def schedule_async(result):
+    # AsyncServer のメソッドはバージョンによってコルーチンを返す。待たずにイベントループへ渡す
+    if inspect.isawaitable(result):
+        if event_log_barrier is not None and not event_log_barrier.done():
+            start_async_task(after_event_log(event_log_barrier, result))
+        else:
+            start_async_task(result)
+
+async def after_event_log(barrier, awaitable):
+    # Future は番号順に済み、待っていたタスクは登録順に再開するので、送信の順序は変わらない
+    await barrier
+    await awaitable
+
+def current_sid():
+    return event_context.sid
+
+def negotiate_encoding(data):
+    # クライアントが 'packed' を申し出たときだけ使う。Redis 経由のクラスタはメッセージを JSON で
+    # 転送するのでバイト列を運べず、JSON のままにする
+    if data.get('encoding') != 'packed' or (cluster is not None and isinstance(cluster.pubsub, RedisPubSub)):
+        return 'json'
+    return 'packed'
+
+def deliver(event, data, to):
+    if async_server is not None:
+        schedule_async(async_server.emit(event, data, room=to))
+    elif cluster is None:
+        socketio.emit(event, data, room=to)
+    else:
+        # ルーム宛てと、どのノードの接続か分からない sid 宛ては全ノードへ送る
+        node_id = connection_nodes.get(to)
+        if node_id == cluster.node_id:
+            socketio.emit(event, data, room=to)
+        else:
+            cluster.send(node_id, 'emit', event=event, data=data, to=to)
+
+def deliver_reply(event, data):
+    if event_context.sid is None:
+        # 再接続の猶予切れや持ち時間切れなど、サーバー自身が起こしたイベントには返信先が無い
+        return
+    if async_server is not None:
+        schedule_async(async_server.emit(event, data, room=event_context.sid))
+    elif cluster is None or event_context.origin == cluster.node_id:
+        socketio.emit(event, data, room=event_context.sid)
+    else:
+        cluster.send(event_context.origin, 'emit', event=event, data=data, to=event_context.sid)
+
+def send_event(event, data, to):
+    outbox = getattr(event_context, 'outbox', None)
+    if outbox is not None:
+        outbox.append((to, event, data))
+    else:
+        wait_for_event_log()
+        deliver(event, data, to)
+
+def reply(event, data):
+    outbox = getattr(event_context, 'outbox', None)
+    if outbox is not None:
+        outbox.append((REPLY, event, data))
+    else:
+        wait_for_event_log()
+        deliver_reply(event, data)
+
+def flush_outbox(outbox, room_id):
+    # 1つのハンドラが送ったフレームを宛先の接続ごとにまとめ、2件以上なら 'batch' 1回で送る。
+    # ルーム宛てのフレームはその時点のプレーヤー全員と観戦者のルームに配り直し、
+    # JSON へのエンコードはフレームごとに1回だけ行う。観戦者へはプレーヤーに送り終えてから送る。
+    members = None
+    watchers = None
+    channel = spectator_channel(room_id) if room_id else None
+    room = game_rooms.get(room_id) if room_id else None
+    if room is not None and any(to == room_id for to, _, _ in outbox):
+        with room.lock:
+            members = [pdata['sid'] for pdata in room.players.values() if pdata['sid'] is not None]
+            if room.spectators:
+                watchers = channel
+    
+    recipients = {}
+    for index, (to, _, _) in enumerate(outbox):
+        if to is REPLY:
+            to = event_context.sid
+            if to is None:
+                continue
+        if members is not None and to == room_id:
+            for sid in members:
+                recipients.setdefault(sid, []).append(index)
+            if watchers is not None:
+                recipients.setdefault(watchers, []).append(index)
+        else:
+            recipients.setdefault(to, []).append(index)
     
-    <div class="container">
-        <h1>🎴 マルチプレーヤー ババ抜き 🎴</h1>
-        
-        <div id="setup" class="setup">
-            <div class="input-group">
-                <label for="playerName">プレーヤー名</label>
-                <input type="text" id="playerName" placeholder="お名前をご入力ください" maxlength="20">
-            </div>
-            <div class="input-group">
-                <label for="roomId">ルームID</label>
-                <input type="text" id="roomId" placeholder="新規作成の場合は空白" maxlength="10">
-            </div>
-            <button type="button" id="joinButton">🚀 ゲームに参加する</button>
-            <div class="stats">
-                <small>💡 ルームIDを空白にすると新しいルームが作成されます</small>
-            </div>
-        </div>
+    encoded = {}
+    for to, indexes in sorted(recipients.items(), key=lambda item: item[0] == channel):
+        if len(indexes) == 1:
+            _, event, data = outbox[indexes[0]]
+        else:
+            for index in indexes:
+                if index not in encoded:
+                    _, frame_event, frame_data = outbox[index]
+                    try:
+                        encoded[index] = json.dumps([frame_event, frame_data], ensure_ascii=False,
+                                                    separators=(',', ':'))
+                    except TypeError:
+                        # バイト列（packed の手札）を含むフレームは Socket.IO にバイナリ添付として任せる
+                        encoded[index] = None
+            if any(encoded[index] is None for index in indexes):
+                event, data = 'batch', [[outbox[index][1], outbox[index][2]] for index in indexes]
+            else:
+                event, data = 'batch', '[' + ','.join(encoded[index] for index in indexes) + ']'
+        if to == event_context.sid:
+            deliver_reply(event, data)
+        else:
+            deliver(event, data, to)
 
-        <div id="game" class="game-area">
-            <div id="roomInfo" class="room-info"></div>
-            <div id="message" class="message"></div>
-            
-            <div id="gameOrder" class="game-order" style="display: none;">
-                <h3>🎮 ゲーム情報</h3>
-                <div id="orderText"></div>
-            </div>
-            
-            <div id="myHand" class="my-hand">
-                <h3>🃏 あなたの手札</h3>
-                <div id="myCards" class="cards"></div>
-                <div id="myStats" class="stats"></div>
-            </div>
-            
-            <div id="otherPlayers" class="other-players"></div>
-            
-            <div style="text-align: center; margin: 30px 0;">
-                <button id="discardBtn" style="display: none;">🗑️ ペアを捨てる</button>
-                <button id="startBtn" style="display: none;">🎮 ゲーム開始</button>
-                <button onclick="leaveGame()">🚪 ゲーム退出</button>
-            </div>
-        </div>
-    </div>
+def enter_room(room_id):
+    if async_server is not None:
+        schedule_async(async_server.enter_room(event_context.sid, room_id))
+    elif cluster is None or event_context.origin == cluster.node_id:
+        join_room(room_id, sid=event_context.sid, namespace='/')
+    else:
+        cluster.send(event_context.origin, 'join', room=room_id, sid=event_context.sid)
+
+def exit_room(room_id):
+    if event_context.sid is None:
+        return
+    if async_server is not None:
+        schedule_async(async_server.leave_room(event_context.sid, room_id))
+    elif cluster is None or event_context.origin == cluster.node_id:
+        leave_room(room_id, sid=event_context.sid, namespace='/')
+    else:
+        cluster.send(event_context.origin, 'leave', room=room_id, sid=event_context.sid)
+
+def set_connection_session(sid, player_id, room_id):
+    # player_id が None のものは観戦中の接続。room_id が None なら対応を外す
+    if room_id is None:
+        connection_sessions.pop(sid, None)
+    else:
+        connection_sessions[sid] = (player_id, room_id)
+
+def bind_connection(player_id, room_id):
+    if cluster is not None:
+        if room_id is None:
+            connection_nodes.pop(event_context.sid, None)
+        else:
+            connection_nodes[event_context.sid] = event_context.origin
+    if cluster is None or event_context.origin == cluster.node_id:
+        set_connection_session(event_context.sid, player_id, room_id)
+    else:
+        cluster.send(event_context.origin, 'bind', sid=event_context.sid,
+                     player_id=player_id, room_id=room_id)
+
+def routing_key(data):
+    return str(data.get('room_id') or '').strip().upper()
+
+def flush_event_outbox(room_id):
+    # ハンドラがここまでに積んだフレームを送り出す。RoomRegistry.locked がルームのロックを
+    # 離す前に呼ぶので、同じルームの別のハンドラのフレームと version の順序が入れ替わらない
+    outbox = getattr(event_context, 'outbox', None)
+    if not outbox:
+        return
+    event_context.outbox = []
+    # 先行書き込み: このハンドラの記録が fsync されてから送る。ルームのロックを持ったまま待つので、
+    # 同じルームの次のハンドラのフレームが先に出ることはない
+    wait_for_event_log()
+    flushed = time.perf_counter()
+    try:
+        flush_outbox(outbox, room_id)
+    except Exception as e:
+        logger.error(f"Emit flush error: {e}")
+    fanout_latency.observe('flush', time.perf_counter() - flushed)
+
+def run_room_event(event, data, sid, origin):
+    previous = (getattr(event_context, 'sid', None), getattr(event_context, 'origin', None),
+                getattr(event_context, 'outbox', None))
+    event_context.sid = sid
+    event_context.origin = origin
+    event_context.outbox = [] if app.config['BATCH_EMITS'] else None
+    start = time.perf_counter()
+    try:
+        room_event_handlers[event](data)
+    except Exception as e:
+        event_errors.inc(event)
+        logger.error(f"SocketIO error: {e}")
+        reply('error', {'message': 'サーバーエラーが発生しました。ページを再読み込みしてください。'})
+    finally:
+        # 通常は RoomRegistry.locked の中で送り終えている。ここに残るのはルームのロックの外で積んだ返信だけ
+        flush_event_outbox(routing_key(data) if isinstance(data, dict) else None)
+        event_latency.observe(event, time.perf_counter() - start)
+        event_context.sid, event_context.origin, event_context.outbox = previous
+
+def dispatch_room_event(event, data, sid, origin=None):
+    # origin は接続を持つノード。ハンドラの中から別のルームへ回し直すときは元の origin を引き継ぐ
+    if cluster is not None and not cluster.is_local(routing_key(data)):
+        cluster.forward(routing_key(data), event, data, sid, origin)
+    else:
+        run_room_event(event, data, sid, origin if origin is not None else cluster.node_id if cluster else None)
+
+def room_event(event):
+    # ルームに対するイベントを登録する。担当ノードで実行され、送信は reply/send_event を使う
+    def decorator(handler):
+        room_event_handlers[event] = handler
+        socketio.on(event)(lambda data: dispatch_room_event(event, data, request.sid))
+        return handler
+    return decorator
+
+def spectator_channel(room_id):
+    # 観戦者だけが入る Socket.IO のルーム。プレーヤーのルーム (room_id) とは分けておく
+    return f"{room_id}:watch"
+
+def emit_spectator_state(room):
+    if room.spectators:
+        send_event('spectator_state', room.spectator_frame(), spectator_channel(room.room_id))
+
+def emit_state_snapshots(room):
+    room.version += 1
+    start = time.perf_counter()
+    # sid が None のプレーヤー（スナップショットから復元され、まだ再接続していない）には送らない
+    snapshots = [(pdata['sid'], room.to_dict_for_player(pid))
+                 for pid, pdata in room.players.items() if pdata['sid'] is not None]
+    built = time.perf_counter()
+    for sid, snapshot in snapshots:
+        send_event('game_state_updated', snapshot, sid)
+    emit_spectator_state(room)
+    serialize_latency.observe('snapshot', built - start)
+    fanout_latency.observe('snapshot', time.perf_counter() - built)
+
+def emit_state_patches(room, before, moves):
+    room.version += 1
+    start = time.perf_counter()
+    patches = room.build_patches(before, moves)
+    built = time.perf_counter()
+    for pid, patch in patches.items():
+        sid = room.players[pid]['sid']
+        if sid is not None:
+            send_event('game_state_patch', patch, sid)
+    emit_spectator_state(room)
+    serialize_latency.observe('patch', built - start)
+    fanout_latency.observe('patch', time.perf_counter() - built)
+
+CLIENT_CSS = '''
+* { box-sizing: border-box; }
+body {
+    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+    max-width: 1200px;
+    margin: 0 auto;
+    padding: 20px;
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    color: white;
+    min-height: 100vh;
+    line-height: 1.6;
+}
+.container {
+    background: rgba(255, 255, 255, 0.1);
+    padding: 30px;
+    border-radius: 20px;
+    backdrop-filter: blur(15px);
+    box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3);
+    border: 1px solid rgba(255, 255, 255, 0.1);
+}
+h1 {
+    text-align: center;
+    margin-bottom: 30px;
+    text-shadow: 2px 2px 4px rgba(0, 0, 0, 0.5);
+    font-size: 2.5em;
+    background: linear-gradient(45deg, #ffd700, #ffed4e);
+    -webkit-background-clip: text;
+    -webkit-text-fill-color: transparent;
+    background-clip: text;
+}
+.setup {
+    text-align: center;
+    margin-bottom: 30px;
+}
+.input-group {
+    margin: 20px 0;
+    position: relative;
+}
+.input-group label {
+    display: block;
+    margin-bottom: 8px;
+    font-weight: 600;
+    color: #ffd700;
+}
+input[type="text"], select {
+    padding: 15px 25px;
+    border: none;
+    border-radius: 30px;
+    font-size: 16px;
+    width: 300px;
+    max-width: 100%;
+    text-align: center;
+    transition: all 0.3s ease;
+    background: rgba(255, 255, 255, 0.9);
+    color: #333;
+}
+input[type="text"]:focus, select:focus {
+    outline: none;
+    transform: translateY(-2px);
+    box-shadow: 0 5px 15px rgba(0, 0, 0, 0.3);
+    background: rgba(255, 255, 255, 1);
+}
+button {
+    background: linear-gradient(45deg, #ff6b6b, #ee5a24);
+    color: white;
+    border: none;
+    padding: 15px 30px;
+    border-radius: 30px;
+    font-size: 16px;
+    font-weight: 600;
+    cursor: pointer;
+    margin: 10px;
+    transition: all 0.3s ease;
+    box-shadow: 0 4px 15px rgba(0, 0, 0, 0.2);
+}
+button:hover:not(:disabled) {
+    transform: translateY(-3px);
+    box-shadow: 0 8px 25px rgba(0, 0, 0, 0.3);
+    background: linear-gradient(45deg, #ff5252, #d63031);
+}
+button:active:not(:disabled) {
+    transform: translateY(-1px);
+}
+button:disabled {
+    opacity: 0.6;
+    cursor: not-allowed;
+    transform: none;
+}
+.game-area {
+    display: none;
+}
+.lobby {
+    background: rgba(255, 255, 255, 0.1);
+    padding: 15px;
+    border-radius: 10px;
+    margin: 15px auto;
+    max-width: 500px;
+}
+.lobby h3 {
+    color: #ffd700;
+    margin-bottom: 10px;
+}
+.lobby-room {
+    display: flex;
+    justify-content: space-between;
+    align-items: center;
+    padding: 8px 15px;
+    margin: 5px 0;
+    border-radius: 20px;
+    background: rgba(255, 255, 255, 0.15);
+    cursor: pointer;
+    transition: all 0.3s ease;
+}
+.lobby-room:hover {
+    background: rgba(255, 215, 0, 0.3);
+}
+.lobby-pager button {
+    padding: 5px 15px;
+    margin: 5px;
+}
+.message {
+    text-align: center;
+    margin: 20px 0;
+    padding: 20px;
+    background: rgba(255, 255, 255, 0.15);
+    border-radius: 15px;
+    font-weight: 500;
+    white-space: pre-line;
+    border-left: 4px solid #ffd700;
+    animation: slideIn 0.5s ease;
+}
+@keyframes slideIn {
+    from { opacity: 0; transform: translateY(20px); }
+    to { opacity: 1; transform: translateY(0); }
+}
+.room-info {
+    background: rgba(255, 255, 255, 0.2);
+    padding: 20px;
+    border-radius: 15px;
+    margin: 20px 0;
+    text-align: center;
+    font-weight: 600;
+    border: 2px solid rgba(255, 215, 0, 0.3);
+}
+.my-hand {
+    background: rgba(255, 215, 0, 0.2);
+    padding: 25px;
+    border-radius: 15px;
+    margin: 25px 0;
+    border: 2px solid rgba(255, 215, 0, 0.4);
+}
+.my-hand h3 {
+    color: #ffd700;
+    text-shadow: 1px 1px 2px rgba(0, 0, 0, 0.5);
+}
+.cards {
+    display: flex;
+    flex-wrap: wrap;
+    gap: 12px;
+    justify-content: center;
+    margin: 20px 0;
+}
+.card {
+    background: linear-gradient(145deg, #ffffff, #f0f0f0);
+    color: #333;
+    padding: 12px;
+    border-radius: 10px;
+    min-width: 70px;
+    text-align: center;
+    font-weight: bold;
+    font-size: 14px;
+    box-shadow: 0 4px 8px rgba(0, 0, 0, 0.2);
+    transition: all 0.3s ease;
+    border: 2px solid #ddd;
+}
+.card:hover {
+    transform: translateY(-5px) scale(1.05);
+    box-shadow: 0 8px 16px rgba(0, 0, 0, 0.3);
+}
+.card.joker {
+    background: linear-gradient(45deg, #ff6b6b, #ee5a24);
+    color: white;
+    border: 2px solid #c0392b;
+    animation: pulse 2s infinite;
+}
+@keyframes pulse {
+    0%, 100% { transform: scale(1); }
+    50% { transform: scale(1.05); }
+}
+.other-players {
+    display: grid;
+    grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
+    gap: 20px;
+    margin: 25px 0;
+}
+.other-player {
+    background: rgba(255, 255, 255, 0.15);
+    padding: 20px;
+    border-radius: 15px;
+    text-align: center;
+    transition: all 0.3s ease;
+    border: 2px solid transparent;
+}
+.other-player:hover {
+    background: rgba(255, 255, 255, 0.2);
+    transform: translateY(-2px);
+}
+.current-turn {
+    border: 3px solid #ffd700;
+    box-shadow: 0 0 20px rgba(255, 215, 0, 0.6);
+    background: rgba(255, 215, 0, 0.1);
+    animation: glow 2s ease-in-out infinite alternate;
+}
+@keyframes glow {
+    from { box-shadow: 0 0 20px rgba(255, 215, 0, 0.6); }
+    to { box-shadow: 0 0 30px rgba(255, 215, 0, 0.9); }
+}
+.eliminated {
+    opacity: 0.5;
+    filter: grayscale(100%);
+}
+.connection-status {
+    position: fixed;
+    top: 15px;
+    right: 15px;
+    padding: 8px 15px;
+    border-radius: 20px;
+    font-size: 12px;
+    font-weight: 600;
+    z-index: 1000;
+    transition: all 0.3s ease;
+}
+.connected {
+    background: linear-gradient(45deg, #00b894, #00a085);
+    color: white;
+    box-shadow: 0 2px 10px rgba(0, 184, 148, 0.3);
+}
+.disconnected {
+    background: linear-gradient(45deg, #e17055, #d63031);
+    color: white;
+    box-shadow: 0 2px 10px rgba(214, 48, 49, 0.3);
+}
+.connecting {
+    background: linear-gradient(45deg, #fdcb6e, #e17055);
+    color: white;
+    box-shadow: 0 2px 10px rgba(225, 112, 85, 0.3);
+}
+.card-back {
+    background: linear-gradient(145deg, #4a90e2, #357abd);
+    color: white;
+    padding: 12px;
+    border-radius: 10px;
+    min-width: 70px;
+    text-align: center;
+    font-weight: bold;
+    font-size: 14px;
+    box-shadow: 0 4px 8px rgba(0, 0, 0, 0.2);
+    cursor: pointer;
+    transition: all 0.3s ease;
+    border: 2px solid #2980b9;
+}
+.card-back:hover {
+    transform: translateY(-5px) scale(1.1);
+    box-shadow: 0 8px 20px rgba(0, 0, 0, 0.4);
+    border: 3px solid #ffd700;
+}
+.card-back:active {
+    transform: translateY(-2px) scale(1.05);
+}
+.game-order {
+    background: rgba(255, 215, 0, 0.15);
+    padding: 25px;
+    border-radius: 20px;
+    margin: 25px 0;
+    border: 2px solid #ffd700;
+    text-align: center;
+    box-shadow: 0 4px 15px rgba(255, 215, 0, 0.2);
+}
+.game-order h3 {
+    color: #ffd700;
+    text-shadow: 1px 1px 2px rgba(0, 0, 0, 0.5);
+    margin-bottom: 15px;
+}
+.stats {
+    background: rgba(255, 255, 255, 0.1);
+    padding: 15px;
+    border-radius: 10px;
+    margin: 15px 0;
+    font-size: 14px;
+    text-align: center;
+}
+.error-message {
+    background: rgba(231, 76, 60, 0.2);
+    border: 2px solid #e74c3c;
+    color: #fff;
+    padding: 15px;
+    border-radius: 10px;
+    margin: 15px 0;
+    animation: shake 0.5s ease-in-out;
+}
+@keyframes shake {
+    0%, 100% { transform: translateX(0); }
+    25% { transform: translateX(-5px); }
+    75% { transform: translateX(5px); }
+}
+.success-message {
+    background: rgba(46, 204, 113, 0.2);
+    border: 2px solid #2ecc71;
+    color: #fff;
+    padding: 15px;
+    border-radius: 10px;
+    margin: 15px 0;
+}
+@media (max-width: 768px) {
+    body { padding: 10px; }
+    .container { padding: 20px; }
+    h1 { font-size: 2em; }
+    input[type="text"], select { width: 100%; }
+    .other-players { grid-template-columns: 1fr; }
+    .cards { gap: 8px; }
+    .card, .card-back { min-width: 60px; padding: 8px; font-size: 12px; }
+}
+'''
 
-<script>
+CLIENT_JS = '''
 var socket = null;
 var gameState = null;
 var playerId = null;
@@ -601,6 +1742,23 @@ var roomId = null;
 var isConnected = false;
 var lastClickTime = 0;
 var clickDebounceMs = 500;
+var lobbyPage = 1;
+var lobbyTimer = null;
+var isSpectator = false;
+
+// カードコード → カード。サーバーの CARDS と同じ並び（0 がジョーカー、以降は数字ごとに4スート）
+var CARD_TABLE = (function() {
+    var values = [null, null, '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A'];
+    var suits = ['♠', '♥', '♦', '♣'];
+    var table = [{code: 0, value: 0, suit: 0, is_joker: true, display: '🃏'}];
+    for (var value = 2; value <= 14; value++) {
+        for (var suit = 0; suit < 4; suit++) {
+            table.push({code: table.length, value: value, suit: suit, is_joker: false,
+                        display: values[value] + suits[suit]});
+        }
+    }
+    return table;
+})();
 
 function showMessage(text, type) {
     var messageElement = document.getElementById('message');
@@ -651,6 +1809,8 @@ function validateInput() {
     
     var isValid = nameInput.value.trim().length >= 2;
     joinButton.disabled = !isValid || !isConnected;
+    var quickMatchButton = document.getElementById('quickMatchButton');
+    if (quickMatchButton) quickMatchButton.disabled = !isValid || !isConnected;
     
     if (nameInput.value.length > 0 && nameInput.value.length < 2) {
         nameInput.style.borderColor = '#e74c3c';
@@ -721,15 +1881,29 @@ function initializeSocket() {
 }
 
 function setupSocketHandlers() {
+    // サーバーが1回の操作で送る複数のフレームは、JSON 文字列の配列として1つにまとめて届く
+    socket.on('batch', function(payload) {
+        // バイナリを含むまとめは、JSON 文字列ではなく [イベント名, データ] の配列のまま届く
+        var frames = typeof payload === 'string' ? JSON.parse(payload) : payload;
+        for (var i = 0; i < frames.length; i++) {
+            var listeners = socket.listeners(frames[i][0]);
+            for (var j = 0; j < listeners.length; j++) {
+                listeners[j](frames[i][1]);
+            }
+        }
+    });
+
     socket.on('connect', function() {
         console.log('Socket.IOに接続されました');
         updateConnectionStatus('connected');
+        // サーバー再起動後の再接続では、復元されたルームの状態を取り直す
+        requestFullState();
     });
 
     socket.on('disconnect', function() {
         console.log('Socket.IOから切断されました');
         updateConnectionStatus('disconnected');
-        showMessage('サーバーとの接続が切断されました。', 'error');
+        showMessage('サーバーとの接続が切断されました。再接続を試みています...', 'error');
     });
 
     socket.on('connect_error', function(error) {
@@ -744,9 +1918,14 @@ function setupSocketHandlers() {
         var joinButton = document.getElementById('joinButton');
         joinButton.disabled = false;
         joinButton.textContent = '🚀 ゲームに参加する';
+        document.getElementById('quickMatchButton').textContent = '🎲 おまかせ参加';
+        validateInput();
         
         if (data.success) {
             console.log('ゲーム参加成功');
+            // おまかせ参加ではサーバーがルームを選ぶ
+            roomId = data.game_state.room_id;
+            stopLobbyRefresh();
             document.getElementById('setup').style.display = 'none';
             document.getElementById('game').style.display = 'block';
             updateGameDisplay(data.game_state);
@@ -757,11 +1936,35 @@ function setupSocketHandlers() {
         }
     });
 
+    socket.on('spectate_started', function(data) {
+        if (!data.success) {
+            isSpectator = false;
+            showMessage(data.message, 'error');
+            return;
+        }
+        stopLobbyRefresh();
+        document.getElementById('setup').style.display = 'none';
+        document.getElementById('game').style.display = 'block';
+        document.getElementById('myHand').style.display = 'none';
+        updateSpectatorView(JSON.parse(data.state));
+    });
+
+    // 観戦者向けの状態は、サーバーで1回だけ JSON にした文字列のまま全員に届く
+    socket.on('spectator_state', function(data) {
+        if (isSpectator) {
+            updateSpectatorView(JSON.parse(data));
+        }
+    });
+
     socket.on('game_state_updated', function(data) {
         console.log('game_state_updatedイベント受信');
         updateGameDisplay(data);
     });
 
+    socket.on('game_state_patch', function(data) {
+        applyStatePatch(data);
+    });
+
     socket.on('player_joined', function(data) {
         console.log('player_joinedイベント受信');
         showMessage(data.message, 'success');
@@ -827,7 +2030,10 @@ function joinGame() {
         socket.emit('join_game', {
             player_id: playerId,
             room_id: roomId,
-            name: name
+            name: name,
+            max_players: parseInt(document.getElementById('maxPlayers').value, 10),
+            decks: parseInt(document.getElementById('deckCount').value, 10),
+            encoding: 'packed'
         });
         console.log('join_gameイベントを送信しました');
     } catch (error) {
@@ -836,14 +2042,135 @@ function joinGame() {
         button.textContent = '🚀 ゲームに参加する';
         showMessage('参加に失敗しました。もう一度お試しください。', 'error');
     }
-    
-    setTimeout(function() {
-        if (button.disabled && button.textContent === '🔄 参加中...') {
-            button.disabled = false;
-            button.textContent = '🚀 ゲームに参加する';
-            showMessage('参加に時間がかかっています。もう一度お試しください。', 'error');
-        }
-    }, 15000);
+    
+    setTimeout(function() {
+        if (button.disabled && button.textContent === '🔄 参加中...') {
+            button.disabled = false;
+            button.textContent = '🚀 ゲームに参加する';
+            showMessage('参加に時間がかかっています。もう一度お試しください。', 'error');
+        }
+    }, 15000);
+}
+
+function quickMatch() {
+    if (!socket || !isConnected) {
+        showMessage('サーバーに接続中です。少しお待ちください...', 'error');
+        return;
+    }
+    
+    var name = document.getElementById('playerName').value.trim();
+    if (name.length < 2 || name.length > 20) {
+        showMessage('名前は2文字以上20文字以内で入力してください', 'error');
+        return;
+    }
+    
+    playerId = generatePlayerId();
+    roomId = null;
+    
+    var button = document.getElementById('quickMatchButton');
+    button.disabled = true;
+    button.textContent = '🔄 ルームを探しています...';
+    document.getElementById('joinButton').disabled = true;
+    
+    socket.emit('quick_match', {
+        player_id: playerId,
+        name: name,
+        max_players: parseInt(document.getElementById('maxPlayers').value, 10),
+        decks: parseInt(document.getElementById('deckCount').value, 10),
+        encoding: 'packed'
+    });
+}
+
+function spectateGame() {
+    if (!socket || !isConnected) {
+        showMessage('サーバーに接続中です。少しお待ちください...', 'error');
+        return;
+    }
+    
+    var room = document.getElementById('roomId').value.trim();
+    if (!room) {
+        showMessage('観戦するルームIDを入力してください', 'error');
+        return;
+    }
+    
+    playerId = null;
+    roomId = room;
+    isSpectator = true;
+    socket.emit('spectate', {room_id: roomId});
+}
+
+function updateSpectatorView(state) {
+    var roomInfo = document.getElementById('roomInfo');
+    if (roomInfo) {
+        var roomLabel = document.createElement('strong');
+        roomLabel.textContent = state.room_id;
+        roomInfo.textContent = '👀 観戦中 | 🏠 ルームID: ';
+        roomInfo.appendChild(roomLabel);
+        roomInfo.appendChild(document.createTextNode(
+            ' | 👥 プレーヤー: ' + state.player_count + '/' + state.max_players + '人'));
+    }
+    
+    if (state.game_phase === 'waiting') {
+        showMessage('プレーヤーを待機中... (' + state.player_count + '/' + state.max_players + '人)');
+    } else if (state.game_phase === 'finished') {
+        var resultText = '🎉 ゲーム終了！\\n\\n';
+        for (var i = 0; i < state.elimination_order.length; i++) {
+            resultText += (i + 1) + '位: ' + state.elimination_order[i] + '\\n';
+        }
+        showMessage(resultText);
+    }
+    
+    // 自分の席が無いので、どのプレーヤーの手札も引けない表示になる
+    updateOtherPlayers(state.players, state.current_player_position, -1);
+}
+
+function loadLobby(page) {
+    fetch('/lobby?page=' + page)
+        .then(function(response) { return response.json(); })
+        .then(function(data) {
+            lobbyPage = data.page;
+            var list = document.getElementById('lobbyRooms');
+            list.innerHTML = '';
+            if (data.rooms.length === 0) {
+                list.innerHTML = '<small>募集中のルームはありません</small>';
+            }
+            data.rooms.forEach(function(room) {
+                var row = document.createElement('div');
+                row.className = 'lobby-room';
+                // ルームIDは利用者が入力した文字列なので、HTML としては解釈させない
+                var roomLabel = document.createElement('span');
+                roomLabel.textContent = room.room_id;
+                var seatsLabel = document.createElement('span');
+                seatsLabel.textContent = '👥 ' + room.players + '/' + room.max_players + '人・🃏 ' + room.decks + 'デッキ';
+                row.appendChild(roomLabel);
+                row.appendChild(seatsLabel);
+                row.onclick = function() {
+                    document.getElementById('roomId').value = room.room_id;
+                    if (debounceClick()) joinGame();
+                };
+                list.appendChild(row);
+            });
+            document.getElementById('lobbyPage').textContent = data.page + ' / ' + data.pages;
+            document.getElementById('lobbyPrev').disabled = data.page <= 1;
+            document.getElementById('lobbyNext').disabled = data.page >= data.pages;
+        })
+        .catch(function(error) {
+            console.warn('ロビーの取得に失敗しました:', error);
+        });
+}
+
+function startLobbyRefresh() {
+    loadLobby(lobbyPage);
+    if (lobbyTimer === null) {
+        lobbyTimer = setInterval(function() { loadLobby(lobbyPage); }, 5000);
+    }
+}
+
+function stopLobbyRefresh() {
+    if (lobbyTimer !== null) {
+        clearInterval(lobbyTimer);
+        lobbyTimer = null;
+    }
 }
 
 function startGame() {
@@ -862,6 +2189,22 @@ function startGame() {
     });
 }
 
+function addBots() {
+    if (!socket || !isConnected) {
+        showMessage('サーバーに接続されていません', 'error');
+        return;
+    }
+    
+    if (!debounceClick()) {
+        return;
+    }
+    
+    socket.emit('add_bots', {
+        player_id: playerId,
+        room_id: roomId
+    });
+}
+
 function discardPairs() {
     if (!socket || !isConnected) {
         showMessage('サーバーに接続されていません', 'error');
@@ -897,6 +2240,20 @@ function drawCard(fromPosition, cardIndex) {
 }
 
 function leaveGame() {
+    if (isSpectator) {
+        if (socket && isConnected) {
+            socket.emit('stop_spectating', {room_id: roomId});
+        }
+        isSpectator = false;
+        roomId = null;
+        document.getElementById('myHand').style.display = '';
+        document.getElementById('setup').style.display = 'block';
+        document.getElementById('game').style.display = 'none';
+        startLobbyRefresh();
+        showMessage('観戦を終了しました。', 'success');
+        return;
+    }
+    
     if (!confirm('本当にゲームから退出しますか？')) {
         return;
     }
@@ -917,19 +2274,105 @@ function leaveGame() {
     
     document.getElementById('playerName').value = '';
     document.getElementById('roomId').value = '';
+    validateInput();
+    startLobbyRefresh();
     
     showMessage('ゲームから退出しました。', 'success');
 }
 
+function requestFullState() {
+    if (socket && isConnected && isSpectator && roomId) {
+        // 再接続後は新しい接続として観戦し直す
+        socket.emit('spectate', {room_id: roomId});
+    } else if (socket && isConnected && playerId && roomId) {
+        socket.emit('request_state', {
+            player_id: playerId,
+            room_id: roomId,
+            encoding: 'packed'
+        });
+    }
+}
+
+function applyStatePatch(patch) {
+    if (!gameState || patch.version !== gameState.version + 1) {
+        console.log('パッチの順序が一致しないため、全体の状態を再取得します');
+        requestFullState();
+        return;
+    }
+    
+    var keys = ['current_player_position', 'game_phase', 'game_start_time', 'elimination_order'];
+    for (var i = 0; i < keys.length; i++) {
+        if (patch.hasOwnProperty(keys[i])) {
+            gameState[keys[i]] = patch[keys[i]];
+        }
+    }
+    
+    if (patch.players) {
+        for (var i = 0; i < patch.players.length; i++) {
+            var changed = patch.players[i];
+            for (var j = 0; j < gameState.other_players.length; j++) {
+                var other = gameState.other_players[j];
+                if (other.position === changed.position) {
+                    other.hand_count = changed.hand_count;
+                    other.eliminated = changed.eliminated;
+                }
+            }
+        }
+    }
+    
+    if (patch.my_info) {
+        var myInfo = gameState.my_info;
+        var info = patch.my_info;
+        if (info.hand_added_codes) {
+            info.hand_added = decodeCards(info.hand_added_codes);
+        }
+        if (info.hand_removed) {
+            // 同じカードが複数枚ある場合に備えて、1コードにつき1枚ずつ外す
+            var removed = info.hand_removed.slice();
+            myInfo.hand = myInfo.hand.filter(function(card) {
+                var index = removed.indexOf(card.code);
+                if (index === -1) return true;
+                removed.splice(index, 1);
+                return false;
+            });
+        }
+        if (info.hand_added) {
+            myInfo.hand = myInfo.hand.concat(info.hand_added);
+        }
+        var myKeys = ['hand_count', 'eliminated', 'cards_drawn', 'pairs_discarded'];
+        for (var i = 0; i < myKeys.length; i++) {
+            if (info.hasOwnProperty(myKeys[i])) {
+                myInfo[myKeys[i]] = info[myKeys[i]];
+            }
+        }
+    }
+    
+    gameState.version = patch.version;
+    updateGameDisplay(gameState);
+}
+
+function decodeCodes(packed) {
+    // packed エンコーディングでは、手札全体は1枚1バイトのコード列（ArrayBuffer）、差分はコードの配列で届く
+    return Array.prototype.slice.call(new Uint8Array(packed));
+}
+
+function decodeCards(packed) {
+    return decodeCodes(packed).map(function(code) { return CARD_TABLE[code]; });
+}
+
 function updateGameDisplay(state) {
     if (!state) return;
     
+    if (state.my_info && state.my_info.hand_codes) {
+        state.my_info.hand = decodeCards(state.my_info.hand_codes);
+        delete state.my_info.hand_codes;
+    }
     gameState = state;
     
     var roomInfo = document.getElementById('roomInfo');
     if (roomInfo) {
         var infoText = '🏠 ルームID: <strong>' + state.room_id + '</strong> | ';
-        infoText += '👥 プレーヤー: ' + state.player_count + '/3人';
+        infoText += '👥 プレーヤー: ' + state.player_count + '/' + state.max_players + '人';
         if (state.game_start_time) {
             var startTime = new Date(state.game_start_time);
             var elapsed = Math.floor((Date.now() - startTime.getTime()) / 1000);
@@ -939,8 +2382,8 @@ function updateGameDisplay(state) {
     }
     
     if (state.game_phase === 'waiting') {
-        if (state.player_count < 3) {
-            showMessage('プレーヤーを待機中... (' + state.player_count + '/3人)\\n\\n' +
+        if (state.player_count < state.max_players) {
+            showMessage('プレーヤーを待機中... (' + state.player_count + '/' + state.max_players + '人)\\n\\n' +
                       '🔗 ルームID「' + state.room_id + '」を他のプレーヤーに教えてください！\\n' +
                       '💡 このIDを共有すれば、友達も参加できます。');
         } else {
@@ -967,7 +2410,7 @@ function showGameOrderMessage(state) {
     allPlayers.sort(function(a, b) { return a.position - b.position; });
     
     var myPosition = state.my_info.position;
-    var nextPosition = (myPosition + 1) % 3;
+    var nextPosition = (myPosition + 1) % allPlayers.length;
     var targetPlayer = null;
     for (var i = 0; i < allPlayers.length; i++) {
         if (allPlayers[i].position === nextPosition) {
@@ -992,7 +2435,7 @@ function showGameOrderMessage(state) {
     
     for (var i = 0; i < allPlayers.length; i++) {
         var player = allPlayers[i];
-        var fromIndex = (i + 1) % 3;
+        var fromIndex = (i + 1) % allPlayers.length;
         var fromPlayer = allPlayers[fromIndex];
         
         if (player.position === myPosition) {
@@ -1114,10 +2557,11 @@ function isNextPlayer(myPosition, targetPosition) {
 function updateButtons(state) {
     var startBtn = document.getElementById('startBtn');
     var discardBtn = document.getElementById('discardBtn');
+    var addBotsBtn = document.getElementById('addBotsBtn');
     
     if (startBtn) {
         startBtn.style.display = 
-            (state.game_phase === 'waiting' && state.player_count === 3) ? 'inline-block' : 'none';
+            (state.game_phase === 'waiting' && state.player_count === state.max_players) ? 'inline-block' : 'none';
         startBtn.onclick = startGame;
     }
     
@@ -1126,6 +2570,12 @@ function updateButtons(state) {
             (state.game_phase === 'discard') ? 'inline-block' : 'none';
         discardBtn.onclick = discardPairs;
     }
+    
+    if (addBotsBtn) {
+        addBotsBtn.style.display = 
+            (state.game_phase === 'waiting' && state.player_count < state.max_players) ? 'inline-block' : 'none';
+        addBotsBtn.onclick = addBots;
+    }
 }
 
 document.addEventListener('DOMContentLoaded', function() {
@@ -1140,6 +2590,19 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    document.getElementById('quickMatchButton').addEventListener('click', function() {
+        if (debounceClick()) quickMatch();
+    });
+    document.getElementById('spectateButton').addEventListener('click', function() {
+        if (debounceClick()) spectateGame();
+    });
+    document.getElementById('lobbyPrev').addEventListener('click', function() {
+        loadLobby(lobbyPage - 1);
+    });
+    document.getElementById('lobbyNext').addEventListener('click', function() {
+        loadLobby(lobbyPage + 1);
+    });
+    
     var playerNameInput = document.getElementById('playerName');
     var roomIdInput = document.getElementById('roomId');
     
@@ -1168,6 +2631,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     initializeSocket();
+    startLobbyRefresh();
 });
 
 window.addEventListener('error', function(e) {
@@ -1197,271 +2661,564 @@ window.addEventListener('beforeunload', function(e) {
         });
     }
 });
-</script>
+'''
+
+INDEX_HTML = '''
+<!DOCTYPE html>
+<html lang="ja">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>マルチプレーヤー ババ抜き</title>
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.7.2/socket.io.min.js"></script>
+    <link rel="stylesheet" href="{css_url}">
+</head>
+<body>
+    <div class="connection-status" id="connectionStatus">接続中...</div>
+    
+    <div class="container">
+        <h1>🎴 マルチプレーヤー ババ抜き 🎴</h1>
+        
+        <div id="setup" class="setup">
+            <div class="input-group">
+                <label for="playerName">プレーヤー名</label>
+                <input type="text" id="playerName" placeholder="お名前をご入力ください" maxlength="20">
+            </div>
+            <div class="input-group">
+                <label for="roomId">ルームID</label>
+                <input type="text" id="roomId" placeholder="新規作成の場合は空白" maxlength="10">
+            </div>
+            <div class="input-group">
+                <label for="maxPlayers">人数（新規作成時）</label>
+                <select id="maxPlayers">
+                    {player_options}
+                </select>
+            </div>
+            <div class="input-group">
+                <label for="deckCount">デッキ数（新規作成時）</label>
+                <select id="deckCount">
+                    {deck_options}
+                </select>
+            </div>
+            <button type="button" id="joinButton">🚀 ゲームに参加する</button>
+            <button type="button" id="quickMatchButton">🎲 おまかせ参加</button>
+            <button type="button" id="spectateButton">👀 観戦する</button>
+            <div class="stats">
+                <small>💡 ルームIDを空白にすると新しいルームが作成されます。おまかせ参加は同じ人数・デッキ数で募集中のルームに入ります</small>
+            </div>
+            <div id="lobby" class="lobby">
+                <h3>📋 募集中のルーム</h3>
+                <div id="lobbyRooms"></div>
+                <div class="lobby-pager">
+                    <button type="button" id="lobbyPrev">◀</button>
+                    <span id="lobbyPage"></span>
+                    <button type="button" id="lobbyNext">▶</button>
+                </div>
+            </div>
+        </div>
+
+        <div id="game" class="game-area">
+            <div id="roomInfo" class="room-info"></div>
+            <div id="message" class="message"></div>
+            
+            <div id="gameOrder" class="game-order" style="display: none;">
+                <h3>🎮 ゲーム情報</h3>
+                <div id="orderText"></div>
+            </div>
+            
+            <div id="myHand" class="my-hand">
+                <h3>🃏 あなたの手札</h3>
+                <div id="myCards" class="cards"></div>
+                <div id="myStats" class="stats"></div>
+            </div>
+            
+            <div id="otherPlayers" class="other-players"></div>
+            
+            <div style="text-align: center; margin: 30px 0;">
+                <button id="discardBtn" style="display: none;">🗑️ ペアを捨てる</button>
+                <button id="addBotsBtn" style="display: none;">🤖 空席をボットで埋める</button>
+                <button id="startBtn" style="display: none;">🎮 ゲーム開始</button>
+                <button onclick="leaveGame()">🚪 ゲーム退出</button>
+            </div>
+        </div>
+    </div>
+
+<script src="{js_url}"></script>
 </body>
 </html>
-    '''
-    return render_template_string(html_template)
+'''
+
+class StaticAsset:
+    # 起動時に一度だけエンコード・圧縮し、リクエストごとにはバイト列を返すだけにする
+    def __init__(self, text, mimetype, cache_control):
+        body = text.encode('utf-8')
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:20]
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, 9)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=11)
+        self.etags = {encoding: f'"{self.digest}-{encoding}"' for encoding in self.variants}
+
+    def choose_encoding(self, accept_encoding):
+        accepted = {}
+        for part in accept_encoding.split(','):
+            name, _, params = part.strip().partition(';')
+            quality = 1.0
+            if params.strip().startswith('q='):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip().lower()] = quality
+        
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding
+        return 'identity'
 
-@socketio.on('join_game')
+    def prepare(self, accept_encoding, if_none_match):
+        # (ステータス, ヘッダー, 本体) を返す。Flask と ASGI の両方から使う
+        encoding = self.choose_encoding(accept_encoding)
+        etag = self.etags[encoding]
+        headers = {
+            'ETag': etag,
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        
+        if etag in if_none_match or if_none_match.strip() == '*':
+            return 304, headers, b''
+        return 200, headers, self.variants[encoding]
+
+    def response(self):
+        status, headers, body = self.prepare(request.headers.get('Accept-Encoding', ''),
+                                             request.headers.get('If-None-Match', ''))
+        if status == 304:
+            return Response(status=304, headers=headers)
+        return Response(body, headers=headers, mimetype=self.mimetype)
+
+# URL にハッシュを含めるので、CSS/JS は長期キャッシュできる
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+client_css = StaticAsset(CLIENT_CSS, 'text/css', ASSET_CACHE_CONTROL)
+client_js = StaticAsset(CLIENT_JS, 'application/javascript', ASSET_CACHE_CONTROL)
+index_page = StaticAsset(
+    INDEX_HTML.format(
+        css_url=f'/assets/app.css?v={client_css.digest}',
+        js_url=f'/assets/app.js?v={client_js.digest}',
+        player_options=''.join(
+            f'<option value="{n}"{" selected" if n == 3 else ""}>{n}人</option>'
+            for n in range(MIN_PLAYERS, MAX_PLAYERS + 1)),
+        deck_options=''.join(f'<option value="{n}">{n}</option>' for n in range(1, MAX_DECKS + 1))
+    ),
+    'text/html', 'no-cache'
+)
+
+@app.route('/')
+def index():
+    return index_page.response()
+
+@app.route('/assets/app.css')
+def client_css_asset():
+    return client_css.response()
+
+@app.route('/assets/app.js')
+def client_js_asset():
+    return client_js.response()
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/lobby')
+def lobby_listing():
+    return Response(lobby.page(request.args.get('page', 1, type=int)), mimetype='application/json')
+
+@room_event('join_game')
 def handle_join_game(data):
     player_id = data['player_id']
     room_id = data['room_id']
     name = data['name']
     
     if not name or len(name.strip()) < 2 or len(name.strip()) > 20:
-        emit('game_joined', {
+        reply('game_joined', {
             'success': False,
             'message': '名前は2文字以上20文字以内で入力してください'
         })
         return
     
     if not room_id or len(room_id) > 10:
-        emit('game_joined', {
+        reply('game_joined', {
             'success': False,
             'message': 'ルームIDは10文字以内で入力してください'
         })
         return
     
+    max_players = data.get('max_players', 3)
+    decks = data.get('decks', 1)
+    if (not isinstance(max_players, int) or not MIN_PLAYERS <= max_players <= MAX_PLAYERS
+            or not isinstance(decks, int) or not 1 <= decks <= MAX_DECKS):
+        reply('game_joined', {
+            'success': False,
+            'message': f'人数は{MIN_PLAYERS}〜{MAX_PLAYERS}人、デッキ数は1〜{MAX_DECKS}で指定してください'
+        })
+        return
+    
     name = name.strip()
     room_id = room_id.strip().upper()
+    # 自動マッチ（quick_match）で回ってきた場合は、それまでに試したルームIDの一覧
+    tried = data.get('quick_match') if isinstance(data.get('quick_match'), list) else None
+    retry = tried is not None and len(tried) < QUICK_MATCH_ATTEMPTS - 1
+    
+    with game_rooms.locked(room_id, create=True, max_players=max_players, decks=decks) as room:
+        result, message = room.add_player(player_id, name, current_sid())
+        if result:
+            room.players[player_id]['encoding'] = negotiate_encoding(data)
+            log_event(room_id, 'join_game', player_id, name)
+            enter_room(room_id)
+            bind_connection(player_id, room_id)
+            room.version += 1
+            
+            reply('game_joined', {
+                'success': True,
+                'game_state': room.to_dict_for_player(player_id)
+            })
+            
+            for pid in room.players:
+                if pid != player_id and room.players[pid]['sid'] is not None:
+                    send_event('player_joined', {
+                        'message': f'🎉 {name}がゲームに参加しました！',
+                        'game_state': room.to_dict_for_player(pid)
+                    }, room.players[pid]['sid'])
+            emit_spectator_state(room)
+            
+            room.add_to_history('player_joined', name)
+            
+        elif not retry:
+            reply('game_joined', {
+                'success': False,
+                'message': message
+            })
+    
+    if not result and retry:
+        # 選んだルームが先に埋まっていた（または同じ名前のプレーヤーがいた）ので、別のルームでやり直す。
+        # 他のルームのロックを取るので、このルームのロックを離してから回す
+        dispatch_room_event('join_game', quick_match_request(data, tried + [room_id]),
+                            current_sid(), event_context.origin)
+
+def new_room_id():
+    while True:
+        room_id = ''.join(random.choices(ROOM_ID_CHARS, k=6))
+        if room_id not in game_rooms:
+            return room_id
+
+def quick_match_request(data, tried=()):
+    # 索引から条件の合う空席のあるルームを選び、join_game のデータにする。
+    # 見つからないとき、または最後の試行では新しいルームを作る
+    max_players = data.get('max_players', 3)
+    decks = data.get('decks', 1)
+    room_id = None
+    if isinstance(max_players, int) and isinstance(decks, int) and len(tried) < QUICK_MATCH_ATTEMPTS - 1:
+        room_id = lobby.match(max_players, decks, tried)
+    return dict(data, room_id=room_id or new_room_id(), quick_match=list(tried))
+
+def quick_match(data):
+    dispatch_room_event('join_game', quick_match_request(data), current_sid(), event_context.origin)
+
+# room_id を持たないので、ASGI モードでは全員が同じ待ち行列に入り、届いた順にマッチする
+room_event_handlers['quick_match'] = quick_match
+
+@socketio.on('quick_match')
+def handle_quick_match(data):
+    # マッチは受け取ったノードの索引で行い、選んだルームの担当ノードへ join_game として回す
+    run_room_event('quick_match', data, request.sid, cluster.node_id if cluster else None)
+
+@room_event('add_bots')
+def handle_add_bots(data):
+    # 待機中のルームの空席をボットで埋める。count を省略すると空席をすべて埋める
+    room_id = data['room_id']
+    player_id = data['player_id']
     
-    if room_id not in game_rooms:
-        game_rooms[room_id] = GameRoom(room_id)
-    
-    room = game_rooms[room_id]
-    
-    result, message = room.add_player(player_id, name, request.sid)
-    if result:
-        join_room(room_id)
-        session['player_id'] = player_id
-        session['room_id'] = room_id
-        
-        emit('game_joined', {
-            'success': True,
-            'game_state': room.to_dict_for_player(player_id)
-        })
+    with game_rooms.locked(room_id) as room:
+        if room is None:
+            return
         
-        for pid in room.players:
-            if pid != player_id:
-                emit('player_joined', {
-                    'message': f'🎉 {name}がゲームに参加しました！',
-                    'game_state': room.to_dict_for_player(pid)
-                }, room=room.players[pid]['sid'])
+        player_data = room.players.get(player_id)
+        if player_data is None or player_data['bot']:
+            reply('error', {'message': 'プレーヤーが見つかりません'})
+            return
+        if room.game_phase != 'waiting':
+            reply('error', {'message': 'ゲーム中はボットを追加できません'})
+            return
+        free = room.max_players - len(room.players)
+        count = data.get('count', free)
+        if free == 0:
+            reply('error', {'message': '空いている席がありません'})
+            return
+        if not isinstance(count, int) or not 1 <= count <= free:
+            reply('error', {'message': f'追加できるボットは{free}人までです'})
+            return
         
-        room.add_to_history('player_joined', name)
+        names = []
+        taken = {pdata['name'] for pdata in room.players.values()}
+        for _ in range(count):
+            name = next(f'🤖ボット{n}' for n in itertools.count(1) if f'🤖ボット{n}' not in taken)
+            bot_id = f"bot-{random.getrandbits(64):016x}"
+            room.add_player(bot_id, name, None, bot=True)
+            log_event(room_id, 'join_game', bot_id, name)
+            room.add_to_history('player_joined', name)
+            taken.add(name)
+            names.append(name)
         
-    else:
-        emit('game_joined', {
-            'success': False,
-            'message': message
-        })
+        emit_state_snapshots(room)
+        send_event('message', {'message': f'🎉 {"、".join(names)}がゲームに参加しました！'}, room_id)
 
-@socketio.on('start_game')
+@room_event('start_game')
 def handle_start_game(data):
     room_id = data['room_id']
     player_id = data['player_id']
     
-    if room_id in game_rooms:
-        room = game_rooms[room_id]
+    with game_rooms.locked(room_id) as room:
+        if room is None:
+            return
         
         if player_id not in room.players:
-            emit('error', {'message': 'プレーヤーが見つかりません'})
+            reply('error', {'message': 'プレーヤーが見つかりません'})
             return
         
+        before = room.capture_state()
+        previous = room.hand_codes()
         if room.start_game():
-            for pid in room.players:
-                emit('game_state_updated', room.to_dict_for_player(pid), 
-                     room=room.players[pid]['sid'])
+            log_event(room_id, 'start_game', player_id)
+            emit_state_patches(room, before, room.hand_moves(previous))
             
             player_name = room.players[player_id]['name']
             room.add_to_history('game_started', player_name)
-            emit('message', {'message': '🎮 ゲームが開始されました！まずはペアを捨ててください'}, room=room_id)
+            send_event('message', {'message': '🎮 ゲームが開始されました！まずはペアを捨ててください'}, room_id)
         else:
-            emit('error', {'message': 'ゲームを開始できません（3人必要）'})
+            reply('error', {'message': f'ゲームを開始できません（{room.max_players}人必要）'})
 
-@socketio.on('discard_pairs')
+@room_event('discard_pairs')
 def handle_discard_pairs(data):
     room_id = data['room_id']
     
-    if room_id in game_rooms:
-        room = game_rooms[room_id]
-        
-        total_pairs = 0
-        for player_data in room.players.values():
-            if not player_data['eliminated']:
-                pairs_count = room.discard_pairs_for_player(player_data)
-                total_pairs += pairs_count
-        
-        room.game_phase = 'draw'
-        room.current_player = 0
-        room.turn_start_time = datetime.now()
+    with game_rooms.locked(room_id) as room:
+        if room is None:
+            return
         
-        for player_id in room.players:
-            emit('game_state_updated', room.to_dict_for_player(player_id), 
-                 room=room.players[player_id]['sid'])
+        before = room.capture_state()
+        success, result = room.discard_all_pairs()
+        if not success:
+            reply('error', {'message': result})
+            return
+        total_pairs, moves = result
+        log_event(room_id, 'discard_pairs')
+        emit_state_patches(room, before, moves)
         
-        first_player = list(room.players.values())[0]['name']
+        first_player_data = room.get_player_by_position(room.current_player)
+        first_player = first_player_data['name'] if first_player_data else '不明'
         room.add_to_history('pairs_discarded', 'all_players', f'合計{total_pairs}組のペアを削除')
-        emit('message', {'message': f'🗑️ 全員でペアを削除しました！\\n🎯 {first_player}からゲーム開始！隣のプレーヤーからカードを引いてください'}, room=room_id)
+        if room.game_phase == 'finished':
+            send_event('message', {'message': game_result_message(room)}, room_id)
+            return
+        send_event('message', {'message': f'🗑️ 全員でペアを削除しました！\\n🎯 {first_player}からゲーム開始！隣のプレーヤーからカードを引いてください'}, room_id)
 
-@socketio.on('draw_card')
+def game_result_message(room):
+    loser = next((p['name'] for p in room.seats if not p['eliminated']), '不明')
+    
+    result_msg = f'🎉 ゲーム終了！\\n\\n'
+    for i, player_name in enumerate(room.elimination_order):
+        medal = '🥇' if i == 0 else '🥈' if i == 1 else '🥉' if i == 2 else '🏅'
+        result_msg += f'{medal} {i+1}位: {player_name}\\n'
+    result_msg += f'💀 {len(room.players)}位: {loser} (ババ 🃏)\\n\\n'
+    result_msg += '🎮 お疲れさまでした！'
+    return result_msg
+
+@room_event('draw_card')
 def handle_draw_card(data):
     room_id = data['room_id']
     player_id = data['player_id']
     from_position = data['from_position']
     card_index = data['card_index']
     
-    if room_id in game_rooms:
-        room = game_rooms[room_id]
-        
-        current_player_data = room.players.get(player_id)
-        if not current_player_data:
-            emit('error', {'message': 'プレーヤーが見つかりません'})
-            return
-        
-        if current_player_data['position'] != room.current_player:
-            emit('error', {'message': 'あなたのターンではありません'})
-            return
-        
-        from_player_data = room.get_player_by_position(from_position)
-        if not from_player_data:
-            emit('error', {'message': '対象プレーヤーが見つかりません'})
+    with game_rooms.locked(room_id) as room:
+        if room is None:
             return
         
-        expected_next_position = room.get_next_player_position(room.current_player)
-        if from_position != expected_next_position:
-            emit('error', {'message': '引く順番が正しくありません'})
+        before = room.capture_state()
+        success, result = room.draw_card(player_id, from_position, card_index)
+        if not success:
+            reply('error', {'message': result})
             return
+        log_event(room_id, 'draw_card', player_id, from_position, card_index)
         
-        if card_index >= len(from_player_data['hand']):
-            emit('error', {'message': '無効なカードです'})
-            return
-        
-        drawn_card = from_player_data['hand'].pop(card_index)
-        current_player_data['hand'].append(drawn_card)
-        current_player_data['cards_drawn'] += 1
-        
-        if len(from_player_data['hand']) == 0:
-            from_player_data['eliminated'] = True
-            room.elimination_order.append(from_player_data['name'])
-            room.add_to_history('player_eliminated', from_player_data['name'], 'カードがなくなり上がり')
-        
-        pairs_count = room.discard_pairs_for_player(current_player_data)
+        drawn_card, pairs_count, moves = result
+        current_player_data = room.players[player_id]
+        emit_state_patches(room, before, moves)
         
-        if len(current_player_data['hand']) == 0:
-            current_player_data['eliminated'] = True
-            room.elimination_order.append(current_player_data['name'])
-            room.add_to_history('player_eliminated', current_player_data['name'], 'ペア削除後に上がり')
-        
-        if room.check_win_condition():
-            room.game_phase = 'finished'
-            for pid in room.players:
-                emit('game_state_updated', room.to_dict_for_player(pid), 
-                     room=room.players[pid]['sid'])
-            
-            loser = [p for p in room.players.values() if not p['eliminated']][0]['name']
-            room.add_to_history('game_finished', loser, 'ババを持って最下位')
-            
-            result_msg = f'🎉 ゲーム終了！\\n\\n'
-            for i, player_name in enumerate(room.elimination_order):
-                medal = '🥇' if i == 0 else '🥈' if i == 1 else '🥉'
-                result_msg += f'{medal} {i+1}位: {player_name}\\n'
-            result_msg += f'💀 3位: {loser} (ババ 🃏)\\n\\n'
-            result_msg += '🎮 お疲れさまでした！'
-            
-            emit('message', {'message': result_msg}, room=room_id)
+        if room.game_phase == 'finished':
+            send_event('message', {'message': game_result_message(room)}, room_id)
         else:
-            room.current_player = room.get_next_player_position(room.current_player)
-            room.turn_start_time = datetime.now()
-            
-            for pid in room.players:
-                emit('game_state_updated', room.to_dict_for_player(pid), 
-                     room=room.players[pid]['sid'])
-            
             next_player_data = room.get_player_by_position(room.current_player)
             next_player_name = next_player_data['name'] if next_player_data else '不明'
             
             action_msg = f'🎯 {current_player_data["name"]}が{drawn_card}を引きました。'
+            if data.get('timed_out'):
+                action_msg = f'⏰ 持ち時間切れのため、{current_player_data["name"]}の代わりに{drawn_card}を引きました。'
             if pairs_count > 0:
                 action_msg += f'\\n🗑️ {pairs_count}組のペアを削除！'
             action_msg += f'\\n\\n⏭️ 次は{next_player_name}のターンです！'
             
-            room.add_to_history('card_drawn', current_player_data['name'], 
-                              f'{drawn_card}を引き、{pairs_count}組のペアを削除')
-            
-            emit('message', {'message': action_msg}, room=room_id)
+            send_event('message', {'message': action_msg}, room_id)
 
-@socketio.on('leave_game')
+@room_event('leave_game')
 def handle_leave_game(data):
     room_id = data.get('room_id')
     player_id = data.get('player_id')
     
-    if room_id and room_id in game_rooms:
-        room = game_rooms[room_id]
+    if not room_id:
+        return
+    
+    with game_rooms.locked(room_id) as room:
+        if room is None:
+            return
+        
         player_data = room.players.get(player_id)
-        player_name = player_data.get('name', '不明') if player_data else '不明'
+        if not player_data:
+            return
+        player_name = player_data.get('name', '不明')
         
+        connection_nodes.pop(player_data['sid'], None)
         room.remove_player(player_id)
-        leave_room(room_id)
+        log_event(room_id, 'leave_game', player_id)
+        exit_room(room_id)
+        
+        if all(pdata['bot'] for pdata in room.players.values()):
+            # ボットだけが残ったルームは閉じる
+            for bot_id in list(room.players):
+                room.remove_player(bot_id)
+                log_event(room_id, 'leave_game', bot_id)
         
         if len(room.players) == 0:
             logger.info(f"Empty room deleted: {room_id}")
-            del game_rooms[room_id]
+            game_rooms.discard(room_id, room)
+            if room.spectators:
+                send_event('message', {'message': '🚪 プレーヤーが全員退出したため、ルームが閉じられました。'},
+                           spectator_channel(room_id))
         else:
-            if len(room.players) < 3:
-                room.game_phase = 'waiting'
-                room.current_player = 0
-                room.elimination_order = []
-                room.game_start_time = None
-                
-                for player in room.players.values():
-                    player['hand'] = []
-                    player['eliminated'] = False
-                    player['cards_drawn'] = 0
-                    player['pairs_discarded'] = 0
+            if len(room.players) < room.max_players:
+                room.reset_game()
+                emit_state_snapshots(room)
                 
-                for pid in room.players:
-                    emit('game_state_updated', room.to_dict_for_player(pid), 
-                         room=room.players[pid]['sid'])
-                
-                room.add_to_history('game_reset', player_name, '3人未満のためリセット')
-                emit('message', {
-                    'message': f'😢 {player_name}がゲームから退出しました。\\n3人未満になったため待機状態に戻ります。'
-                }, room=room_id)
+                room.add_to_history('game_reset', player_name, f'{room.max_players}人未満のためリセット')
+                send_event('message', {
+                    'message': f'😢 {player_name}がゲームから退出しました。\\n{room.max_players}人未満になったため待機状態に戻ります。'
+                }, room_id)
             else:
                 if room.game_phase in ['discard', 'draw']:
-                    room.game_phase = 'waiting'
-                    room.current_player = 0
-                    room.elimination_order = []
-                    room.game_start_time = None
-                    
-                    for player in room.players.values():
-                        player['hand'] = []
-                        player['eliminated'] = False
-                        player['cards_drawn'] = 0
-                        player['pairs_discarded'] = 0
+                    room.reset_game()
                 
-                for pid in room.players:
-                    emit('game_state_updated', room.to_dict_for_player(pid), 
-                         room=room.players[pid]['sid'])
+                emit_state_snapshots(room)
                 
                 room.add_to_history('game_reset', player_name, 'プレーヤー退出によりリセット')
-                emit('message', {
+                send_event('message', {
                     'message': f'😢 {player_name}がゲームから退出しました。\\nゲームをリセットします。'
-                }, room=room_id)
+                }, room_id)
 
-@socketio.on('disconnect')
-def handle_disconnect():
-    player_id = session.get('player_id')
-    room_id = session.get('room_id')
+@room_event('request_state')
+def handle_request_state(data):
+    room_id = data.get('room_id')
+    player_id = data.get('player_id')
+    
+    with game_rooms.locked(room_id) as room:
+        if not room or player_id not in room.players or room.players[player_id]['bot']:
+            return
+        player_data = room.players[player_id]
+        if player_data['sid'] is None:
+            # 切断後の猶予時間内の再接続、またはスナップショットから復元したルームへの再接続
+            player_data['sid'] = current_sid()
+            enter_room(room_id)
+            bind_connection(player_id, room_id)
+            if player_data['suspended_at'] is not None:
+                player_data['suspended_at'] = None
+                room.add_to_history('player_reconnected', player_data['name'])
+                send_event('message', {'message': f'🔌 {player_data["name"]}が再接続しました！'}, room_id)
+        if player_data['sid'] == current_sid():
+            player_data['encoding'] = negotiate_encoding(data)
+            reply('game_state_updated', room.to_dict_for_player(player_id))
+
+@room_event('suspend_player')
+def handle_suspend_player(data):
+    room_id = data['room_id']
+    player_id = data['player_id']
+    # 切断した接続なので、ルームが既に無くても送信先の記録は外す
+    connection_nodes.pop(current_sid(), None)
+    
+    with game_rooms.locked(room_id) as room:
+        if room is None:
+            return
+        
+        # 既に別の接続で再接続済みなら、古い接続の切断は無視する
+        player_data = room.players.get(player_id)
+        if not player_data or player_data['sid'] != current_sid():
+            return
+        
+        player_data['sid'] = None
+        player_data['suspended_at'] = time.time()
+        suspended_players.schedule((weakref.ref(room), player_id, player_data['suspended_at']),
+                                   player_data['suspended_at'] + suspended_players.timeout)
+        room.add_to_history('player_suspended', player_data['name'])
+        send_event('message', {
+            'message': f'📡 {player_data["name"]}の接続が切れました。'
+                       f'{int(suspended_players.timeout)}秒間、再接続を待ちます。'
+        }, room_id)
+
+@room_event('spectate')
+def handle_spectate(data):
+    room_id = routing_key(data)
+    
+    with game_rooms.locked(room_id) as room:
+        if room is None:
+            reply('spectate_started', {'success': False, 'message': 'ルームが見つかりません'})
+            return
+        
+        room.spectators.add(current_sid())
+        enter_room(spectator_channel(room_id))
+        bind_connection(None, room_id)
+        reply('spectate_started', {'success': True, 'state': room.spectator_frame()})
+
+@room_event('stop_spectating')
+def handle_stop_spectating(data):
+    # 観戦の終了ボタンと、観戦中の接続の切断の両方から呼ばれる
+    room_id = routing_key(data)
+    bind_connection(None, None)
+    
+    with game_rooms.locked(room_id) as room:
+        if room is None or current_sid() not in room.spectators:
+            return
+        room.spectators.discard(current_sid())
+        exit_room(spectator_channel(room_id))
+
+def disconnect_event(sid):
+    player_id, room_id = connection_sessions.pop(sid, (None, None))
     
-    if player_id and room_id and room_id in game_rooms:
+    if room_id and player_id is None:
+        return 'stop_spectating', {'room_id': room_id}
+    if player_id and room_id:
         logger.info(f"Player {player_id} disconnected from room {room_id}")
-        handle_leave_game({
-            'player_id': player_id,
-            'room_id': room_id
-        })
+        # 猶予時間が 0 なら従来どおりすぐに退出させる
+        event = 'suspend_player' if suspended_players.timeout > 0 else 'leave_game'
+        return event, {'player_id': player_id, 'room_id': room_id}
+    return None
+
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
+    # Flask-SocketIO 5.x は切断の理由を渡す
+    closed = disconnect_event(request.sid)
+    if closed:
+        dispatch_room_event(*closed, request.sid)
 
 @socketio.on_error_default
 def default_error_handler(e):
@@ -1471,21 +3228,176 @@ def default_error_handler(e):
 def initialize():
     logger.info("ババ抜きゲームサーバーが起動しました")
 
+def cleanup_tick():
+    try:
+        deleted_count = room_expiry.advance()
+        if deleted_count > 0:
+            logger.info(f"Periodic cleanup: removed {deleted_count} inactive rooms")
+        suspended_players.advance()
+        turn_timers.advance()
+    except Exception as e:
+        logger.error(f"Periodic cleanup error: {e}")
+
 def periodic_cleanup():
     while True:
-        try:
-            deleted_count = cleanup_inactive_rooms()
-            if deleted_count > 0:
-                logger.info(f"Periodic cleanup: removed {deleted_count} inactive rooms")
-            time.sleep(1800)
-        except Exception as e:
-            logger.error(f"Periodic cleanup error: {e}")
-            time.sleep(300)
+        cleanup_tick()
+        time.sleep(room_expiry.tick)
 
-import threading
-cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
-cleanup_thread.start()
+async def periodic_cleanup_async():
+    while True:
+        cleanup_tick()
+        await asyncio.sleep(room_expiry.tick)
+
+# ルームごとの待ち行列。処理中のルームにだけ存在し、空になったらタスクごと消える
+room_queues = {}
+
+def enqueue_room_event(event, data, sid):
+    # 同じルームのイベントは1つのタスクが届いた順に処理するので、ロックを待つことはない
+    key = routing_key(data) if isinstance(data, dict) else ''
+    pending = room_queues.get(key)
+    if pending is None:
+        pending = room_queues[key] = deque()
+        start_async_task(drain_room_queue(key, pending))
+    pending.append((event, data, sid))
+
+async def drain_room_queue(key, pending):
+    while pending:
+        event, data, sid = pending.popleft()
+        run_room_event(event, data, sid, None)
+        await asyncio.sleep(0)
+    del room_queues[key]
+
+def make_async_room_handler(event):
+    async def handler(sid, data):
+        enqueue_room_event(event, data, sid)
+    return handler
+
+async def handle_async_disconnect(sid, *args):
+    closed = disconnect_event(sid)
+    if closed:
+        enqueue_room_event(*closed, sid)
+
+async def asgi_http_app(scope, receive, send):
+    # Socket.IO 以外の HTTP（ページ・アセット・メトリクス）と lifespan を受け持つ
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                start_background_tasks()
+                start_async_task(periodic_cleanup_async())
+                start_async_task(run_bot_turns_async())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    
+    request_headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                       for name, value in scope['headers']}
+    assets = {'/': index_page, '/assets/app.css': client_css, '/assets/app.js': client_js}
+    asset = assets.get(scope['path'])
+    if asset is not None:
+        status, headers, body = asset.prepare(request_headers.get('accept-encoding', ''),
+                                              request_headers.get('if-none-match', ''))
+        headers['Content-Type'] = f'{asset.mimetype}; charset=utf-8'
+    elif scope['path'] == '/metrics':
+        status, headers, body = 200, {'Content-Type': 'text/plain; version=0.0.4'}, render_metrics().encode()
+    elif scope['path'] == '/lobby':
+        page = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1'))).get('page', '1')
+        status, headers, body = 200, {'Content-Type': 'application/json'}, \
+            lobby.page(int(page) if page.isdigit() else 1)
+    else:
+        status, headers, body = 404, {'Content-Type': 'text/plain'}, b'Not Found'
+    
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+def create_asgi_app():
+    # ASGI_MODE=1 uvicorn card_game:create_asgi_app --factory --ws-per-message-deflate false
+    # 同じイベント・同じ GameRoom を使い、接続ごとのスレッドを持たないので待機中の接続を安く多数保持できる
+    global async_server
+    import socketio as python_socketio
+    
+    if app.config['CLUSTER_NODES'] > 1:
+        raise RuntimeError("ASGI mode does not support CLUSTER_NODES > 1")
+    async_server = python_socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+    for event in room_event_handlers:
+        async_server.on(event, make_async_room_handler(event))
+    async_server.on('disconnect', handle_async_disconnect)
+    return python_socketio.ASGIApp(async_server, other_asgi_app=asgi_http_app)
+
+def run_cluster_node(node_id, nodes, pubsub, host, port):
+    configure_cluster(node_id, nodes, pubsub)
+    start_background_tasks()
+    socketio.run(app, host=host, port=port)
+
+def run_local_cluster(nodes, host='0.0.0.0', base_port=8000):
+    # 1台のマシン上で nodes 個のワーカーを fork し、multiprocessing.Queue で相互に転送する。
+    # 各ワーカーは base_port + node_id で待ち受けるので、前段でロードバランサを使う。
+    pubsub = QueuePubSub(nodes, multiprocessing.Queue)
+    workers = [
+        multiprocessing.Process(target=run_cluster_node,
+                                args=(node_id, nodes, pubsub, host, base_port + node_id))
+        for node_id in range(nodes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+# start_background_tasks を済ませたプロセスの pid。fork したワーカーでは一致しないので改めて起動する
+background_pid = None
+background_lock = threading.Lock()
+
+def start_background_tasks():
+    # クラスタへの参加（CLUSTER_NODE_INDEX）、スナップショットからの復元、履歴・イベントログの書き出し、
+    # 周期処理（ルームの期限切れ・再接続の猶予・持ち時間）とボットの手番を、プロセスごとに1回だけ起動する。
+    # __main__ と run_cluster_node のほか、gunicorn や flask run のように import だけされた場合に備えて
+    # 最初の HTTP リクエストと Socket.IO の接続でも呼ぶ。
+    # ASGI モードでは lifespan の開始時に呼ばれ、スレッドの代わりに periodic_cleanup_async と
+    # run_bot_turns_async をタスクとして起動する
+    global background_pid
+    if background_pid == os.getpid():
+        return
+    with background_lock:
+        if background_pid == os.getpid():
+            return
+        background_pid = os.getpid()
+        
+        if cluster is None and app.config['CLUSTER_NODES'] > 1 and app.config['CLUSTER_NODE_INDEX'] is not None:
+            configure_cluster(int(app.config['CLUSTER_NODE_INDEX']), app.config['CLUSTER_NODES'],
+                              RedisPubSub(app.config['PUBSUB_URL']))
+        # CLUSTER_NODES > 1 でノード番号が無いプロセスは run_local_cluster の親で、ルームを持たない
+        if app.config['SNAPSHOT_PATH'] and (cluster is not None or app.config['CLUSTER_NODES'] <= 1):
+            suffix = f".{cluster.node_id}" if cluster is not None else ''
+            start_room_snapshots(app.config['SNAPSHOT_PATH'] + suffix)
+        start_log_writers()
+        if async_server is None:
+            threading.Thread(target=periodic_cleanup, daemon=True).start()
+            threading.Thread(target=run_bot_turns, daemon=True).start()
+
+@app.before_request
+def ensure_background_tasks():
+    start_background_tasks()
+
+@socketio.on('connect')
+def handle_connect(auth=None):
+    start_background_tasks()
 
 if __name__ == '__main__':
     logger.info("Starting Babanuki Game Server...")
-    socketio.run(app, debug=True, host='0.0.0.0', port=8000)
\ No newline at end of file
+    if app.config['ASGI_MODE']:
+        import uvicorn
+        uvicorn.run(create_asgi_app(), host='0.0.0.0', port=int(os.environ.get('PORT', 8000)),
+                    ws_per_message_deflate=False)
+    elif app.config['CLUSTER_NODES'] > 1 and app.config['CLUSTER_NODE_INDEX'] is None:
+        run_local_cluster(app.config['CLUSTER_NODES'])
+    else:
+        start_background_tasks()
+        socketio.run(app, debug=cluster is None, host='0.0.0.0',
+                     port=int(os.environ.get('PORT', 8000)))
\ No newline at end of file
@@ -0,0 +1,735 @@
+# ババ抜きのゲームロジック（カード・手札・配り方・ルーム・ボットの方針表）。
+# Flask や Socket.IO に依存せず、import してもスレッドやファイルを作らないので、
+# サーバー（card_game.py）のほか simulate.py・replay.py・ベンチマークからそのまま使える。
+import bisect
+import json
+import logging
+import math
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+SUITS = ("♠", "♥", "♦", "♣")
+VALUES = (None, None, "2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K", "A")
+JOKER_CODE = 0
+DECK_SIZE = 53
+MIN_PLAYERS = 2
+MAX_PLAYERS = 10
+# 1ルームのカードは最大 MAX_DECKS * 52 + 1 枚（ルームあたりのメモリの上限）
+MAX_DECKS = 4
+
+def card_code(value, suit, is_joker=False):
+    if is_joker:
+        return JOKER_CODE
+    return (value - 2) * 4 + suit + 1
+
+class Card:
+    # 53枚分のインスタンスを CARDS に一度だけ作り、全ルームで共有する
+    __slots__ = ('code', 'value', 'suit', 'is_joker', 'display', '_dict')
+
+    def __new__(cls, value, suit, is_joker=False):
+        return CARDS[card_code(value, suit, is_joker)]
+
+    @classmethod
+    def _create(cls, code, value, suit, is_joker):
+        card = object.__new__(cls)
+        display = "🃏" if is_joker else f"{VALUES[value]}{SUITS[suit]}"
+        object.__setattr__(card, 'code', code)
+        object.__setattr__(card, 'value', value)
+        object.__setattr__(card, 'suit', suit)
+        object.__setattr__(card, 'is_joker', is_joker)
+        object.__setattr__(card, 'display', display)
+        object.__setattr__(card, '_dict', {
+            'code': code,
+            'value': value,
+            'suit': suit,
+            'is_joker': is_joker,
+            'display': display
+        })
+        return card
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Card is immutable")
+
+    def __reduce__(self):
+        return card_from_code, (self.code,)
+
+    def __repr__(self):
+        return f"Card({self.display})"
+
+    def __str__(self):
+        return self.display
+    
+    def get_value(self):
+        return 'JOKER' if self.is_joker else self.value
+    
+    def to_dict(self):
+        # キャッシュ済みの辞書を返すため、呼び出し側で変更しないこと
+        return self._dict
+
+CARDS = tuple(
+    [Card._create(JOKER_CODE, 0, 0, True)] +
+    [Card._create(card_code(value, suit), value, suit, False)
+     for value in range(2, 15) for suit in range(4)]
+)
+
+def card_from_code(code):
+    return CARDS[code]
+
+def deck_codes(decks=1):
+    # 複数デッキでもジョーカーは1枚だけ（ジョーカー同士でペアにならないように）
+    return [JOKER_CODE] + list(range(1, DECK_SIZE)) * decks
+
+class Hand(list):
+    # slots[ランク] はそのランクのカードの位置（無ければ -1）。
+    # ペア削除後はどのランクも1枚以下なので、引いたカードは O(1) で相殺できる。
+    __slots__ = ('slots',)
+
+    def __init__(self, cards=()):
+        super().__init__(cards)
+        self.slots = None
+
+    def discard_pairs(self, removed=None):
+        # removed にリストを渡すと、捨てたカードをそこに追加する
+        held = {}
+        jokers = []
+        pairs_count = 0
+        
+        for card in self:
+            if card.is_joker:
+                jokers.append(card)
+            elif card.value in held:
+                if removed is not None:
+                    removed += (held[card.value], card)
+                del held[card.value]
+                pairs_count += 1
+            else:
+                held[card.value] = card
+        
+        self[:] = jokers + list(held.values())
+        self.reindex()
+        return pairs_count
+
+    def reindex(self):
+        # ペア削除済みの手札について、並びを変えずに索引だけを作り直す
+        self.slots = [-1] * len(VALUES)
+        for i, card in enumerate(self):
+            if not card.is_joker:
+                self.slots[card.value] = i
+
+    def pair_for(self, card):
+        # receive(card) で card と一緒に捨てられるカード（無ければ None）
+        if card.is_joker:
+            return None
+        if self.slots is not None:
+            position = self.slots[card.value]
+            return self[position] if position >= 0 else None
+        return next((held for held in self if held.value == card.value and not held.is_joker), None)
+
+    def receive(self, card, slot=None):
+        # slot を渡すと、ペアにならなかったカードを末尾ではなくその位置に入れる（元のカードは末尾へ）
+        if self.slots is None:
+            self.append(card)
+            return self.discard_pairs()
+        
+        if not card.is_joker:
+            position = self.slots[card.value]
+            if position >= 0:
+                self.take(position)
+                return 1
+            self.slots[card.value] = len(self)
+        self.append(card)
+        if slot is not None and slot < len(self) - 1:
+            self.swap(slot, len(self) - 1)
+        return 0
+
+    def swap(self, i, j):
+        self[i], self[j] = self[j], self[i]
+        for index in (i, j):
+            if not self[index].is_joker:
+                self.slots[self[index].value] = index
+
+    def take(self, index):
+        if self.slots is None:
+            return self.pop(index)
+        
+        if index < 0:
+            index += len(self)
+        card = self[index]
+        last = self.pop()
+        if index < len(self):
+            self[index] = last
+            if not last.is_joker:
+                self.slots[last.value] = index
+        if not card.is_joker:
+            self.slots[card.value] = -1
+        return card
+
+class DealEngine:
+    # 多数のルーム分のデッキをまとめてシャッフルする（NumPy があれば行列で一括処理）。
+    # カードごとに [0, 1) の乱数を引いて並べ替える。NumPy 側の MT19937 には random.Random と同じ
+    # 内部状態を渡すので、同じ seed なら NumPy の有無にかかわらず同じ配り方になる
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        if np is not None:
+            _, state, _ = self.rng.getstate()
+            self.np_rng = np.random.RandomState()
+            self.np_rng.set_state(('MT19937', np.array(state[:-1], dtype=np.uint32), state[-1]))
+        else:
+            self.np_rng = None
+
+    def shuffle_many(self, count, decks=1):
+        base = deck_codes(decks)
+        if self.np_rng is not None:
+            keys = self.np_rng.random_sample((count, len(base)))
+            return np.array(base, dtype=np.uint8)[np.argsort(keys, axis=1, kind='stable')]
+        
+        shuffled = []
+        for _ in range(count):
+            keys = [self.rng.random() for _ in base]
+            shuffled.append([base[i] for i in sorted(range(len(base)), key=keys.__getitem__)])
+        return shuffled
+
+    def deal_many(self, count, seats=3, decks=1):
+        return [
+            [list(map(int, codes[seat::seats])) for seat in range(seats)]
+            for codes in self.shuffle_many(count, decks)
+        ]
+
+# 履歴のタイムスタンプは time.monotonic()。書き出し時にこの差分で壁時計に直す
+MONOTONIC_TO_WALL = time.time() - time.monotonic()
+
+class GameRoom:
+    # 履歴を保持する件数と、履歴を書き出す先（submit(room_id, record) を持つもの）。
+    # サーバーでは card_game が HISTORY_CAPACITY と HistorySpillWriter に合わせて設定する
+    history_capacity = 256
+    history_spill = None
+
+    def __init__(self, room_id, seed=None, headless=False, max_players=3, decks=1):
+        if not MIN_PLAYERS <= max_players <= MAX_PLAYERS:
+            raise ValueError(f"max_players must be between {MIN_PLAYERS} and {MAX_PLAYERS}")
+        if not 1 <= decks <= MAX_DECKS:
+            raise ValueError(f"decks must be between 1 and {MAX_DECKS}")
+        self.room_id = room_id
+        self.max_players = max_players
+        self.decks = decks
+        # headless=True はシミュレーション用。ログ出力と履歴記録を行わない
+        self.headless = headless
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self._rng = None
+        self._placement_rng = None
+        self.games_started = 0
+        self.players = {}
+        # 席番号 → プレーヤー情報。席番号は常に 0 から詰めて振られる
+        self.seats = []
+        # 上がっていない席だけをつなぐ双方向の環。上がった席のポインタは外した時点の隣を指したまま残す
+        self.next_seat = []
+        self.prev_seat = []
+        self.active_seats = 0
+        self.current_player = 0
+        self.game_phase = 'waiting'
+        self.elimination_order = []
+        self.created_at = datetime.now()
+        self.last_activity = datetime.now()
+        self.deck = []
+        self.game_start_time = None
+        self.turn_start_time = None
+        # (monotonic時刻, action, player, details) のタプルを最新 history_capacity 件だけ保持する
+        self.game_history = deque(maxlen=self.history_capacity)
+        self.version = 0
+        # turn_timers / bot_turns にこのルームのエントリが載っているか
+        self.turn_timer_armed = False
+        self.bot_turn_scheduled = False
+        # 観戦中の接続の sid と、観戦者向けの状態 (version, JSON 文字列)
+        self.spectators = set()
+        self._spectator_frame = (None, None)
+        self.lock = threading.RLock()
+        
+    @property
+    def rng(self):
+        # Random の初期化は数µsかかるので、最初に使うときに作る（スナップショットからの一括復元向け）
+        if self._rng is None:
+            self._rng = random.Random(self.seed)
+        return self._rng
+    
+    def placement(self, size):
+        # 引いたカードを手札のどこに入れるか。末尾に置くと引かれた位置に末尾のカードが移るので、
+        # 直前に受け取ったカード（ジョーカーを含む）の位置が読めてしまう。
+        # 乱数は (seed, 何ゲーム目か) から作り、1回引くごとに1つ進める。スナップショットから戻した
+        # ルームでは、それまでに引いた回数だけ進めてイベントログからの再生と同じ並びにする
+        if self._placement_rng is None:
+            rng = random.Random(f"{self.seed}:{self.games_started}:draws")
+            for _ in range(sum(p['cards_drawn'] for p in self.players.values())):
+                rng.random()
+            self._placement_rng = rng
+        return int(self._placement_rng.random() * size)
+    
+    def add_player(self, player_id, name, sid, bot=False):
+        if len(self.players) >= self.max_players:
+            return False, f"ルームが満員です（{self.max_players}人まで）"
+        
+        # 名前の重複チェック
+        existing_names = [p['name'] for p in self.players.values()]
+        if name in existing_names:
+            return False, "同じ名前のプレーヤーが既に参加しています"
+        
+        available_position = len(self.seats)
+        
+        self.players[player_id] = {
+            'name': name,
+            'hand': Hand(),
+            'eliminated': False,
+            'sid': sid,
+            # サーバー側のボット（sid は常に None で、手番は bot_turns から打つ）
+            'bot': bot,
+            # 切断中（再接続待ち）になった時刻。接続中は None
+            'suspended_at': None,
+            # 'json' か 'packed'（手札をカードコードのバイト列で送る）。接続ごとに negotiate_encoding で決める
+            'encoding': 'json',
+            'position': available_position,
+            'join_time': datetime.now(),
+            'cards_drawn': 0,
+            'pairs_discarded': 0
+        }
+        self.seats.append(self.players[player_id])
+        self.rebuild_turn_ring()
+        
+        self.touch()
+        if not self.headless:
+            logger.info(f"Player {name} joined room {self.room_id}")
+        return True, "参加成功"
+    
+    def remove_player(self, player_id):
+        if player_id in self.players:
+            player_name = self.players[player_id]['name']
+            del self.players[player_id]
+            self.touch()
+            if not self.headless:
+                logger.info(f"Player {player_name} left room {self.room_id}")
+            
+            if len(self.players) < self.max_players:
+                self.reorganize_positions()
+    
+    def reorganize_positions(self):
+        self.seats = list(self.players.values())
+        for i, player in enumerate(self.seats):
+            player['position'] = i
+            player['public_view'] = None
+        self.rebuild_turn_ring()
+        self.current_player = 0
+    
+    def rebuild_turn_ring(self):
+        count = len(self.seats)
+        active = [i for i, player in enumerate(self.seats) if not player['eliminated']]
+        self.next_seat = [0] * count
+        self.prev_seat = [0] * count
+        for i, position in enumerate(active):
+            self.next_seat[position] = active[(i + 1) % len(active)]
+            self.prev_seat[position] = active[i - 1]
+        for position in range(count):
+            if self.seats[position]['eliminated']:
+                following = bisect.bisect_right(active, position)
+                self.next_seat[position] = active[following % len(active)] if active else position
+                self.prev_seat[position] = active[following - 1] if active else position
+        self.active_seats = len(active)
+    
+    def eliminate_player(self, player_data, details):
+        player_data['eliminated'] = True
+        position = player_data['position']
+        previous, following = self.prev_seat[position], self.next_seat[position]
+        self.next_seat[previous] = following
+        self.prev_seat[following] = previous
+        self.active_seats -= 1
+        self.elimination_order.append(player_data['name'])
+        self.add_to_history('player_eliminated', player_data['name'], details)
+    
+    def create_deck(self):
+        # (seed, 何ゲーム目か) だけで決まるので、イベントログからの再生やスナップショット復元後も同じ配り方になる
+        deck = [CARDS[code] for code in deck_codes(self.decks)]
+        random.Random(f"{self.seed}:{self.games_started}").shuffle(deck)
+        return deck
+    
+    def start_game(self, deck_codes=None):
+        if len(self.players) != self.max_players:
+            return False
+        
+        if deck_codes is None:
+            self.deck = self.create_deck()
+        else:
+            self.deck = [CARDS[code] for code in deck_codes]
+        self.games_started += 1
+        self._placement_rng = None
+        player_list = list(self.players.values())
+        seats = len(player_list)
+        
+        # 前のゲームが終わったままの状態（上がり・順位・枚数の記録）から始め直すこともある
+        self.elimination_order = []
+        for i, player in enumerate(player_list):
+            player['hand'] = Hand(self.deck[i::seats])
+            player['eliminated'] = False
+            player['cards_drawn'] = 0
+            player['pairs_discarded'] = 0
+        self.rebuild_turn_ring()
+        self._spectator_frame = (None, None)
+        
+        self.game_phase = 'discard'
+        self.game_start_time = datetime.now()
+        self.touch()
+        
+        if not self.headless:
+            logger.info(f"Game started in room {self.room_id} with players: {[p['name'] for p in player_list]}")
+        
+        return True
+    
+    def discard_pairs_for_player(self, player_data, removed=None):
+        pairs_count = player_data['hand'].discard_pairs(removed)
+        player_data['pairs_discarded'] += pairs_count
+        return pairs_count
+    
+    def receive_card(self, player_data, card, slot=None):
+        # 戻り値は (ペア数, 手札から消えたカードのコード, 手札に加わったカードのコード)
+        partner = player_data['hand'].pair_for(card)
+        pairs_count = player_data['hand'].receive(card, slot)
+        player_data['pairs_discarded'] += pairs_count
+        if partner is not None:
+            return pairs_count, [partner.code], []
+        return pairs_count, [], [card.code]
+    
+    def discard_all_pairs(self):
+        # 配った直後の1回だけ。待機中に受けると手札0枚の全員が上がりになり、ゲーム中に受けると手番が席0に戻る
+        if self.game_phase != 'discard':
+            return False, 'ペアを捨てられるのはゲーム開始直後だけです'
+        
+        # moves は 席番号 → (手札から消えたカードのコード, 加わったカードのコード)。build_patches に渡す
+        # ペア削除はジョーカーを先頭に寄せるので、残った手札を混ぜて並びから位置が読めないようにする。
+        # 乱数は create_deck と同じく (seed, 何ゲーム目か) だけで決め、イベントログからの再生でも同じ並びにする
+        rng = random.Random(f"{self.seed}:{self.games_started}:hands")
+        total_pairs = 0
+        moves = {}
+        for player_data in self.players.values():
+            if not player_data['eliminated']:
+                removed = []
+                total_pairs += self.discard_pairs_for_player(player_data, removed)
+                rng.shuffle(player_data['hand'])
+                player_data['hand'].reindex()
+                if removed:
+                    moves[player_data['position']] = ([card.code for card in removed], [])
+                if len(player_data['hand']) == 0:
+                    self.eliminate_player(player_data, 'ペア削除後に上がり')
+        
+        self.touch()
+        if self.check_win_condition():
+            # 2人のテーブルなどでは、最初のペア削除だけでババを持つ1人しか残らないことがある
+            self.game_phase = 'finished'
+            loser = next((p['name'] for p in self.seats if not p['eliminated']), None)
+            self.add_to_history('game_finished', loser, 'ババを持って最下位')
+            return True, (total_pairs, moves)
+        self.game_phase = 'draw'
+        self.current_player = 0
+        first_player_data = self.get_player_by_position(0)
+        if first_player_data and first_player_data['eliminated']:
+            self.current_player = self.get_next_player_position(0)
+        self.turn_start_time = datetime.now()
+        return True, (total_pairs, moves)
+    
+    def draw_card(self, player_id, from_position, card_index):
+        current_player_data = self.players.get(player_id)
+        if not current_player_data:
+            return False, 'プレーヤーが見つかりません'
+        
+        if current_player_data['position'] != self.current_player:
+            return False, 'あなたのターンではありません'
+        
+        from_player_data = self.get_player_by_position(from_position)
+        if not from_player_data:
+            return False, '対象プレーヤーが見つかりません'
+        
+        expected_next_position = self.get_next_player_position(self.current_player)
+        if from_position != expected_next_position:
+            return False, '引く順番が正しくありません'
+        
+        if card_index >= len(from_player_data['hand']):
+            return False, '無効なカードです'
+        
+        self.touch()
+        drawn_card = from_player_data['hand'].take(card_index)
+        slot = self.placement(len(current_player_data['hand']) + 1)
+        current_player_data['cards_drawn'] += 1
+        
+        if len(from_player_data['hand']) == 0:
+            self.eliminate_player(from_player_data, 'カードがなくなり上がり')
+        
+        pairs_count, removed, added = self.receive_card(current_player_data, drawn_card, slot)
+        # 動いたカードは引かれた1枚と、それとペアになって捨てられた1枚だけ
+        moves = {
+            from_position: ([drawn_card.code], []),
+            current_player_data['position']: (removed, added)
+        }
+        
+        if len(current_player_data['hand']) == 0:
+            self.eliminate_player(current_player_data, 'ペア削除後に上がり')
+        
+        if self.check_win_condition():
+            self.game_phase = 'finished'
+            loser = self.seats[self.get_next_player_position(self.current_player)]['name']
+            self.add_to_history('game_finished', loser, 'ババを持って最下位')
+        else:
+            self.current_player = self.get_next_player_position(self.current_player)
+            self.turn_start_time = datetime.now()
+            if not self.headless:
+                self.add_to_history('card_drawn', current_player_data['name'], 
+                                    f'{drawn_card}を引き、{pairs_count}組のペアを削除')
+        
+        return True, (drawn_card, pairs_count, moves)
+    
+    def reset_game(self):
+        self.game_phase = 'waiting'
+        self.current_player = 0
+        self.elimination_order = []
+        self.game_start_time = None
+        
+        for player in self.players.values():
+            player['hand'] = Hand()
+            player['eliminated'] = False
+            player['cards_drawn'] = 0
+            player['pairs_discarded'] = 0
+        self.rebuild_turn_ring()
+        self._spectator_frame = (None, None)
+    
+    def get_next_player_position(self, current_position):
+        # 上がった席から辿っても、外した時点の隣から環に戻れる
+        if self.active_seats == 0:
+            return 0
+        if not 0 <= current_position < len(self.seats):
+            current_position = len(self.seats) - 1
+        position = self.next_seat[current_position]
+        while self.seats[position]['eliminated']:
+            position = self.next_seat[position]
+        return position
+    
+    def get_player_by_position(self, position):
+        if 0 <= position < len(self.seats):
+            return self.seats[position]
+        return None
+    
+    def check_win_condition(self):
+        return self.active_seats <= 1
+    
+    def touch(self):
+        self.last_activity = datetime.now()
+    
+    def add_to_history(self, action, player_name, details=None):
+        if self.headless:
+            return
+        record = (time.monotonic(), action, player_name, details)
+        self.game_history.append(record)
+        if self.history_spill is not None:
+            self.history_spill.submit(self.room_id, record)
+    
+    def get_history(self):
+        return [{
+            'timestamp': datetime.fromtimestamp(timestamp + MONOTONIC_TO_WALL),
+            'action': action,
+            'player': player,
+            'details': details
+        } for timestamp, action, player, details in self.game_history]
+    
+    def to_dict_for_player(self, player_id):
+        player_data = self.players.get(player_id)
+        if not player_data:
+            return None
+        
+        encoding = player_data['encoding']
+        if encoding == 'packed':
+            # 1枚1バイトのカードコード列。Socket.IO のバイナリ添付として送られる
+            hand = bytes(card.code for card in player_data['hand'])
+        else:
+            hand = [card.to_dict() for card in player_data['hand']]
+        
+        my_info = {
+            'name': player_data['name'],
+            'hand_count': len(player_data['hand']),
+            'eliminated': player_data['eliminated'],
+            'position': player_data['position'],
+            'cards_drawn': player_data.get('cards_drawn', 0),
+            'pairs_discarded': player_data.get('pairs_discarded', 0)
+        }
+        my_info['hand_codes' if encoding == 'packed' else 'hand'] = hand
+        
+        return {
+            'room_id': self.room_id,
+            'my_info': my_info,
+            'other_players': [self.public_view(pdata) for pid, pdata in self.players.items() if pid != player_id],
+            'current_player_position': self.current_player,
+            'game_phase': self.game_phase,
+            'elimination_order': self.elimination_order,
+            'player_count': len(self.players),
+            'max_players': self.max_players,
+            'decks': self.decks,
+            'game_start_time': self.game_start_time.isoformat() if self.game_start_time else None,
+            'version': self.version
+        }
+    
+    def public_view(self, player_data):
+        # 他のプレーヤーと観戦者に見せる部分
+        return {
+            'name': player_data['name'],
+            'hand_count': len(player_data['hand']),
+            'eliminated': player_data['eliminated'],
+            'position': player_data['position']
+        }
+    
+    def spectator_frame(self):
+        # 観戦者は全員同じ公開情報だけを見るので、version ごとに1回だけ JSON にして全員に同じ文字列を送る
+        if self._spectator_frame[0] != self.version:
+            frame = json.dumps({
+                'room_id': self.room_id,
+                'players': [self.public_view(pdata) for pdata in self.seats],
+                'current_player_position': self.current_player,
+                'game_phase': self.game_phase,
+                'elimination_order': self.elimination_order,
+                'player_count': len(self.players),
+                'max_players': self.max_players,
+                'decks': self.decks,
+                'game_start_time': self.game_start_time.isoformat() if self.game_start_time else None,
+                'version': self.version
+            }, ensure_ascii=False, separators=(',', ':'))
+            self._spectator_frame = (self.version, frame)
+        return self._spectator_frame[1]
+    
+    def capture_state(self):
+        # 全員に共通の部分だけを覚えておく。手札の差分は draw_card などが返す moves から作る
+        return (self.current_player, self.game_phase, len(self.elimination_order), self.game_start_time)
+    
+    def hand_codes(self):
+        # ゲームの開始前の手札（席番号 → カードコード）。start_game の後の hand_moves に渡す
+        return {pdata['position']: [card.code for card in pdata['hand']] for pdata in self.seats}
+    
+    def hand_moves(self, previous):
+        # 配り直したときの moves。前の手札をすべて外し、新しい手札をすべて加える
+        return {pdata['position']: (previous.get(pdata['position'], []), [card.code for card in pdata['hand']])
+                for pdata in self.seats}
+    
+    def build_patches(self, before, moves):
+        # capture_state() からの差分と、moves（席番号 → (手札から消えたカードのコード, 加わったカードのコード)）
+        # だけからプレーヤーごとのパッチを作る。手札や他のプレーヤーは走査しないので、席数によらず
+        # 動いたカードの枚数ぶんの手間で済む（パッチ自体はプレーヤーごとに1つ要る）
+        current_player, game_phase, eliminated_count, game_start_time = before
+        
+        shared = {'room_id': self.room_id, 'version': self.version}
+        if self.current_player != current_player:
+            shared['current_player_position'] = self.current_player
+        if self.game_phase != game_phase:
+            shared['game_phase'] = self.game_phase
+        if self.game_start_time != game_start_time:
+            shared['game_start_time'] = self.game_start_time.isoformat() if self.game_start_time else None
+        if len(self.elimination_order) != eliminated_count:
+            shared['elimination_order'] = self.elimination_order
+        
+        changed_players = {}
+        for position in moves:
+            pdata = self.seats[position]
+            changed_players[position] = {
+                'position': position,
+                'hand_count': len(pdata['hand']),
+                'eliminated': pdata['eliminated']
+            }
+        
+        patches = {}
+        for pid, pdata in self.players.items():
+            patch = dict(shared)
+            position = pdata['position']
+            others = [info for other, info in changed_players.items() if other != position]
+            if others:
+                patch['players'] = others
+            
+            move = moves.get(position)
+            if move is not None:
+                removed, added = move
+                my_info = {
+                    'hand_count': len(pdata['hand']),
+                    'eliminated': pdata['eliminated'],
+                    'cards_drawn': pdata['cards_drawn'],
+                    'pairs_discarded': pdata['pairs_discarded']
+                }
+                if removed:
+                    my_info['hand_removed'] = sorted(removed)
+                if added and pdata['encoding'] == 'packed':
+                    # 1ターンの差分は1〜2枚なので、バイナリ添付にせずカードコードの配列で送る方が小さい
+                    my_info['hand_added_codes'] = sorted(added)
+                elif added:
+                    my_info['hand_added'] = [CARDS[code].to_dict() for code in sorted(added)]
+                patch['my_info'] = my_info
+            patches[pid] = patch
+        return patches
+
+class BotPolicy:
+    # ボットが相手の手札のどの位置から引くかの方針表。
+    # ヘッドレスのゲームを前もって回し、相手の手札の枚数ごとにジョーカーがあった位置を数えて、
+    # 偶然では説明できないほど多かった位置（平均 + 5σ 超）を除いた組を表にしておく。
+    # ペア削除後の手札は混ぜ、引いたカードも乱数の位置に入れるので、今のルールでは除かれる位置はなく
+    # 一様に引くのと同じになる（人のプレーヤーに見えない並びの偏りをボットだけが使うことはない）。
+    # 手番では表を1回引いてその中から1つ選ぶだけで、探索はしない。
+    # 候補だけから引くとボット同士で同じカードを回し続けて終わらないことがあるので、
+    # explore の割合ではどの位置からも一様に引く。
+    def __init__(self, games=200, seed=0, explore=0.1):
+        self.games = games
+        self.seed = seed
+        self.explore = explore
+        self.table = None
+        self.lock = threading.Lock()
+
+    def build(self):
+        with self.lock:
+            if self.table is not None:
+                return self.table
+            # ペア削除後の手札はランクごとに1枚以下とジョーカーなので、引くときの枚数は最大 13 + 1
+            counts = [[0] * size for size in range(len(VALUES))]
+            rng = random.Random(self.seed)
+            for seats in range(MIN_PLAYERS, MAX_PLAYERS + 1):
+                room = GameRoom('BOT', seed=self.seed + seats, headless=True, max_players=seats)
+                player_ids = [f"seat{seat}" for seat in range(seats)]
+                for player_id in player_ids:
+                    room.add_player(player_id, player_id, None)
+                for _ in range(self.games):
+                    room.reset_game()
+                    room.start_game()
+                    room.discard_all_pairs()
+                    # ジョーカーの位置は何手か続けて同じままなので、1ゲームでは枚数ごとに最初の1回だけ数える
+                    # （続けて数えると標本が独立でなくなり、偏りがなくても上限を超える位置が出る）
+                    seen = set()
+                    while room.game_phase == 'draw':
+                        position = room.current_player
+                        from_position = room.get_next_player_position(position)
+                        hand = room.seats[from_position]['hand']
+                        if len(hand) not in seen:
+                            for index, card in enumerate(hand):
+                                if card.is_joker:
+                                    counts[len(hand)][index] += 1
+                                    seen.add(len(hand))
+                                    break
+                        # 人がどこから引くかは分からないので、表を作るときは一様に引く
+                        room.draw_card(player_ids[position], from_position, rng.randrange(len(hand)))
+            # 一度も現れなかった枚数では、どの位置も候補になる
+            self.table = []
+            for size, row in enumerate(counts):
+                total = sum(row)
+                limit = total / size + 5 * math.sqrt(total * (size - 1)) / size if size else 0
+                self.table.append(tuple(index for index in range(size) if row[index] <= limit))
+            return self.table
+
+    def choose(self, hand_size, rng):
+        table = self.table if self.table is not None else self.build()
+        if hand_size < len(table) and rng.random() >= self.explore:
+            return rng.choice(table[hand_size])
+        return rng.randrange(hand_size)
@@ -0,0 +1,136 @@
+# EVENT_LOG_PATH に書かれたイベントログを GameRoom(headless=True) で再生する。
+# ルームは create レコードの seed から作り直し、受け付けられた操作を同じ順に当てはめるので、
+# 再生中に拒否される操作があれば、ゲームロジックの変更で結果が変わったことを意味する。
+# 最終状態のダイジェストを実行ごとに比べれば回帰テストに、events/s を比べれば性能測定に使える。
+#
+#   python replay.py events-20261017.log --workers 8
+#   python replay.py events-*.log --json replay.json
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from game_logic import GameRoom
+
+DIGEST_MASK = (1 << 64) - 1
+
+
+def apply_event(room, event, args):
+    if event == 'join_game':
+        return room.add_player(args[0], args[1], None)[0]
+    if event == 'start_game':
+        return room.start_game()
+    if event == 'discard_pairs':
+        return room.discard_all_pairs()[0]
+    if event == 'draw_card':
+        return room.draw_card(*args)[0]
+    if event == 'leave_game':
+        if args[0] not in room.players:
+            return False
+        # handle_leave_game と同じく、誰かが抜けたら残りのプレーヤーで待機状態に戻す
+        room.remove_player(args[0])
+        if room.players:
+            room.reset_game()
+        return True
+    raise ValueError(f"unknown event: {event}")
+
+
+def room_digest(room_id, room):
+    state = (room_id, room.games_started, room.game_phase, room.current_player, room.elimination_order,
+             [(pid, pdata['position'], pdata['eliminated'], [card.code for card in pdata['hand']])
+              for pid, pdata in room.players.items()])
+    return int.from_bytes(hashlib.blake2b(repr(state).encode(), digest_size=8).digest(), 'little')
+
+
+def room_key(line):
+    # JSON を解かずにルームID部分だけで振り分ける（同じルームの行は必ず同じ文字列になる）
+    return line.split(',', 2)[1]
+
+
+def replay_shard(paths, shard, shards):
+    stats = {'rooms': 0, 'events': 0, 'rejected': 0, 'orphaned': 0, 'games_finished': 0, 'digest': 0}
+    rooms = {}
+
+    def finish(room_id):
+        room = rooms.pop(room_id)
+        stats['rooms'] += 1
+        stats['digest'] = (stats['digest'] + room_digest(room_id, room)) & DIGEST_MASK
+
+    start = time.perf_counter()
+    for path in paths:
+        with open(path, encoding='utf-8') as log_file:
+            for line in log_file:
+                if not line.endswith('\n') or zlib.crc32(room_key(line).encode()) % shards != shard:
+                    continue
+                _, room_id, event, *args = json.loads(line)
+                stats['events'] += 1
+                if event == 'create':
+                    if room_id in rooms:
+                        finish(room_id)
+                    seed, max_players, decks = args
+                    rooms[room_id] = GameRoom(room_id, seed=seed, headless=True,
+                                              max_players=max_players, decks=decks)
+                    continue
+                room = rooms.get(room_id)
+                if room is None:
+                    # ログの開始前に作られたルーム（前日のファイルなど）
+                    stats['orphaned'] += 1
+                    continue
+                if event == 'expire':
+                    finish(room_id)
+                    continue
+                if not apply_event(room, event, args):
+                    stats['rejected'] += 1
+                if event == 'draw_card' and room.game_phase == 'finished':
+                    stats['games_finished'] += 1
+                if event == 'leave_game' and not room.players:
+                    finish(room_id)
+    for room_id in list(rooms):
+        finish(room_id)
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def replay(paths, workers=None):
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers == 1:
+        results = [replay_shard(paths, 0, 1)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(replay_shard, paths, shard, workers) for shard in range(workers)]
+            results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    report = {'files': list(paths), 'workers': workers, 'seconds': elapsed}
+    for key in ('rooms', 'events', 'rejected', 'orphaned', 'games_finished'):
+        report[key] = sum(result[key] for result in results)
+    report['digest'] = f"{sum(result['digest'] for result in results) & DIGEST_MASK:016x}"
+    report['events_per_second'] = report['events'] / elapsed if elapsed else None
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="イベントログの再生")
+    parser.add_argument('paths', nargs='+', help="イベントログ（古い順に指定）")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--json', help="結果を JSON で保存するパス")
+    args = parser.parse_args(argv)
+
+    report = replay(args.paths, args.workers)
+    print(f"files: {len(report['files'])}  workers: {report['workers']}")
+    print(f"events: {report['events']}  rooms: {report['rooms']}  games finished: {report['games_finished']}")
+    print(f"elapsed: {report['seconds']:.2f}s  ({report['events_per_second']:.0f} events/s)")
+    print(f"rejected: {report['rejected']}  orphaned: {report['orphaned']}  digest: {report['digest']}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as result_file:
+            json.dump(report, result_file, ensure_ascii=False, indent=2)
+    return 1 if report['rejected'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
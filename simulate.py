@@ -0,0 +1,206 @@
+# GameRoom のゲームロジックだけを使って、ババ抜きを大量にヘッドレス実行する。
+# ソケット送信用のペイロード・ログ・履歴は一切作らない（GameRoom(headless=True)）。
+#
+#   python simulate.py --games 100000 --workers 8 --policy random
+#   python simulate.py --games 10000 --policy first,random,last --json result.json
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from game_logic import BotPolicy, DealEngine, GameRoom
+
+SEATS = 3
+MAX_TURNS = 10000
+# サーバーと同じ BOT_POLICY_GAMES で作れば、サーバーのボットと同じ方針表になる
+bot_policy = BotPolicy(int(os.environ.get('BOT_POLICY_GAMES', 200)))
+
+
+def random_policy(source_hand, rng):
+    return rng.randrange(len(source_hand))
+
+
+def first_policy(source_hand, rng):
+    return 0
+
+
+def last_policy(source_hand, rng):
+    return len(source_hand) - 1
+
+
+def table_policy(source_hand, rng):
+    # サーバーのボットと同じ方針表（プロセスごとに最初の1回だけ作る）
+    return bot_policy.choose(len(source_hand), rng)
+
+
+def avoid_joker_policy(source_hand, rng):
+    # 相手の手札を覗けるという前提の上限値の比較用（実際のプレーヤーには不可能）
+    for index, card in enumerate(source_hand):
+        if not card.is_joker:
+            return index
+    return 0
+
+
+DRAW_POLICIES = {
+    'random': random_policy,
+    'first': first_policy,
+    'last': last_policy,
+    'table': table_policy,
+    'avoid_joker': avoid_joker_policy,
+}
+
+
+def play_game(room, player_ids, deck_codes, policies):
+    room.reset_game()
+    room.start_game(deck_codes)
+    room.discard_all_pairs()
+
+    rng = room.rng
+    turns = 0
+    while room.game_phase == 'draw' and turns < MAX_TURNS:
+        position = room.current_player
+        from_position = room.get_next_player_position(position)
+        source_hand = room.get_player_by_position(from_position)['hand']
+        card_index = policies[position](source_hand, rng)
+        room.draw_card(player_ids[position], from_position, card_index)
+        turns += 1
+
+    if room.game_phase != 'finished':
+        return turns, None
+
+    order = [int(name[4:]) for name in room.elimination_order]
+    order += [seat for seat in range(SEATS) if seat not in order]
+    return turns, tuple(order)
+
+
+def run_chunk(seed, games, policy_names):
+    # 方針は名前か、モジュールレベルの関数（プロセスプールへ pickle で渡せるもの）
+    policies = [DRAW_POLICIES.get(name, name) for name in policy_names]
+    room = GameRoom('SIM', seed=seed, headless=True)
+    player_ids = [f"seat{seat}" for seat in range(SEATS)]
+    for player_id in player_ids:
+        room.add_player(player_id, player_id, None)
+
+    lengths = Counter()
+    placements = Counter()
+    stalled = 0
+    start = time.perf_counter()
+    for deck_codes in DealEngine(seed).shuffle_many(games):
+        turns, order = play_game(room, player_ids, deck_codes, policies)
+        if order is None:
+            stalled += 1
+            continue
+        lengths[turns] += 1
+        for place, seat in enumerate(order):
+            placements[(seat, place)] += 1
+    return lengths, placements, stalled, time.perf_counter() - start
+
+
+def simulate(games, policy_names, seed=0, workers=None, chunk_size=2000):
+    workers = workers or os.cpu_count() or 1
+    chunks = []
+    remaining = games
+    while remaining > 0:
+        chunks.append((seed + len(chunks), min(chunk_size, remaining)))
+        remaining -= chunk_size
+
+    lengths = Counter()
+    placements = Counter()
+    stalled = 0
+    start = time.perf_counter()
+    if workers == 1:
+        results = [run_chunk(chunk_seed, count, policy_names) for chunk_seed, count in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_chunk, chunk_seed, count, policy_names)
+                       for chunk_seed, count in chunks]
+            results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    for chunk_lengths, chunk_placements, chunk_stalled, _ in results:
+        lengths.update(chunk_lengths)
+        placements.update(chunk_placements)
+        stalled += chunk_stalled
+    return build_report(games, policy_names, workers, elapsed, lengths, placements, stalled)
+
+
+def percentile(counter, fraction):
+    total = sum(counter.values())
+    threshold = fraction * total
+    seen = 0
+    for value in sorted(counter):
+        seen += counter[value]
+        if seen >= threshold:
+            return value
+    return None
+
+
+def build_report(games, policy_names, workers, elapsed, lengths, placements, stalled):
+    finished = sum(lengths.values())
+    return {
+        'games': games,
+        'finished': finished,
+        'stalled': stalled,
+        'policies': [getattr(name, '__name__', name) for name in policy_names],
+        'workers': workers,
+        'seconds': elapsed,
+        'games_per_second': games / elapsed if elapsed else None,
+        'game_length': {
+            'mean': sum(turns * count for turns, count in lengths.items()) / finished if finished else None,
+            'min': min(lengths) if lengths else None,
+            'p50': percentile(lengths, 0.50),
+            'p95': percentile(lengths, 0.95),
+            'p99': percentile(lengths, 0.99),
+            'max': max(lengths) if lengths else None,
+            'histogram': {str(turns): lengths[turns] for turns in sorted(lengths)},
+        },
+        'finishing_order': {
+            f"seat{seat}": [placements[(seat, place)] / finished if finished else 0 for place in range(SEATS)]
+            for seat in range(SEATS)
+        },
+    }
+
+
+def print_report(report):
+    length = report['game_length']
+    print(f"games: {report['games']}  workers: {report['workers']}  policies: {','.join(report['policies'])}")
+    print(f"elapsed: {report['seconds']:.2f}s  ({report['games_per_second']:.0f} games/s)")
+    print(f"turns: mean {length['mean']:.1f}  min {length['min']}  p50 {length['p50']}  "
+          f"p95 {length['p95']}  p99 {length['p99']}  max {length['max']}")
+    if report['stalled']:
+        print(f"stalled (>{MAX_TURNS} turns): {report['stalled']}")
+    print("finishing order (1st / 2nd / 3rd):")
+    for seat, shares in report['finishing_order'].items():
+        print(f"  {seat}: " + " / ".join(f"{share * 100:5.1f}%" for share in shares))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ババ抜きのヘッドレスシミュレーション")
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--policy', default='random',
+                        help=f"席ごとにカンマ区切りで指定可能: {', '.join(DRAW_POLICIES)}")
+    parser.add_argument('--json', help="結果を JSON で保存するパス")
+    args = parser.parse_args(argv)
+
+    policy_names = args.policy.split(',')
+    if len(policy_names) == 1:
+        policy_names = policy_names * SEATS
+    unknown = [name for name in policy_names if name not in DRAW_POLICIES]
+    if unknown or len(policy_names) != SEATS:
+        parser.error(f"policy は {SEATS} 席分、{', '.join(DRAW_POLICIES)} から指定してください")
+
+    report = simulate(args.games, policy_names, args.seed, args.workers, args.chunk_size)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as result_file:
+            json.dump(report, result_file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())